@@ -0,0 +1,158 @@
+import unittest
+import settestpath
+
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+
+from yum import misc
+from yum import yumRepo
+from yum import Errors
+from yum.repoMDObject import RepoData
+
+def _compress(fname, ztype, data):
+    if ztype == 'gz':
+        fo = gzip.open(fname, 'wb')
+    elif ztype == 'bz2':
+        fo = bz2.BZ2File(fname, 'wb')
+    else:
+        fo = misc.lzma.LZMAFile(fname, 'wb')
+    fo.write(data)
+    fo.close()
+
+class DecompressSumsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-decompress-sums-')
+        os.mkdir(self.tmpdir + '/gen')
+        #  Bigger than one read() in _decompress_chunked_sums(), and not very
+        # compressible.
+        self.data = ''.join(['%d %s\n' % (num, os.urandom(8).encode('hex'))
+                             for num in range(60000)])
+        self.ztypes = [z for z in ('gz', 'bz2', 'xz')
+                       if z in misc._available_compression]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _sums(self, ztype):
+        fname = '%s/primary.sqlite.%s' % (self.tmpdir, ztype)
+        _compress(fname, ztype, self.data)
+        in_sums = misc.Checksums(['sha256', 'md5'])
+        out_sums = misc.Checksums(['sha256'])
+        out = misc.repo_gen_decompress(fname, 'primary-%s.sqlite' % ztype,
+                                       in_sums=in_sums, out_sums=out_sums)
+        return fname, out, in_sums, out_sums
+
+    def testSums(self):
+        for ztype in self.ztypes:
+            fname, out, in_sums, out_sums = self._sums(ztype)
+            self.assertEqual(open(out).read(), self.data)
+            self.assertEqual(in_sums.hexdigest('sha256'),
+                             misc.checksum('sha256', fname))
+            self.assertEqual(in_sums.hexdigest('md5'),
+                             misc.checksum('md5', fname))
+            self.assertEqual(in_sums.length, os.path.getsize(fname))
+            self.assertEqual(out_sums.hexdigest('sha256'),
+                             misc.checksum('sha256', out))
+            self.assertEqual(out_sums.length, len(self.data))
+
+    def testConcatenated(self):
+        # Eg. pbzip2 output, the sums cover all of the streams.
+        fname = self.tmpdir + '/primary.sqlite.bz2'
+        half = len(self.data) / 2
+        data = bz2.compress(self.data[:half]) + bz2.compress(self.data[half:])
+        open(fname, 'wb').write(data)
+        in_sums = misc.Checksums(['sha256'])
+        out_sums = misc.Checksums(['sha256'])
+        out = misc.repo_gen_decompress(fname, 'primary.sqlite',
+                                       in_sums=in_sums, out_sums=out_sums)
+        self.assertEqual(open(out).read(), self.data)
+        self.assertEqual(in_sums.hexdigest(), misc.checksum('sha256', fname))
+        self.assertEqual(out_sums.hexdigest(), misc.checksum('sha256', out))
+
+    def testCurrent(self):
+        # Nothing to decompress, so the sums are left empty.
+        fname, out, in_sums, out_sums = self._sums('gz')
+        in_sums = misc.Checksums(['sha256'])
+        out_sums = misc.Checksums(['sha256'])
+        misc.repo_gen_decompress(fname, 'primary-gz.sqlite',
+                                 in_sums=in_sums, out_sums=out_sums)
+        self.assertEqual(in_sums.length, 0)
+        self.assertEqual(out_sums.length, 0)
+
+    def testCorrupt(self):
+        fname = self.tmpdir + '/primary.sqlite.gz'
+        _compress(fname, 'gz', self.data)
+        # Break the CRC in the gzip trailer.
+        data = open(fname).read()
+        crc = chr(ord(data[-8]) ^ 0xff)
+        open(fname, 'wb').write(data[:-8] + crc + data[-7:])
+        self.assertRaises(Errors.MiscError, misc.repo_gen_decompress,
+                          fname, 'primary.sqlite',
+                          in_sums=misc.Checksums(['sha256']),
+                          out_sums=misc.Checksums(['sha256']))
+        self.assertFalse(os.path.exists(self.tmpdir + '/gen/primary.sqlite'))
+
+class CheckDecompressMDTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-checkdecompress-')
+        self.repo = yumRepo.YumRepository('checkdecompress')
+        self.repo.basecachedir = self.tmpdir
+        self.repo.base_persistdir = self.tmpdir + '/persist'
+        self.repo.dirSetup()
+        self.data = 'some metadata\n' * 10000
+
+        self.fname = self.repo.cachedir + '/primary.sqlite.bz2'
+        _compress(self.fname, 'bz2', self.data)
+        self.out = self.repo.cachedir + '/gen/primary_db.sqlite'
+        plain = self.tmpdir + '/plain'
+        open(plain, 'w').write(self.data)
+
+        self.mddata = RepoData()
+        self.mddata.type = 'primary_db'
+        self.mddata.checksum = ('sha256', misc.checksum('sha256', self.fname))
+        self.mddata.size = str(os.path.getsize(self.fname))
+        self.mddata.openchecksum = ('sha256', misc.checksum('sha256', plain))
+        self.mddata.opensize = str(len(self.data))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check(self):
+        return self.repo._checkDecompressMD(self.fname, 'primary_db',
+                                            'primary_db.sqlite',
+                                            data=self.mddata)
+
+    def testGood(self):
+        self.assertEqual(self._check(), self.out)
+        self.assertEqual(open(self.out).read(), self.data)
+        # Both sums are remembered, so later checks don't reread the files.
+        self.assertEqual(self.repo._getChksum(self.fname, 'sha256'),
+                         self.mddata.checksum[1])
+        self.assertEqual(self.repo._getChksum(self.out, 'sha256'),
+                         self.mddata.openchecksum[1])
+
+    def testBadChecksum(self):
+        self.mddata.checksum = ('sha256', '0' * 64)
+        self.assertEqual(self._check(), None)
+        self.assertFalse(os.path.exists(self.out))
+
+    def testBadSize(self):
+        self.mddata.size = str(int(self.mddata.size) + 1)
+        self.assertEqual(self._check(), None)
+        self.assertFalse(os.path.exists(self.out))
+
+    def testBadOpenChecksum(self):
+        # The file is used, but the open checksum isn't remembered.
+        self.mddata.openchecksum = ('sha256', '0' * 64)
+        self.assertEqual(self._check(), self.out)
+        self.assertEqual(self.repo._getChksum(self.out, 'sha256'), None)
+        self.assertFalse(self.repo._checkMD(self.out, 'primary_db',
+                                            openchecksum=True,
+                                            data=self.mddata,
+                                            check_can_fail=True))
+
+if __name__ == '__main__':
+    unittest.main()
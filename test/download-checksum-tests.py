@@ -0,0 +1,146 @@
+import unittest
+import settestpath
+
+import os
+import shutil
+import tempfile
+
+import urlgrabber.grabber
+from yum import misc
+from yum import yumRepo
+from yum import Errors
+from yum.packages import YumAvailablePackage
+
+class _Meter:
+    def __init__(self):
+        self.calls = []
+    def start(self, *args, **kwargs):
+        self.calls.append('start')
+    def update(self, amount_read, now=None):
+        pass
+    def end(self, amount_read, now=None):
+        self.calls.append('end')
+    def failure(self, message, now=None):
+        self.calls.append('failure')
+
+class _MultiMeter:
+    def __init__(self):
+        self.calls = []
+        self.meters = []
+    def start(self, numfiles=None, total_size=None, now=None):
+        self.calls.append(('start', numfiles, total_size))
+    def end(self, now=None):
+        self.calls.append('end')
+    def newMeter(self):
+        meter = _Meter()
+        self.meters.append(meter)
+        return meter
+    def removeMeter(self, meter):
+        self.calls.append(('remove', meter in self.meters))
+    class re:
+        total = 0
+
+class DownloadChecksumTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-dlcsum-')
+        os.makedirs(self.tmpdir + '/src')
+        self.data = os.urandom(3 * 2**20)
+        self.rpm = self.tmpdir + '/src/foo-1-1.noarch.rpm'
+        open(self.rpm, 'w').write(self.data)
+
+        self.repo = yumRepo.YumRepository('dlcsum')
+        self.repo.basecachedir = self.tmpdir + '/cache'
+        self.repo.base_persistdir = self.tmpdir + '/persist'
+        self.repo.baseurl = ['file://' + self.tmpdir + '/src/']
+        self.repo.copy_local = 1
+        self.repo._async = False
+        self.repo.dirSetup()
+
+        self.po = YumAvailablePackage(self.repo)
+        self.po.relativepath = 'foo-1-1.noarch.rpm'
+        self.po.basepath = None
+        self.po.packagesize = len(self.data)
+        csum = misc.Checksums(['sha256'])
+        csum.update(self.data)
+        self.po.checksum_type = 'sha256'
+        self.po.pkgId = csum.hexdigest()
+
+        # Count how often the whole file is read, to checksum it.
+        self.checksummed = []
+        self._checksum = misc.checksum
+        def checksum(sumtype, fname, *args, **kwargs):
+            self.checksummed.append(fname)
+            return self._checksum(sumtype, fname, *args, **kwargs)
+        misc.checksum = checksum
+
+    def tearDown(self):
+        misc.checksum = self._checksum
+        shutil.rmtree(self.tmpdir)
+
+    def testStreamed(self):
+        meter = _Meter()
+        self.repo.setCallback(meter)
+        local = self.repo.getPackage(self.po)
+        self.assertEqual(open(local).read(), self.data)
+        self.assertEqual(self.checksummed, [])
+        self.assertEqual(meter.calls, ['start', 'end'])
+        self.assertEqual(self.po._checksum_meter, None)
+        self.assertEqual(self.repo._checksum_meter, None)
+        self.assertTrue(self.po.verifyLocalPkg())
+
+    def testAsync(self):
+        multi = _MultiMeter()
+        self.repo.setCallback(_Meter(), multi)
+        done = []
+        def checkfunc(obj):
+            done.append(self.po._checksum_meter is not None)
+            self.assertTrue(self.po.verifyLocalPkg())
+        def failfunc(obj):
+            done.append(obj.exception)
+        self.repo.getPackage(self.po, checkfunc=checkfunc, failfunc=failfunc,
+                             async=True)
+        urlgrabber.grabber.parallel_wait()
+        # The meter was there for checkfunc, and is gone after.
+        self.assertEqual(done, [True])
+        self.assertEqual(self.checksummed, [])
+        self.assertEqual(self.po._checksum_meter, None)
+        # The real meter was used, and was started once.
+        self.assertEqual(multi.calls, [('start', 1, len(self.data)),
+                                       ('remove', True), 'end'])
+        self.assertEqual(multi.meters[0].calls, ['start', 'end'])
+
+    def testAsyncCompat(self):
+        # Without a multi file meter the package is read after.
+        meter = _Meter()
+        self.repo.setCallback(meter)
+        self.repo.getPackage(self.po, failfunc=self.fail, async=True)
+        urlgrabber.grabber.parallel_wait()
+        self.assertEqual(meter.calls, ['start', 'end'])
+        self.assertEqual(self.checksummed, [self.po.localPkg()])
+
+    def testAsyncFailed(self):
+        os.unlink(self.rpm)
+        done = []
+        self.repo.getPackage(self.po, failfunc=done.append, async=True)
+        urlgrabber.grabber.parallel_wait()
+        self.assertEqual(len(done), 1)
+        self.assertEqual(self.po._checksum_meter, None)
+
+    def testResumed(self):
+        local = self.po.localPkg()
+        open(local, 'w').write(self.data[:2**20])
+        self.repo.getPackage(self.po)
+        self.assertEqual(open(local).read(), self.data)
+        self.assertEqual(self.checksummed, [])
+
+    def testBad(self):
+        open(self.rpm, 'w').write(self.data[:-1] + 'X')
+        self.assertRaises(Errors.RepoError, self.repo.getPackage, self.po)
+        self.assertFalse(os.path.exists(self.po.localPkg()))
+
+    def testChanged(self):
+        self.repo.getPackage(self.po)
+        local = self.po.localPkg()
+        open(local, 'a').write('X')
+        self.assertFalse(self.po.verifyLocalPkg())
+        self.assertEqual(set(self.checksummed), set([local]))
@@ -0,0 +1,163 @@
+#! /usr/bin/python -tt
+
+# Do either:
+# ./download-sched-bench.py
+# ./download-sched-bench.py <MB of packages>
+#
+# Starts a few local HTTP servers as stand-in mirrors, each with a throttled
+# bandwidth (shared between all the connections to it), and one of them
+# slowing down part way through. Then downloads the same set of packages (a
+# few big ones, lots of small ones) from them in parallel, like
+# downloadPkgs() does: in name order, biggest first, and biggest first with
+# max_host_connections=1. Needs urlgrabber-ext-down installed.
+
+import sys, os, time, tempfile, shutil, threading, random
+import SocketServer, BaseHTTPServer, SimpleHTTPServer
+
+import urlgrabber.grabber
+from yum import misc
+from yum import yumRepo
+from yum.packages import YumAvailablePackage
+
+# Bytes/sec of each mirror, and after how many seconds (if ever) it drops to
+# a quarter of that.
+_mirrors = ((4 * 2**20, None), (2 * 2**20, None), (4 * 2**20, 1.0))
+_chunk = 16 * 1024
+
+class _Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def translate_path(self, path):
+        return self.server.srcdir + '/' + os.path.basename(path)
+
+    def copyfile(self, src, dst):
+        server = self.server
+        while True:
+            data = src.read(_chunk)
+            if not data:
+                break
+            server.lock.acquire()
+            now = time.time()
+            rate = server.rate
+            if server.slowdown is not None and now > server.slowdown:
+                rate /= 4
+            when = max(now, server.next)
+            server.next = when + float(len(data)) / rate
+            server.lock.release()
+            if when > now:
+                time.sleep(when - now)
+            dst.write(data)
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def _serve(srcdir, rate):
+    server = _Server(('127.0.0.1', 0), _Handler)
+    server.srcdir = srcdir
+    server.lock = threading.Lock()
+    server.rate = rate
+    server.next = 0
+    server.slowdown = None
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def _packages(srcdir, total):
+    """ Write fake packages, totaling about total bytes. A quarter of that
+        is in three big packages, the rest in lots of small ones. """
+    sizes = [total / 12] * 3
+    while sum(sizes) < total:
+        sizes.append(random.randint(50 * 1024, 400 * 1024))
+    # The big ones could be anywhere, in name order.
+    random.shuffle(sizes)
+    pkgs = []
+    for num, size in enumerate(sizes):
+        name = 'pkg%03d-1-1.noarch.rpm' % num
+        data = os.urandom(size)
+        open(srcdir + '/' + name, 'w').write(data)
+        csum = misc.Checksums(['sha256'])
+        csum.update(data)
+        pkgs.append((name, size, csum.hexdigest()))
+    return pkgs
+
+def _run(tmpdir, servers, pkgs, biggest_first, hmc):
+    cachedir = tmpdir + '/cache'
+    if os.path.exists(cachedir):
+        shutil.rmtree(cachedir)
+    # Forget how fast the mirrors were last time.
+    urlgrabber.grabber._TH.hosts.clear()
+    misc.unlink_f(tmpdir + '/timedhosts')
+
+    repo = yumRepo.YumRepository('bench')
+    repo.basecachedir = cachedir
+    repo.base_persistdir = tmpdir + '/persist'
+    repo.baseurl = ['http://127.0.0.1:%d/' % s.server_address[1]
+                    for s in servers]
+    repo.max_host_connections = hmc
+    repo.dirSetup()
+
+    pos = []
+    for (name, size, csum) in pkgs:
+        po = YumAvailablePackage(repo)
+        po.relativepath = name
+        po.basepath = None
+        po.packagesize = size
+        po.checksum_type = 'sha256'
+        po.pkgId = csum
+        pos.append(po)
+    if biggest_first:
+        pos.sort(key=lambda po: -po.size)
+
+    failed = []
+    stime = time.time()
+    for server, (rate, slowdown) in zip(servers, _mirrors):
+        server.next = 0
+        server.slowdown = None
+        if slowdown is not None:
+            server.slowdown = stime + slowdown
+    for po in pos:
+        repo.getPackage(po, async=True,
+                        failfunc=lambda obj, po=po: failed.append(po))
+    urlgrabber.grabber.parallel_wait()
+    return time.time() - stime, len(failed)
+
+def main():
+    if not os.path.exists('/usr/libexec/urlgrabber-ext-down'):
+        print "urlgrabber-ext-down isn't installed, can't download in parallel."
+        sys.exit(1)
+
+    total = 32
+    if len(sys.argv) > 1:
+        total = int(sys.argv[1])
+    total *= 2**20
+
+    random.seed(0)
+    tmpdir = tempfile.mkdtemp(prefix='yum-download-sched-')
+    try:
+        srcdir = tmpdir + '/src'
+        os.makedirs(srcdir)
+        pkgs = _packages(srcdir, total)
+        servers = [_serve(srcdir, rate) for (rate, slowdown) in _mirrors]
+        urlgrabber.grabber.default_grabber.opts.timedhosts = \
+                                                        tmpdir + '/timedhosts'
+        urlgrabber.grabber.default_grabber.opts.max_connections = 6
+
+        print "%d packages, %.1fMB, from %d mirrors (%s MB/s):" % (
+            len(pkgs), total / (1024.0 * 1024), len(servers),
+            ", ".join(["%.1f" % (rate / (1024.0 * 1024))
+                       for (rate, slowdown) in _mirrors]))
+        for (name, biggest_first, hmc) in (("name order", False, 0),
+                                          ("biggest first", True, 0),
+                                          ("biggest first, 1/host", True, 1)):
+            secs, failed = _run(tmpdir, servers, pkgs, biggest_first, hmc)
+            print "  %-24s %8.2fs" % (name, secs),
+            if failed:
+                print "(%d failed)" % failed,
+            print
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
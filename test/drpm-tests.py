@@ -0,0 +1,175 @@
+import unittest
+import settestpath
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from urlgrabber import grabber
+from yum import drpm
+
+class _FakeConf:
+    deltarpm = 0 # Don't look at any metadata
+    deltarpm_adaptive = True
+
+class _FakeYum:
+    def __init__(self, cachedir):
+        self.verbose_logger = logging.getLogger("yum.verbose.drpmtests")
+        self.conf = _FakeConf()
+        self.conf.cachedir = cachedir
+
+class _FakeRepo:
+    pkgdir = '/nonexistent'
+    urls = []
+
+class _FakePackage:
+    def __init__(self, size):
+        self.repo = _FakeRepo()
+        self.basepath = None
+        self.pkgtup = ('foo', 'noarch', '0', '1', '1')
+        self.localpath = '/tmp/foo-1-1.noarch.rpm'
+        self.size = size
+
+    def verifyLocalPkg(self):
+        return True
+
+class RebuildRateTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-drpm-')
+        self.filename = self.tmpdir + '/rate'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testUnknown(self):
+        rate = drpm.RebuildRate(self.filename)
+        self.assertEqual(rate.estimate(1000), None)
+        rate.save()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def testUpdate(self):
+        rate = drpm.RebuildRate(self.filename)
+        rate.update(1000, 2.0)
+        self.assertEqual(rate.estimate(1000), 2.0)
+        rate.update(1000, 4.0)
+        self.assertAlmostEqual(rate.estimate(1000), 2.6)
+        rate.save()
+
+        rate = drpm.RebuildRate(self.filename)
+        self.assertAlmostEqual(rate.estimate(1000), 2.6)
+
+    def testStale(self):
+        rate = drpm.RebuildRate(self.filename)
+        rate.update(1000, 2.0)
+        self.assertFalse(rate.stale())
+        rate.save()
+        rate = drpm.RebuildRate(self.filename)
+        self.assertFalse(rate.stale())
+        rate.timestamp -= 2 * 24 * 60 * 60
+        self.assertTrue(rate.stale())
+
+    def testBadFile(self):
+        open(self.filename, 'w').write('blah\n')
+        self.assertEqual(drpm.RebuildRate(self.filename).rate, None)
+        open(self.filename, 'w').write('-1\n')
+        self.assertEqual(drpm.RebuildRate(self.filename).rate, None)
+
+class ChooseTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-drpm-')
+        self.presto = drpm.DeltaInfo(_FakeYum(self.tmpdir), [], None)
+        self.po = _FakePackage(10 * 1000 * 1000)
+        self.dpo = drpm.DeltaPackage(self.po, 1000 * 1000, 'foo.drpm',
+                                     ('sha256', ''), None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _choose(self, speed):
+        pkgs = [self.dpo]
+        self.presto._choose(pkgs, 0, speed)
+        return pkgs[0]
+
+    def testNoRate(self):
+        self.assertTrue(self._choose(1e6) is self.dpo)
+        self.assertEqual(self.dpo.rebuild_est, None)
+
+    def testSlowMirror(self):
+        # 1 sec/MB rebuilding, 1MB/s downloads: 1 + 10 secs vs. 10 secs
+        self.presto.rebuild_rate.update(1000 * 1000, 1.0)
+        self.assertTrue(self._choose(1e6) is self.po)
+        self.assertTrue(self._choose(1e6) is self.po)
+        # 0.1 sec/MB rebuilding: 1 + 1 secs vs. 10 secs
+        self.presto.rebuild_rate.rate = 1e-7
+        self.assertTrue(self._choose(1e6) is self.dpo)
+        self.assertAlmostEqual(self.dpo.rebuild_est, 1.0)
+
+    def testFastMirror(self):
+        # 0.1 sec/MB rebuilding, 100MB/s downloads: 1.01 secs vs. 0.1 secs
+        self.presto.rebuild_rate.update(1000 * 1000, 0.1)
+        self.assertTrue(self._choose(1e8) is self.po)
+
+    def testRecheck(self):
+        # The full rpm is faster, but we haven't timed a rebuild for a while.
+        self.presto.rebuild_rate.update(1000 * 1000, 1.0)
+        self.presto.rebuild_rate.timestamp -= 2 * 24 * 60 * 60
+        self.assertTrue(self._choose(1e6) is self.dpo)
+        # Just the one.
+        self.assertTrue(self._choose(1e6) is self.po)
+
+    def testDownloadSpeed(self):
+        hosts = grabber._TH.hosts.copy()
+        try:
+            grabber._TH.load()
+            grabber._TH.hosts.clear()
+            self.po.repo.urls = ['http://known.example.com/repo/',
+                                 'http://unknown.example.com/repo/']
+            self.assertEqual(drpm._download_speed(self.po.repo), None)
+            grabber._TH.hosts['known.example.com'] = (5000, 0, time.time())
+            speed = drpm._download_speed(self.po.repo)
+            self.assertTrue(4900 < speed < 5100)
+        finally:
+            grabber._TH.hosts.clear()
+            grabber._TH.hosts.update(hosts)
+
+    def _spawn(self, *args):
+        pid = os.spawnl(os.P_NOWAIT, args[0], *args)
+        self.presto.jobs[pid] = self.dpo
+        self.dpo.rebuild_start = time.time()
+
+    def testWaitTimed(self):
+        self._spawn('/bin/sleep', '0.2')
+        self.presto.wait()
+        est = self.presto.rebuild_rate.estimate(self.po.size)
+        self.assertTrue(0.2 <= est < 1)
+
+    def testReapedLater(self):
+        # It exited before we waited, so we don't know how long it took.
+        self._spawn('/bin/true')
+        time.sleep(0.2)
+        self.presto.wait()
+        self.assertEqual(self.presto.rebuild_rate.estimate(self.po.size), None)
+        self._spawn('/bin/true')
+        time.sleep(0.2)
+        self.presto._wait()
+        self.assertEqual(self.presto.jobs, {})
+        self.assertEqual(self.presto.rebuild_rate.estimate(self.po.size), None)
+
+    def testRebuiltCallback(self):
+        rebuilt = []
+        self.presto.rebuilt = rebuilt.append
+        self._spawn('/bin/false')
+        self.presto.adderror = lambda po, msg: None
+        self.presto.wait()
+        self.assertEqual(rebuilt, [])
+        self._spawn('/bin/true')
+        self.presto.wait()
+        self.assertEqual(rebuilt, [self.po])
+
+    def testRebuilt(self):
+        self.presto._rebuilt(self.dpo, 2000.0) # Very slow
+        self.presto.rebuild_rate.save()
+        rate = drpm.RebuildRate(self.tmpdir + '/deltarpm-rebuild-rate')
+        self.assertTrue(rate.estimate(self.po.size) > 1000)
@@ -0,0 +1,183 @@
+import unittest
+import settestpath
+
+import os
+import shutil
+import tempfile
+
+from urlgrabber.grabber import URLGrabber
+from yum import httpvalidators
+from yum import repoMDObject
+from yum import yumRepo
+from testbase import TestHTTPServer
+
+_repomd = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+ <revision>%s</revision>
+ <data type="primary">
+  <checksum type="sha256">dddd</checksum>
+  <location href="repodata/primary.xml.gz"/>
+  <timestamp>1400000001</timestamp>
+ </data>
+</repomd>
+"""
+
+class _ServerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-httpvalidators-')
+        self.srv = TestHTTPServer()
+        self.url = self.srv.url
+
+    def tearDown(self):
+        self.srv.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _serve(self, path, data):
+        self.srv.serve(path, data)
+
+    def _conditional(self):
+        """ Return if the last request was conditional. """
+        return self.srv.requests[-1][1] != (None, None)
+
+class URLGrabIfModifiedTests(_ServerTests):
+    def setUp(self):
+        _ServerTests.setUp(self)
+        self.fname = self.tmpdir + '/validators.txt'
+        self.local = self.tmpdir + '/file'
+        self.tmp = self.local + '.tmp'
+        self._serve('/file', 'data1')
+
+    def _grab(self):
+        validators = httpvalidators.HTTPValidators(self.fname)
+        ret = httpvalidators.urlgrab_if_modified(URLGrabber(),
+                                                 self.url + '/file', self.tmp,
+                                                 self.local, validators)
+        validators.save()
+        if ret is not None:
+            os.rename(ret, self.local)
+        return ret
+
+    def testNotModified(self):
+        self.assertEqual(self._grab(), self.tmp)
+        self.assertFalse(self._conditional())
+        self.assertEqual(self._grab(), None)
+        self.assertTrue(self._conditional())
+        self.assertFalse(os.path.exists(self.tmp))
+        self.assertEqual(open(self.local).read(), 'data1')
+
+    def testModified(self):
+        self._grab()
+        self._serve('/file', 'data2')
+        self.assertEqual(self._grab(), self.tmp)
+        self.assertTrue(self._conditional())
+        self.assertEqual(open(self.local).read(), 'data2')
+        self.assertEqual(self._grab(), None)
+
+    def testLocalChanged(self):
+        self._grab()
+        open(self.local, 'w').write('other')
+        self.assertEqual(self._grab(), self.tmp)
+        self.assertFalse(self._conditional())
+        os.unlink(self.local)
+        self.assertEqual(self._grab(), self.tmp)
+        self.assertFalse(self._conditional())
+
+class RepoRevalidateTests(_ServerTests):
+    def setUp(self):
+        _ServerTests.setUp(self)
+        self.repo = yumRepo.YumRepository('revalidatetest')
+        self.repo.basecachedir = self.tmpdir
+        self.repo.base_persistdir = self.tmpdir + '/persist'
+        self.repo.baseurl = [self.url + '/repo/']
+        self.repo.mirrorlist = self.url + '/mirrorlist'
+        self.repo.mirrorlist_expire = 0
+        self.repo.repo_gpgcheck = False
+        self.local = self.repo.cachedir + '/repomd.xml'
+        self._serve('/repo/repodata/repomd.xml', _repomd % '1')
+        self._serve('/mirrorlist', self.url + '/repo/\n')
+
+    def _repomd(self):
+        st = os.stat(self.local)
+        ret = self.repo._getFileRepoXML(self.local)
+        self.assertEqual(ret, self.local)
+        return os.stat(self.local).st_ino != st.st_ino
+
+    def testRepoXML(self):
+        open(self.local, 'w').write('old')
+        self.assertTrue(self._repomd())
+        self.assertFalse(self._conditional())
+        self.assertFalse(self._repomd())
+        self.assertTrue(self._conditional())
+        self._serve('/repo/repodata/repomd.xml', _repomd % '2')
+        self.assertTrue(self._repomd())
+        self.assertEqual(self.repo._parseRepoXML(self.local).revision, '2')
+
+    def testMirrorList(self):
+        self.assertEqual(self.repo._getMirrorList(), [self.url + '/repo/'])
+        self.assertFalse(self._conditional())
+        fname = self.repo.mirrorlist_file
+        st = os.stat(fname)
+        os.utime(fname, (st.st_atime - 100, st.st_mtime - 100))
+        self.assertEqual(self.repo._getMirrorList(), [self.url + '/repo/'])
+        self.assertTrue(self._conditional())
+        nst = os.stat(fname)
+        self.assertEqual(nst.st_ino, st.st_ino)
+        self.assertTrue(nst.st_mtime > st.st_mtime - 100)
+
+    def testDisabled(self):
+        self.repo.http_revalidate = False
+        open(self.local, 'w').write('old')
+        self.assertTrue(self._repomd())
+        self.assertTrue(self._repomd())
+        self.assertFalse(self._conditional())
+        self.assertFalse(os.path.exists(self.repo.cachedir + '/validators.txt'))
+
+class _FakeMetalink:
+    """ Metalink data for the repomd.xml in fname, served by the mirrors. """
+    def __init__(self, fname, mirrors):
+        repoXML = repoMDObject.RepoMD('metalinktest', fname)
+        self.repomd = self
+        self.timestamp = repoXML.timestamp
+        self.size = repoXML.length
+        self.chksums = repoXML.checksums
+        self.old_repomds = []
+        self.mirrors = mirrors
+        self._host2mc = {}
+
+    def urls(self):
+        return self.mirrors
+
+class RepoMetalinkRevalidateTests(_ServerTests):
+    def setUp(self):
+        _ServerTests.setUp(self)
+        self.repo = yumRepo.YumRepository('metalinktest')
+        self.repo.basecachedir = self.tmpdir
+        self.repo.base_persistdir = self.tmpdir + '/persist'
+        self.repo.metalink = self.url + '/metalink'
+        self.repo.failovermethod = 'priority' # The stale mirror is first
+        self.repo.repo_gpgcheck = False
+        self.local = self.repo.cachedir + '/repomd.xml'
+        self.mirrors = [self.url + '/stale/', self.url + '/repo/']
+        self._serve('/stale/repodata/repomd.xml', _repomd % '1')
+        self._serve('/repo/repodata/repomd.xml', _repomd % '2')
+
+    def _metalink(self, revision):
+        fname = self.tmpdir + '/repomd.%s.xml' % revision
+        open(fname, 'w').write(_repomd % revision)
+        self.repo._metalink = _FakeMetalink(fname, self.mirrors)
+
+    def testStaleMirror(self):
+        self._metalink('1')
+        self.assertEqual(self.repo._getFileRepoXML(self.local), self.local)
+        self.assertEqual(self.repo._parseRepoXML(self.local).revision, '1')
+
+        #  The first mirror says our repomd.xml is current, but the metalink
+        # doesn't match it, so the next mirror is used.
+        self._metalink('2')
+        self.assertEqual(self.repo._getFileRepoXML(self.local), self.local)
+        self.assertEqual(self.srv.requests[1][:2],
+                         ('/stale/repodata/repomd.xml', ('"v1"',
+                          'Mon, 01 Jan 2024 00:00:00 GMT')))
+        self.assertEqual(self.srv.requests[-1][0],
+                         '/repo/repodata/repomd.xml')
+        self.assertEqual(self.repo._parseRepoXML(self.local).revision, '2')
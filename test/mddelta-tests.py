@@ -0,0 +1,248 @@
+import unittest
+import settestpath
+
+import os
+import bz2
+import shutil
+import tempfile
+
+from yum import mddelta
+from yum import misc
+from yum import yumRepo
+from yum.repoMDObject import RepoData
+from yum.Errors import MiscError
+from yum.sqlutils import sqlite
+
+_schema = """
+CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT,
+    arch TEXT, version TEXT, epoch TEXT, release TEXT);
+CREATE TABLE provides (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER);
+CREATE TABLE files (name TEXT, type TEXT, pkgKey INTEGER);
+CREATE INDEX packagename ON packages (name);
+CREATE INDEX pkgprovides ON provides (pkgKey);
+CREATE INDEX pkgfiles ON files (pkgKey);
+"""
+
+def _mkdb(fname, pkgs, checksum='old'):
+    """ Create a primary like DB with pkgs, a list of (name, version). """
+    conn = sqlite.connect(fname)
+    conn.executescript(_schema)
+    conn.execute("INSERT INTO db_info VALUES (10, ?)", (checksum,))
+    for (num, (name, ver)) in enumerate(pkgs):
+        pkgKey = (num + 1) * 7 # Don't match between DBs
+        pkgId = misc.Checksums(['sha256'])
+        pkgId.update("%s-%s" % (name, ver))
+        conn.execute("INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (pkgKey, pkgId.hexdigest(), name, 'noarch', ver, '0', '1'))
+        conn.execute("INSERT INTO provides VALUES (?, ?, ?, ?, ?, ?)",
+                     (name, 'EQ', '0', ver, '1', pkgKey))
+        conn.execute("INSERT INTO provides VALUES (?, ?, ?, ?, ?, ?)",
+                     ('lib%s.so' % name, None, None, None, None, pkgKey))
+        conn.execute("INSERT INTO files VALUES (?, ?, ?)",
+                     ('/usr/bin/' + name, 'file', pkgKey))
+    conn.commit()
+    conn.close()
+
+def _contents(fname):
+    """ Return the data in the DB, without the pkgKeys. """
+    conn = sqlite.connect(fname)
+    ret = []
+    for table in ('packages', 'provides', 'files'):
+        sql = """SELECT * FROM %s JOIN packages USING (pkgKey)
+                 ORDER BY packages.pkgId""" % table
+        if table == 'packages':
+            sql = "SELECT * FROM packages ORDER BY pkgId"
+        for row in conn.execute(sql):
+            ret.append(sorted([x for x in row if not isinstance(x, int)]))
+    ret.append(list(conn.execute("SELECT * FROM db_info")))
+    conn.close()
+    ret.sort()
+    return ret
+
+class MDDeltaTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-mddelta-')
+        self.old = self.tmpdir + '/old.sqlite'
+        self.new = self.tmpdir + '/new.sqlite'
+        self.delta = self.tmpdir + '/delta.sqlite'
+        self.out = self.tmpdir + '/out.sqlite'
+        _mkdb(self.old, [('a', '1'), ('b', '1'), ('c', '1')])
+        _mkdb(self.new, [('b', '1'), ('c', '2'), ('d', '1')], 'new')
+        mddelta.create(self.old, self.new, self.delta)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testApply(self):
+        mddelta.apply(self.old, self.delta, self.out)
+        self.assertEqual(_contents(self.out), _contents(self.new))
+
+    def testApplyAgain(self):
+        mddelta.apply(self.old, self.delta, self.out)
+        mddelta.apply(self.out, self.delta, self.out + '2')
+        self.assertEqual(_contents(self.out + '2'), _contents(self.new))
+
+    def testApplyToNewerBase(self):
+        # Already has d, and not a.
+        mid = self.tmpdir + '/mid.sqlite'
+        _mkdb(mid, [('b', '1'), ('c', '1'), ('d', '1')])
+        mddelta.apply(mid, self.delta, self.out)
+        self.assertEqual(_contents(self.out), _contents(self.new))
+
+    def testApplyToWrongBase(self):
+        # Has a package the delta doesn't know about, so can't get to new.
+        other = self.tmpdir + '/other.sqlite'
+        _mkdb(other, [('a', '1'), ('b', '1'), ('c', '1'), ('e', '1')])
+        self.assertRaises(MiscError,
+                          mddelta.apply, other, self.delta, self.out)
+        self.assertFalse(os.path.exists(self.out))
+
+    def testBadChecksum(self):
+        conn = sqlite.connect(self.delta)
+        conn.execute("UPDATE delta_info SET pkgids_checksum = 'bad'")
+        conn.commit()
+        conn.close()
+        self.assertRaises(MiscError,
+                          mddelta.apply, self.old, self.delta, self.out)
+        self.assertFalse(os.path.exists(self.out))
+
+    def testBadData(self):
+        # The right packages, but not the right data for them.
+        conn = sqlite.connect(self.delta)
+        conn.execute("UPDATE files SET name = '/usr/bin/bad'")
+        conn.commit()
+        conn.close()
+        self.assertRaises(MiscError,
+                          mddelta.apply, self.old, self.delta, self.out)
+        self.assertFalse(os.path.exists(self.out))
+
+    def testOldDelta(self):
+        # Deltas without a content_checksum can't be checked, so aren't used.
+        conn = sqlite.connect(self.delta)
+        conn.execute("CREATE TABLE info2 (pkgids_checksum TEXT, "
+                     "packages INTEGER)")
+        conn.execute("INSERT INTO info2 SELECT pkgids_checksum, packages "
+                     "FROM delta_info")
+        conn.execute("DROP TABLE delta_info")
+        conn.execute("ALTER TABLE info2 RENAME TO delta_info")
+        conn.commit()
+        conn.close()
+        self.assertRaises(MiscError,
+                          mddelta.apply, self.old, self.delta, self.out)
+
+    def testContentChecksum(self):
+        mddelta.apply(self.old, self.delta, self.out)
+        sums = []
+        for fname in (self.new, self.out, self.old):
+            conn = sqlite.connect(fname)
+            sums.append(mddelta.content_checksum(conn.cursor()))
+            conn.close()
+        self.assertEqual(sums[0], sums[1])
+        self.assertNotEqual(sums[0], sums[2])
+
+    def testNotDelta(self):
+        self.assertRaises(MiscError,
+                          mddelta.apply, self.old, self.new, self.out)
+        self.assertFalse(os.path.exists(self.out))
+
+
+class _GrabObj:
+    pass
+
+class _DeltaRepo(yumRepo.YumRepository):
+    """ A repo. where _getFile() copies files from srcdir. """
+    def _getFile(self, relative=None, local=None, checkfunc=None, **kwargs):
+        self.downloaded.append(relative)
+        shutil.copy2(os.path.join(self.srcdir, relative), local)
+        obj = _GrabObj()
+        obj.filename = local
+        checkfunc(obj)
+        return local
+
+def _repodata(fname, relative, timestamp):
+    data = RepoData()
+    data.type = 'primary_db'
+    data.location = (None, relative)
+    data.timestamp = timestamp
+    data.checksum = ('sha256', misc.checksum('sha256', fname))
+    data.size = str(os.path.getsize(fname))
+    return data
+
+class RepoDeltaTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-mddelta-')
+        self.srcdir = self.tmpdir + '/src'
+        os.makedirs(self.srcdir + '/repodata')
+        self.repo = _DeltaRepo('deltatest')
+        self.repo.basecachedir = self.tmpdir + '/cache'
+        self.repo.base_persistdir = self.tmpdir + '/persist'
+        self.repo.srcdir = self.srcdir
+        self.repo.downloaded = []
+        self.repo.metadata_deltas = True
+        if not os.path.exists(self.repo.cachedir + '/gen'):
+            os.makedirs(self.repo.cachedir + '/gen')
+        self.gen = self.repo.cachedir + '/gen/primary_db.sqlite'
+
+        old = self.srcdir + '/old.sqlite'
+        new = self.srcdir + '/new.sqlite'
+        delta = self.srcdir + '/delta.sqlite'
+        _mkdb(old, [('a', '1'), ('b', '1')])
+        _mkdb(new, [('b', '1'), ('c', '1')], 'new')
+        mddelta.create(old, new, delta)
+        self.odata = _repodata(old, 'repodata/old-primary.sqlite.bz2', '100')
+        self.odata.openchecksum = self.odata.checksum
+        self.ndata = _repodata(new, 'repodata/new-primary.sqlite.bz2', '200')
+        self.new = new
+
+        fname = self.srcdir + '/repodata/delta-primary.sqlite.bz2'
+        open(fname, 'w').write(bz2.compress(open(delta).read()))
+        self.ndata.deltas = [_repodata(fname, 'repodata/delta-primary.sqlite.bz2',
+                                       '100')]
+
+        shutil.copy2(old, self.gen)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testDelta(self):
+        self.assertFalse(self.repo._deltaMDValid(self.ndata, 'primary_db'))
+        self.assertTrue(self.repo._retrieveDeltaMD(self.odata, self.ndata,
+                                                   'primary_db'))
+        self.assertEqual(self.repo.downloaded,
+                         ['repodata/delta-primary.sqlite.bz2'])
+        self.assertEqual(_contents(self.gen), _contents(self.new))
+        self.assertEqual(self.repo._deltaMDValid(self.ndata, 'primary_db'),
+                         self.gen)
+        self.assertFalse(self.repo._deltaMDValid(self.odata, 'primary_db'))
+        # Don't leave the delta around.
+        self.assertEqual(sorted(os.listdir(self.repo.cachedir + '/gen')),
+                         ['primary_db.sqlite', 'primary_db.sqlite.delta'])
+
+    def testNoDeltaForBase(self):
+        self.ndata.deltas[0].timestamp = '150'
+        self.assertFalse(self.repo._retrieveDeltaMD(self.odata, self.ndata,
+                                                    'primary_db'))
+        self.assertEqual(self.repo.downloaded, [])
+
+    def testOldDBChanged(self):
+        _mkdb(self.gen + '.x', [('a', '1')])
+        os.rename(self.gen + '.x', self.gen)
+        self.assertFalse(self.repo._retrieveDeltaMD(self.odata, self.ndata,
+                                                    'primary_db'))
+        self.assertEqual(self.repo.downloaded, [])
+
+    def testBadDeltaChecksum(self):
+        self.ndata.deltas[0].checksum = ('sha256', '0' * 64)
+        old = _contents(self.gen)
+        self.assertFalse(self.repo._retrieveDeltaMD(self.odata, self.ndata,
+                                                    'primary_db'))
+        self.assertEqual(_contents(self.gen), old)
+        self.assertFalse(self.repo._deltaMDValid(self.ndata, 'primary_db'))
+
+    def testDisabled(self):
+        self.repo.metadata_deltas = False
+        self.assertFalse(self.repo._retrieveDeltaMD(self.odata, self.ndata,
+                                                    'primary_db'))
+        self.assertEqual(self.repo.downloaded, [])
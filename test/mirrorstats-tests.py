@@ -0,0 +1,143 @@
+import unittest
+import settestpath
+
+import os
+import time
+import shutil
+import tempfile
+
+import urlgrabber.grabber
+from urlgrabber.grabber import URLGrabber, URLGrabError
+from yum import mirrorstats
+from testbase import TestHTTPServer
+
+def _server(delay):
+    """ Serves a small file after delay, or an error if delay is None. """
+    srv = TestHTTPServer()
+    srv.serve('/file', 'data')
+    if delay is None:
+        srv.error = 500
+    else:
+        srv.delay = delay
+    return srv
+
+class MirrorStatsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-mirrorstats-')
+        self.fname = self.tmpdir + '/mirrorstats.txt'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testScore(self):
+        stats = mirrorstats.MirrorStats(self.fname)
+        stats.success('http://fast/', 100, 0.01)
+        stats.success('http://slow/', 100, 0.5)
+        stats.success('http://big/', 10 * 1024 * 1024, 1.0)
+        self.assertTrue(stats.score('http://fast/') <
+                        stats.score('http://unknown/') <
+                        stats.score('http://slow/'))
+        self.assertTrue(stats.score('http://big/') <
+                        stats.score('http://unknown/'))
+        stats.failure('http://fast/')
+        stats.failure('http://fast/')
+        self.assertTrue(stats.score('http://fast/') >
+                        stats.score('http://unknown/'))
+
+    def testSave(self):
+        stats = mirrorstats.MirrorStats(self.fname)
+        stats.success('http://fast/', 100, 0.01)
+        stats.failure('http://broken/')
+        self.assertTrue(stats.save())
+        nstats = mirrorstats.MirrorStats(self.fname)
+        for mirror in ('http://fast/', 'http://broken/', 'http://unknown/'):
+            self.assertAlmostEqual(stats.score(mirror), nstats.score(mirror), 3)
+
+    def testDecay(self):
+        stats = mirrorstats.MirrorStats(self.fname)
+        stats.success('http://slow/', 100, 5.0)
+        stats.failure('http://slow/')
+        unknown = stats.score('http://unknown/')
+        self.assertTrue(stats.score('http://slow/') > unknown * 10)
+        (latency, speed, failures, ts) = stats.mirrors['http://slow/']
+        ts -= mirrorstats._half_life * 20
+        stats.mirrors['http://slow/'] = (latency, speed, failures, ts)
+        self.assertAlmostEqual(stats.score('http://slow/'), unknown, 3)
+
+
+class MGFastestTests(unittest.TestCase):
+    """ Mirrors with different delays, and a broken one, are ranked by their
+        speed after a few "runs" each doing one download. """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-mirrorstats-')
+        self.fname = self.tmpdir + '/mirrorstats.txt'
+        self.servers = {}
+        for (name, delay) in (('broken', None), ('slow', 0.4),
+                              ('medium', 0.2), ('fast', 0.0)):
+            self.servers[name] = _server(delay)
+        self.mirrors = []
+        self.names = {}
+        for name in ('broken', 'slow', 'medium', 'fast'):
+            url = 'http://127.0.0.1:%d/' % self.servers[name].server_address[1]
+            self.mirrors.append(url)
+            self.names[url] = name
+
+    def tearDown(self):
+        for srv in self.servers.values():
+            srv.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self):
+        """ Like a yum run, load the stats, download and save them. Returns
+            the order of the mirrors used. """
+        stats = mirrorstats.MirrorStats(self.fname)
+        def failure(obj):
+            stats.failure(obj.mirror)
+        mg = mirrorstats.MGFastest(URLGrabber(retry=1), self.mirrors,
+                                   failure_callback=failure, stats=stats)
+        order = [self.names[mirror['mirror']] for mirror in mg.mirrors]
+        mg.urlgrab('file', self.tmpdir + '/file')
+        stats.save()
+        return order
+
+    def testRanking(self):
+        self.assertEqual(self._run(), ['broken', 'slow', 'medium', 'fast'])
+        self.assertEqual(len(self.servers['broken'].requests), 1)
+        self.assertEqual(len(self.servers['slow'].requests), 1)
+        # Unknown mirrors are tried before the slow one, then we know.
+        self.assertEqual(self._run(), ['medium', 'fast', 'slow', 'broken'])
+        self.assertEqual(self._run(), ['fast', 'medium', 'slow', 'broken'])
+        self.assertEqual(self._run(), ['fast', 'medium', 'slow', 'broken'])
+        self.assertEqual(len(self.servers['fast'].requests), 2)
+
+    def testAsync(self):
+        # Async downloads are timed too, once checkfunc says they're good.
+        stats = mirrorstats.MirrorStats(self.fname)
+        mirrors = [m for m in self.mirrors if self.names[m] == 'medium']
+        mg = mirrorstats.MGFastest(URLGrabber(retry=1), mirrors, stats=stats)
+        checked = []
+        done = []
+        mg.urlgrab('file', self.tmpdir + '/file', async=True,
+                   checkfunc=checked.append, failfunc=done.append)
+        urlgrabber.grabber.parallel_wait()
+        self.assertEqual(len(checked), 1)
+        self.assertEqual(done, [])
+        (latency, speed, failures) = stats.get(mirrors[0])
+        self.assertTrue(0.2 <= latency < 1)
+
+        # A download checkfunc doesn't like isn't a success.
+        def bad(obj):
+            raise URLGrabError(-1, 'bad')
+        stats = mirrorstats.MirrorStats(self.fname)
+        mg = mirrorstats.MGFastest(URLGrabber(retry=1), mirrors, stats=stats)
+        mg.urlgrab('file', self.tmpdir + '/file', async=True,
+                   checkfunc=bad, failfunc=done.append)
+        urlgrabber.grabber.parallel_wait()
+        self.assertEqual(len(done), 1)
+        self.assertEqual(stats.mirrors, {})
+
+    def testNoStats(self):
+        mg = mirrorstats.MGFastest(URLGrabber(), self.mirrors)
+        self.assertEqual([mirror['mirror'] for mirror in mg.mirrors],
+                         self.mirrors)
@@ -0,0 +1,130 @@
+#! /usr/bin/python -tt
+
+# Do either:
+# ./repomd-manifest-bench.py
+# ./repomd-manifest-bench.py <num repos>
+#
+# Creates repomd.xml and metalink.xml files for a lot of fake repos. (50 by
+# default), and times loading them all and checking each repomd.xml against
+# its metalink, as repo. setup does: parsing the XML every time, the first
+# run with repomd_manifest (parsing and adding to the manifest), and later
+# runs loading everything from the manifest.
+
+import sys, os, time, tempfile, shutil, gc
+from yum import yumRepo
+
+_mdtypes = ('primary', 'filelists', 'other', 'group', 'updateinfo',
+            'prestodelta', 'pkgtags')
+
+def _repomd(num):
+    data = []
+    for mdtype in _mdtypes:
+        for db in ('', '_db'):
+            data.append("""\
+ <data type="%(type)s%(db)s">
+  <checksum type="sha256">%(sum)s</checksum>
+  <open-checksum type="sha256">%(sum)s</open-checksum>
+  <location href="repodata/%(sum)s-%(type)s%(db)s.xml.gz"/>
+  <timestamp>1400000000</timestamp>
+  <size>%(num)d000</size>
+  <open-size>%(num)d0000</open-size>
+  <database_version>10</database_version>
+ </data>
+""" % {'type' : mdtype, 'db' : db, 'num' : num,
+       'sum' : '%064x' % (num * 100 + len(data))})
+    return """\
+<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+ <revision>%d</revision>
+ <tags>
+  <content>binary-x86_64</content>
+  <distro cpeid="cpe:/o:fedoraproject:fedora:20">Fedora 20</distro>
+ </tags>
+%s</repomd>
+""" % (1400000000 + num, ''.join(data))
+
+def _metalink(repomd, num):
+    urls = []
+    for i in range(60):
+        for proto in ('http', 'https', 'rsync'):
+            urls.append('    <url protocol="%s" type="%s" location="US" '
+                        'preference="%d">%s://mirror%d.example.com/repo%d/'
+                        'repodata/repomd.xml</url>\n' %
+                        (proto, proto, 100 - i, proto, i, num))
+    return """\
+<?xml version="1.0" encoding="utf-8"?>
+<metalink version="3.0" xmlns="http://www.metalinker.org/" type="dynamic" xmlns:mm0="http://fedorahosted.org/mirrormanager">
+ <files>
+  <file name="repomd.xml">
+   <mm0:timestamp>%d</mm0:timestamp>
+   <size>%d</size>
+   <verification>
+%s   </verification>
+   <resources maxconnections="1">
+%s   </resources>
+  </file>
+ </files>
+</metalink>
+""" % (repomd.timestamp, repomd.length,
+       ''.join(['    <hash type="%s">%s</hash>\n' % (sumtype, csum)
+                for (sumtype, csum) in sorted(repomd.checksums.items())]),
+       ''.join(urls))
+
+def _make_repos(tmpdir, num):
+    repos = []
+    for i in range(num):
+        repo = yumRepo.YumRepository('bench%d' % i)
+        repo.basecachedir = tmpdir
+        repo.base_persistdir = tmpdir + '/persist'
+        repo.metalink = 'http://example.com/metalink?repo=bench%d' % i
+        local = repo.cachedir + '/repomd.xml'
+        open(local, 'w').write(_repomd(i))
+        repomd = repo._parseRepoXML(local)
+        open(repo.cachedir + '/metalink.xml', 'w').write(_metalink(repomd, i))
+        repos.append(repo)
+    return repos
+
+def _load(repos):
+    ret = []
+    for repo in repos:
+        repomd = repo._parseRepoXML(repo.cachedir + '/repomd.xml')
+        ml = repo._parseMetalink(repo.cachedir + '/metalink.xml')
+        assert repo._checkRepoXMLMetalink(repomd, ml.repomd)
+        ret.append(ml)
+    return ret
+
+def _time(repos, manifest, new_process=True):
+    for repo in repos:
+        repo.repomd_manifest = manifest
+    if new_process:
+        yumRepo._repomd_manifests.clear()
+    gc.collect()
+    stime = time.time()
+    mls = _load(repos)
+    ret = (time.time() - stime) * 1000
+    for ml in mls:
+        assert len(list(ml.urls())) == 60
+    return ret
+
+def main():
+    num = 50
+    if len(sys.argv) > 1:
+        num = int(sys.argv[1])
+
+    tmpdir = tempfile.mkdtemp(prefix='yum-repomd-manifest-')
+    try:
+        repos = _make_repos(tmpdir, num)
+        print "Loading %d repomd.xml + metalink.xml files:" % num
+        for i in range(3):
+            print "  %-28s %8.3fms" % ("XML", _time(repos, False))
+        os.unlink(tmpdir + "/repomd.manifest")
+        print "  %-28s %8.3fms" % ("manifest (first run)", _time(repos, True))
+        for i in range(3):
+            print "  %-28s %8.3fms" % ("manifest", _time(repos, True))
+        print "  %-28s %8.3fms" % ("manifest (same process)",
+                                   _time(repos, True, False))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import unittest
+import settestpath
+
+import os
+import shutil
+import tempfile
+
+from yum import yumRepo
+from yum import repoMDObject
+from yum import metalink
+
+_repomd = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+ <revision>%s</revision>
+ <tags>
+  <content>binary-x86_64</content>
+  <distro cpeid="cpe:/o:fedoraproject:fedora:20">Fedora 20</distro>
+ </tags>
+ <data type="primary_db">
+  <checksum type="sha256">aaaa</checksum>
+  <open-checksum type="sha256">bbbb</open-checksum>
+  <location href="repodata/primary.sqlite.bz2"/>
+  <timestamp>1400000000</timestamp>
+  <database_version>10</database_version>
+  <size>100</size>
+  <open-size>300</open-size>
+  <delta>
+   <checksum type="sha256">cccc</checksum>
+   <location href="repodata/delta-primary.sqlite.bz2"/>
+   <timestamp>1300000000</timestamp>
+   <size>5</size>
+  </delta>
+ </data>
+ <data type="primary">
+  <checksum type="sha256">dddd</checksum>
+  <location href="repodata/primary.xml.gz"/>
+  <timestamp>1400000001</timestamp>
+ </data>
+</repomd>
+"""
+
+_metalink = """<?xml version="1.0" encoding="utf-8"?>
+<metalink version="3.0" xmlns="http://www.metalinker.org/" type="dynamic" xmlns:mm0="http://fedorahosted.org/mirrormanager">
+ <files>
+  <file name="repomd.xml">
+   <mm0:timestamp>1400000000</mm0:timestamp>
+   <size>4000</size>
+   <verification>
+    <hash type="md5">aaaa</hash>
+    <hash type="sha256">bbbb</hash>
+   </verification>
+   <mm0:alternates>
+    <mm0:alternate>
+     <mm0:timestamp>1300000000</mm0:timestamp>
+     <size>3900</size>
+     <verification>
+      <hash type="sha256">cccc</hash>
+     </verification>
+    </mm0:alternate>
+   </mm0:alternates>
+   <resources maxconnections="1">
+    <url protocol="http" type="http" location="US" preference="100">http://a.example.com/pub/repodata/repomd.xml</url>
+    <url protocol="rsync" type="rsync" location="DE" preference="99">rsync://b.example.com/pub/repodata/repomd.xml</url>
+    <url protocol="https" type="https" location="DE" preference="99" mm0:private="True">https://c.example.com/pub/repodata/repomd.xml</url>
+   </resources>
+  </file>
+ </files>
+</metalink>
+"""
+
+def _xml(repomd):
+    return sorted(repomd.dump_xml().split('\n'))
+
+class RepoMDManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-repomd-manifest-')
+        self.repo = yumRepo.YumRepository('manifesttest')
+        self.repo.basecachedir = self.tmpdir
+        self.repo.base_persistdir = self.tmpdir + '/persist'
+        self.local = self.repo.cachedir + '/repomd.xml'
+        self.manifest = self.tmpdir + '/repomd.manifest'
+        self._write('1')
+        yumRepo._repomd_manifests.clear()
+
+    def tearDown(self):
+        yumRepo._repomd_manifests.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, revision):
+        open(self.local + '.tmp', 'w').write(_repomd % revision)
+        os.rename(self.local + '.tmp', self.local)
+
+    def _parse(self):
+        """ Parse, as a new process would. """
+        yumRepo._repomd_manifests.clear()
+        return self.repo._parseRepoXML(self.local)
+
+    def testRoundTrip(self):
+        xml = repoMDObject.RepoMD(self.repo.id, self.local)
+        self.repo._parseRepoXML(self.local)
+        self.assertTrue(os.path.exists(self.manifest))
+
+        orig = repoMDObject.RepoMD.parse
+        def _fail(*args):
+            raise AssertionError("repomd.xml was parsed")
+        repoMDObject.RepoMD.parse = _fail
+        try:
+            repomd = self._parse()
+        finally:
+            repoMDObject.RepoMD.parse = orig
+        self.assertEqual(_xml(repomd), _xml(xml))
+        for attr in ('timestamp', 'length', 'checksums', 'revision', 'tags'):
+            self.assertEqual(getattr(repomd, attr), getattr(xml, attr))
+        delta = repomd.getData('primary_db').getDelta(1300000000)
+        self.assertEqual(delta.type, 'primary_db')
+        self.assertEqual(delta.size, '5')
+
+    def testChanged(self):
+        self.repo._parseRepoXML(self.local)
+        self._write('2')
+        self.assertEqual(self._parse().revision, '2')
+        self.assertEqual(self._parse().revision, '2')
+
+    def testCacheDependent(self):
+        # Which primary_db we use depends on what's in the cachedir, so it
+        # can't be keyed on just repomd.xml.
+        dup = ''' <data type="primary_db">
+  <checksum type="sha256">eeee</checksum>
+  <location href="repodata/primary.sqlite.zck"/>
+  <timestamp>1400000000</timestamp>
+  <size>200</size>
+ </data>
+</repomd>'''
+        data = (_repomd % '1').replace('</repomd>', dup)
+        open(self.local, 'w').write(data)
+        self.assertEqual(self._parse().getData('primary_db').checksum[1],
+                         'aaaa')
+        self.assertFalse(self.local in
+                         yumRepo._repomd_manifest_load(self.manifest))
+        open(self.repo.cachedir + '/primary.sqlite.zck', 'w').write('')
+        self.assertEqual(self._parse().getData('primary_db').checksum[1],
+                         'eeee')
+
+    def testPartialEntry(self):
+        self.repo._parseRepoXML(self.local)
+        data = open(self.manifest).read()
+        self.assertTrue(data.endswith('\n.\n'))
+        open(self.manifest, 'w').write(data[:-len('.\n')])
+        yumRepo._repomd_manifests.clear()
+        self.assertEqual(yumRepo._repomd_manifest_load(self.manifest), {})
+
+    def testDisabled(self):
+        self.repo.repomd_manifest = False
+        self.repo._parseRepoXML(self.local)
+        self.assertFalse(os.path.exists(self.manifest))
+
+    def testMetalink(self):
+        local = self.repo.cachedir + '/metalink.xml'
+        open(local, 'w').write(_metalink)
+        xml = metalink.MetaLinkRepoMD(local)
+        self.repo._parseMetalink(local)
+
+        yumRepo._repomd_manifests.clear()
+        orig = metalink.xmlparse
+        def _fail(*args):
+            raise AssertionError("metalink.xml was parsed")
+        metalink.xmlparse = _fail
+        try:
+            ml = self.repo._parseMetalink(local)
+        finally:
+            metalink.xmlparse = orig
+        self.assertEqual(str(ml), str(xml))
+        self.assertEqual(list(ml.urls()), list(xml.urls()))
+        self.assertEqual(ml._host2mc.keys(), xml._host2mc.keys())
+        self.assertEqual(ml.repomd, xml.repomd)
+        self.assertEqual(ml.repomd.chksums, xml.repomd.chksums)
+        # The repomd.xml entry is still there.
+        self.assertEqual(self._parse().revision, '1')
+        self.assertEqual(sorted(yumRepo._repomd_manifest_load(self.manifest)),
+                         sorted([local, self.local]))
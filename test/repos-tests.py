@@ -0,0 +1,132 @@
+import unittest
+import settestpath
+
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+
+from yum import Errors
+from yum import repos
+
+class _FakePlugins:
+    def run(self, *args):
+        pass
+
+class _FakeConf:
+    setup_connections = 2
+
+class _FakeYum:
+    def __init__(self):
+        self.plugins = _FakePlugins()
+        self.conf = _FakeConf()
+
+class _FakeRepo:
+    cache = False
+    _async = True
+    skip_if_unavailable = False
+
+    def __init__(self, repoid):
+        self.id = repoid
+        self.done = 0
+
+    def isEnabled(self):
+        return True
+
+    def _commonLoadRepoXML(self, text):
+        raise Errors.RepoError('broken', repo=self)
+
+    def _asyncDone(self):
+        self.done += 1
+
+    def close(self):
+        pass
+
+class RetrieveAllMDTests(unittest.TestCase):
+    def setUp(self):
+        self.yb = _FakeYum()
+        self.storage = repos.RepoStorage(self.yb)
+        self.storage._prefetchAllRepoXML = lambda connections: None
+        self.repo = _FakeRepo('broken')
+        self.storage.add(self.repo)
+
+    def testAsyncDoneOnError(self):
+        # The prefetched files are cleaned up, even when setup fails.
+        self.assertRaises(Errors.RepoError, self.storage.retrieveAllMD)
+        self.assertEqual(self.repo.done, 1)
+
+class _FailingMultiprocessing:
+    class Pool:
+        def __init__(self, workers):
+            raise OSError(12, 'Cannot allocate memory')
+
+class DecompressMDTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-decompress-')
+        os.mkdir(self.tmpdir + '/gen')
+        self.data = {}
+        self.todo = []
+        for (num, ext) in enumerate(['gz', 'bz2', 'gz']):
+            fname = '%s/%d-primary.sqlite.%s' % (self.tmpdir, num, ext)
+            data = ('data %d\n' % num) * 1000
+            if ext == 'gz':
+                fo = gzip.open(fname, 'wb')
+            else:
+                fo = bz2.BZ2File(fname, 'wb')
+            fo.write(data)
+            fo.close()
+            self.data['db%d.sqlite' % num] = data
+            self.todo.append((fname, 'db%d.sqlite' % num, False))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _done(self):
+        ret = {}
+        for name in self.data:
+            fname = self.tmpdir + '/gen/' + name
+            if os.path.exists(fname):
+                ret[name] = open(fname).read()
+        return ret
+
+    def testPool(self):
+        if repos.multiprocessing is None:
+            return
+        repos.decompressMD(self.todo, 4)
+        self.assertEqual(self._done(), self.data)
+
+    def testWorkerErrors(self):
+        # Problems are left for populate() to find.
+        if repos.multiprocessing is None:
+            return
+        bad = self.tmpdir + '/bad-primary.sqlite.gz'
+        open(bad, 'w').write('not gzip data')
+        self.todo.insert(1, (bad, 'bad.sqlite', False))
+        self.todo.append((self.tmpdir + '/missing.sqlite.bz2', 'missing.sqlite',
+                          False))
+        repos.decompressMD(self.todo, 2)
+        self.assertEqual(self._done(), self.data)
+        self.assertEqual(repos._repo_gen_decompress_worker(self.todo[1]), None)
+
+    def testSerial(self):
+        # One worker, or one file, is left to populate().
+        repos.decompressMD(self.todo, 1)
+        repos.decompressMD(self.todo[:1], 4)
+        self.assertEqual(self._done(), {})
+
+    def testNoPool(self):
+        orig = repos.multiprocessing
+        repos.multiprocessing = _FailingMultiprocessing()
+        try:
+            repos.decompressMD(self.todo, 4)
+        finally:
+            repos.multiprocessing = orig
+        self.assertEqual(self._done(), {})
+        # Which then does them one at a time.
+        for args in self.todo:
+            repos._repo_gen_decompress_worker(args)
+        self.assertEqual(self._done(), self.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import settestpath
+
+import os
+import shutil
+import tempfile
+
+import urlgrabber.grabber
+from urlgrabber.grabber import URLGrabError
+from yum import misc
+from yum import yumRepo
+from yum.packages import YumAvailablePackage
+from testbase import TestHTTPServer
+
+class SegmentedDownloadTests(unittest.TestCase):
+    def setUp(self):
+        if not os.path.exists('/usr/libexec/urlgrabber-ext-down'):
+            self.skipTest("urlgrabber-ext-down isn't installed")
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-segmented-')
+        self.data = os.urandom(300 * 1024)
+        self.servers = [TestHTTPServer(), TestHTTPServer()]
+        for server in self.servers:
+            server.serve('/foo-1-1.noarch.rpm', self.data)
+
+        self.repo = yumRepo.YumRepository('segmented')
+        self.repo.basecachedir = self.tmpdir + '/cache'
+        self.repo.base_persistdir = self.tmpdir + '/persist'
+        self.repo.baseurl = [server.url + '/' for server in self.servers]
+        self.repo.download_segment_size = 64 * 1024
+        self.repo.dirSetup()
+
+        self.po = YumAvailablePackage(self.repo)
+        self.po.relativepath = 'foo-1-1.noarch.rpm'
+        self.po.basepath = None
+        self.po.packagesize = len(self.data)
+        csum = misc.Checksums(['sha256'])
+        csum.update(self.data)
+        self.po.checksum_type = 'sha256'
+        self.po.pkgId = csum.hexdigest()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _ranges(self):
+        """ Return the Range headers of the requests to both servers. """
+        requests = self.servers[0].requests + self.servers[1].requests
+        return [rng for (path, cond, rng) in requests]
+
+    def _download(self, callback_args=False):
+        checked = []
+        failed = []
+        def checkfunc(obj, *args):
+            self.assertEqual(args, callback_args and ('arg',) or ())
+            checked.append(obj.filename)
+            if not self.po.verifyLocalPkg():
+                misc.unlink_f(obj.filename)
+                raise URLGrabError(-1, 'Package does not match')
+        def failfunc(obj):
+            failed.append(obj.exception)
+        if callback_args: # The (func, args, kwargs) form
+            checkfunc = (checkfunc, ('arg',), {})
+        self.repo.getPackage(self.po, checkfunc=checkfunc, async=True,
+                             failfunc=failfunc)
+        urlgrabber.grabber.parallel_wait()
+        self.assertEqual(failed, [])
+        self.assertEqual(os.listdir(self.repo.pkgdir), ['foo-1-1.noarch.rpm'])
+        self.assertEqual(open(self.po.localPkg()).read(), self.data)
+        return checked
+
+    def testRanges(self):
+        self.assertEqual(self.repo._segmentRanges(self.po),
+                         [(0, 76800), (76800, 153600), (153600, 230400),
+                          (230400, 307200)])
+        self.po.packagesize = 100 * 1024
+        self.assertEqual(self.repo._segmentRanges(self.po), None)
+        self.po.packagesize = 300 * 1024
+        self.repo.download_segment_size = 0
+        self.assertEqual(self.repo._segmentRanges(self.po), None)
+
+    def testSegmented(self):
+        self.assertEqual(self._download(), [self.po.localPkg()])
+        self.assertEqual(sorted(self._ranges()),
+                         ['bytes=0-76799', 'bytes=153600-230399',
+                          'bytes=230400-307199', 'bytes=76800-153599'])
+        # Spread over both the mirrors.
+        self.assertTrue(self.servers[0].requests)
+        self.assertTrue(self.servers[1].requests)
+
+    def testCallbackArgs(self):
+        self.assertEqual(self._download(True), [self.po.localPkg()])
+        for server in self.servers:
+            server.corrupt = True
+        os.unlink(self.po.localPkg())
+        self.assertEqual(self._download(True), [self.po.localPkg()] * 2)
+
+    def testFallback(self):
+        for server in self.servers:
+            server.corrupt = True
+        self.assertEqual(self._download(), [self.po.localPkg()] * 2)
+        ranges = self._ranges()
+        self.assertEqual(len(ranges), 5)
+        self.assertTrue(None in ranges)
@@ -0,0 +1,119 @@
+import unittest
+import settestpath
+
+import os
+import shutil
+import tempfile
+
+import yum
+import rpmUtils.miscutils
+import rpmUtils.transaction
+from testbase import FakeConf
+
+class _FakeRpmDB:
+    def readOnlyTS(self):
+        return None
+    def dropCachedData(self):
+        pass
+
+class _FakePackage:
+    pkgtype = 'local'
+    def __init__(self, fname):
+        self.fname = fname
+    def localPkg(self):
+        return self.fname
+
+class SigCheckTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sigcheck-')
+        # The contents of each package is what checkSig() says about it.
+        self.pkgs = []
+        for name, sigresult in (('good', 0), ('nokey', 1), ('unsigned', 4)):
+            fname = '%s/%s.rpm' % (self.tmpdir, name)
+            open(fname, 'w').write(str(sigresult))
+            self.pkgs.append(_FakePackage(fname))
+
+        # Only the checks in this process are seen, not the workers'.
+        self.checked = []
+        self._checkSig = rpmUtils.miscutils.checkSig
+        def checkSig(ts, fname):
+            self.checked.append(os.path.basename(fname))
+            return int(open(fname).read())
+        rpmUtils.miscutils.checkSig = checkSig
+        self._initReadOnlyTransaction = \
+                                rpmUtils.transaction.initReadOnlyTransaction
+        rpmUtils.transaction.initReadOnlyTransaction = lambda root: None
+
+        self.yb = yum.YumBase()
+        self.yb._conf = FakeConf()
+        self.yb._conf.localpkg_gpgcheck = True
+        self.yb._conf.sigcheck_workers = 2
+        self.yb._rpmdb = _FakeRpmDB()
+
+    def tearDown(self):
+        self.yb._sigCheckAbort()
+        rpmUtils.miscutils.checkSig = self._checkSig
+        rpmUtils.transaction.initReadOnlyTransaction = \
+                                                self._initReadOnlyTransaction
+        shutil.rmtree(self.tmpdir)
+
+    def _check(self):
+        return [self.yb.sigCheckPkg(po) for po in self.pkgs]
+
+    def testSerial(self):
+        self.assertEqual(self._check(),
+                         [(0, ''),
+                          (2, 'Public key for nokey.rpm is not installed'),
+                          (2, 'Package unsigned.rpm is not signed')])
+        self.assertEqual(self.checked, ['good.rpm', 'nokey.rpm',
+                                        'unsigned.rpm'])
+
+    def testWorkers(self):
+        serial = self._check()
+        self.checked = []
+
+        self.yb._sigCheckStart(len(self.pkgs))
+        self.assertNotEqual(self.yb._sigcheck_pool, None)
+        for po in self.pkgs:
+            self.yb._sigCheckQueue(po)
+        self.yb._sigCheckFinish()
+        self.assertEqual(self.yb._sigcheck_pool, None)
+        self.assertEqual(self.checked, [])
+
+        # Same results, only the failures are checked (and reported) again.
+        self.assertEqual(self._check(), serial)
+        self.assertEqual(self.checked, ['nokey.rpm', 'unsigned.rpm'])
+
+    def testQueued(self):
+        # A check still in the workers is waited for, not done again.
+        serial = self._check()
+        self.checked = []
+        self.yb._sigCheckStart(len(self.pkgs))
+        for po in self.pkgs:
+            self.yb._sigCheckQueue(po)
+        self.assertEqual(self.yb.sigCheckPkg(self.pkgs[0]), serial[0])
+        self.assertEqual(self.checked, [])
+        self.yb._sigCheckFinish()
+        self.assertEqual(self._check(), serial)
+        self.assertEqual(self.checked, ['nokey.rpm', 'unsigned.rpm'])
+
+    def testChanged(self):
+        self.yb._sigCheckStart(len(self.pkgs))
+        for po in self.pkgs:
+            self.yb._sigCheckQueue(po)
+        self.yb._sigCheckFinish()
+        open(self.pkgs[0].localPkg(), 'w').write('4 ')
+        self.assertEqual(self.yb.sigCheckPkg(self.pkgs[0]),
+                         (2, 'Package good.rpm is not signed'))
+        self.assertEqual(self.checked, ['good.rpm'])
+
+    def testOneWorker(self):
+        self.yb._conf.sigcheck_workers = 1
+        self.yb._sigCheckStart(len(self.pkgs))
+        self.assertEqual(self.yb._sigcheck_pool, None)
+        for po in self.pkgs:
+            self.yb._sigCheckQueue(po)
+        self.yb._sigCheckFinish()
+        self.assertEqual(self.checked, [])
+        self._check()
+        self.assertEqual(len(self.checked), 3)
@@ -0,0 +1,145 @@
+#! /usr/bin/python -tt
+
+# Do either:
+# ./sqlite-ro-bench.py
+# ./sqlite-ro-bench.py <num packages>
+#
+# Creates primary and filelists DBs with lots of fake packages, and then times
+# provides and file lookups through a sqlite sack with the DBs opened normally
+# and with sqlutils.sql_read_only(). "cold" is the first lookup on a new
+# connection (the OS page cache will still be warm), "warm" is the average of
+# the next lookups of different names.
+
+import sys, time, tempfile, shutil
+import sqlitecachec
+from yum import sqlitesack
+from yum.sqlutils import sqlite, sql_read_only
+
+class FakeRepo:
+    def __init__(self, id, cachedir):
+        self.id = id
+        self.cost = 1000
+        self.cachedir = cachedir
+    def __str__(self):
+        return self.id
+    def __cmp__(self, other):
+        return cmp(self.id, getattr(other, 'id', other))
+    def __hash__(self):
+        return hash(self.id)
+
+def _make_dbs(tmpdir, num):
+    pri = sqlite.connect(tmpdir + '/primary.sqlite')
+    pri.executescript("""
+CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT,
+    arch TEXT, version TEXT, epoch TEXT, release TEXT, summary TEXT,
+    description TEXT, url TEXT, time_file INTEGER, time_build INTEGER,
+    rpm_license TEXT, rpm_vendor TEXT, rpm_group TEXT, rpm_buildhost TEXT,
+    rpm_sourcerpm TEXT, rpm_header_start INTEGER, rpm_header_end INTEGER,
+    rpm_packager TEXT, size_package INTEGER, size_installed INTEGER,
+    size_archive INTEGER, location_href TEXT, location_base TEXT,
+    checksum_type TEXT);
+CREATE TABLE files (name TEXT, type TEXT, pkgKey INTEGER);
+CREATE TABLE requires (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER , pre BOOLEAN DEFAULT FALSE);
+CREATE TABLE provides (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER);
+CREATE TABLE conflicts (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER);
+CREATE TABLE obsoletes (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER);
+CREATE INDEX packagename ON packages (name);
+CREATE INDEX packageId ON packages (pkgId);
+CREATE INDEX filenames ON files (name);
+CREATE INDEX pkgfiles ON files (pkgKey);
+CREATE INDEX pkgprovides on provides (pkgKey);
+CREATE INDEX providesname ON provides (name);
+""")
+    fil = sqlite.connect(tmpdir + '/filelists.sqlite')
+    fil.executescript("""
+CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT);
+CREATE TABLE filelist (pkgKey INTEGER, dirname TEXT, filenames TEXT,
+    filetypes TEXT);
+CREATE INDEX keyfile ON filelist (pkgKey);
+CREATE INDEX pkgId ON packages (pkgId);
+CREATE INDEX dirnames ON filelist (dirname);
+""")
+    for db in (pri, fil):
+        db.execute("INSERT INTO db_info VALUES (10, 'fake')")
+
+    for i in xrange(1, num + 1):
+        name = 'pkg-%d' % i
+        pkgid = '%064x' % i
+        pri.execute("""INSERT INTO packages (pkgKey, pkgId, name, arch,
+                       version, epoch, release, summary, description,
+                       location_href, checksum_type)
+                       VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
+                    (i, pkgid, name, 'x86_64', '1.0', '0', '1',
+                     'summary', 'description', name + '.rpm', 'sha256'))
+        for prov in (name, 'lib%d.so.1()(64bit)' % i, 'config(%s)' % name):
+            pri.execute("""INSERT INTO provides VALUES (?,?,?,?,?,?)""",
+                        (prov, 'EQ', '0', '1.0', '1', i))
+        pri.execute("INSERT INTO files VALUES (?,?,?)",
+                    ('/usr/bin/' + name, 'file', i))
+        fil.execute("INSERT INTO packages VALUES (?,?)", (i, pkgid))
+        fil.execute("INSERT INTO filelist VALUES (?,?,?,?)",
+                    (i, '/usr/share/doc/' + name, 'README/COPYING', 'ff'))
+    for db in (pri, fil):
+        db.commit()
+        db.close()
+
+def _time(func, args):
+    stime = time.time()
+    for arg in args:
+        func(arg)
+    return (time.time() - stime) / len(args)
+
+def _bench(tmpdir, num, read_only):
+    repo = FakeRepo('fake', tmpdir)
+    sack = sqlitesack.YumSqlitePackageSack(
+                                         sqlitesack.YumAvailablePackageSqlite)
+    repo.sack = sack
+    for (mdtype, fname) in (('metadata', 'primary'),
+                            ('filelists', 'filelists')):
+        db = sqlitecachec.open_database('%s/%s.sqlite' % (tmpdir, fname))
+        if read_only:
+            sql_read_only(db)
+        sack.addDict(repo, mdtype, db)
+
+    step = max(1, num / 100)
+    names = range(1, num, step)
+    tests = (("searchProvides",
+              sack.searchProvides, ['lib%d.so.1()(64bit)' % i for i in names]),
+             ("searchFiles",
+              sack.searchFiles, ['/usr/share/doc/pkg-%d/README' % i
+                                 for i in names]),
+             ("searchFiles glob",
+              sack.searchFiles, ['/usr/share/doc/pkg-%d*/COPYING' % i
+                                 for i in names[:10]]))
+    for (msg, func, args) in tests:
+        cold = _time(func, args[:1])
+        warm = _time(func, args[1:])
+        print "  %-20s cold %8.3fms warm %8.3fms" % (msg, cold * 1000,
+                                                     warm * 1000)
+    sack.close()
+
+def main():
+    num = 50000
+    if len(sys.argv) > 1:
+        num = int(sys.argv[1])
+
+    tmpdir = tempfile.mkdtemp(prefix='yum-sqlite-ro-')
+    try:
+        _make_dbs(tmpdir, num)
+        for read_only in (False, True, False, True):
+            if read_only:
+                print "sql_read_only() (%d pkgs):" % num
+            else:
+                print "Default (%d pkgs):" % num
+            _bench(tmpdir, num, read_only)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#! /usr/bin/python -tt
+
+# Do either:
+# ./sqlite-sack-memory.py
+# ./sqlite-sack-memory.py <num packages>
+#
+# Creates a primary db. with lots of fake packages, and then loads all of them
+# into a sqlite sack and shows how much memory the package objects take.
+
+import os, sys, gc, time, tempfile, shutil
+import sqlitecachec
+from yum import sqlitesack
+from yum.sqlutils import sqlite
+from urlgrabber.progress import format_number
+
+def out_mem(pid):
+    ps = {}
+    for line in open("/proc/%d/status" % pid):
+        if line[-1] != '\n':
+            continue
+        data = line[:-1].split(':\t', 1)
+        if data[1].endswith(' kB'):
+            data[1] = data[1][:-3]
+        ps[data[0].strip().lower()] = data[1].strip()
+    if 'vmrss' in ps and 'vmsize' in ps:
+        print "* Memory : %5s RSS (%5sB VSZ)" % \
+                    (format_number(int(ps['vmrss']) * 1024),
+                     format_number(int(ps['vmsize']) * 1024))
+    return int(ps.get('vmrss', 0)) * 1024
+
+class FakeRepo:
+    def __init__(self, id, cachedir):
+        self.id = id
+        self.cost = 1000
+        self.cachedir = cachedir
+    def __str__(self):
+        return self.id
+    def __cmp__(self, other):
+        return cmp(self.id, getattr(other, 'id', other))
+    def __hash__(self):
+        return hash(self.id)
+
+def _make_primary(fname, num):
+    db = sqlite.connect(fname)
+    db.executescript("""
+CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT,
+    arch TEXT, version TEXT, epoch TEXT, release TEXT, summary TEXT,
+    description TEXT, url TEXT, time_file INTEGER, time_build INTEGER,
+    rpm_license TEXT, rpm_vendor TEXT, rpm_group TEXT, rpm_buildhost TEXT,
+    rpm_sourcerpm TEXT, rpm_header_start INTEGER, rpm_header_end INTEGER,
+    rpm_packager TEXT, size_package INTEGER, size_installed INTEGER,
+    size_archive INTEGER, location_href TEXT, location_base TEXT,
+    checksum_type TEXT);
+CREATE TABLE files (name TEXT, type TEXT, pkgKey INTEGER);
+CREATE TABLE requires (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER , pre BOOLEAN DEFAULT FALSE);
+CREATE TABLE provides (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER);
+CREATE TABLE conflicts (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER);
+CREATE TABLE obsoletes (name TEXT, flags TEXT, epoch TEXT, version TEXT,
+    release TEXT, pkgKey INTEGER);
+CREATE INDEX packagename ON packages (name);
+CREATE INDEX packageId ON packages (pkgId);
+""")
+    db.execute("INSERT INTO db_info VALUES (10, 'fake')")
+    arches = ('noarch', 'x86_64', 'i686')
+    def _pkgs():
+        for i in xrange(1, num + 1):
+            yield (i, '%064x' % i, 'pkg-%d' % (i / 3),
+                   arches[i % 3], '1.%d' % (i % 17), '0',
+                   '%d.fc99' % (i % 5), 'summary', 'description',
+                   'Packages/pkg-%d.rpm' % i, 'sha256')
+    db.executemany("""INSERT INTO packages (pkgKey, pkgId, name, arch,
+                      version, epoch, release, summary, description,
+                      location_href, checksum_type)
+                      VALUES (?,?,?,?,?,?,?,?,?,?,?)""", _pkgs())
+    db.commit()
+    db.close()
+
+def main():
+    num = 100000
+    if len(sys.argv) > 1:
+        num = int(sys.argv[1])
+
+    tmpdir = tempfile.mkdtemp(prefix='yum-sack-mem-')
+    try:
+        fname = tmpdir + '/primary.sqlite'
+        _make_primary(fname, num)
+
+        gc.collect()
+        print "Before loading %d packages:" % num
+        beg = out_mem(os.getpid())
+
+        repo = FakeRepo('fake', tmpdir)
+        sack = sqlitesack.YumSqlitePackageSack(
+                                         sqlitesack.YumAvailablePackageSqlite)
+        repo.sack = sack
+        sack.addDict(repo, 'metadata', sqlitecachec.open_database(fname))
+        stime = time.time()
+        pkgs = sack.returnPackages()
+        etime = time.time() - stime
+
+        gc.collect()
+        print "After loading %d packages (%.2fs):" % (len(pkgs), etime)
+        end = out_mem(os.getpid())
+        if pkgs:
+            print "* Per pkg: %5sB" % format_number((end - beg) / len(pkgs))
+        sack.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
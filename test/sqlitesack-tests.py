@@ -0,0 +1,686 @@
+import unittest
+import settestpath
+
+import gc
+import os
+import shutil
+import tempfile
+
+from testbase import makeSqliteRepo, FakeConf, FakeRpmDb
+from yum import YumBase
+from yum import transactioninfo
+from yum import packageSack
+from yum import sqlitesack
+
+class PkgCacheTests(unittest.TestCase):
+    """ The pkg_cache_max LRU of package objects. """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sqlitesack-')
+        pkgs = [{'name' : 'foo%d' % num} for num in range(50)]
+        self.repo = makeSqliteRepo(self.tmpdir, 'lru', pkgs)
+        self.repo.pkg_cache_max = 10
+        self.sack = self.repo.sack
+
+    def tearDown(self):
+        self.sack.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _load(self, num):
+        pkgs = self.sack.searchNames(['foo%d' % num])
+        self.assertEqual(len(pkgs), 1)
+        return pkgs[0]
+
+    def _cached(self):
+        return self.sack._key2pkg.get(self.repo, {})
+
+    def testBounded(self):
+        for num in range(50):
+            self._load(num)
+        self.assertTrue(len(self._cached()) <= 11)
+        self.assertEqual(len(self.sack._key2pkg_ticks[self.repo]),
+                         len(self._cached()))
+        self.assertEqual(self.sack.pkg_cache_misses, 50)
+        self.assertEqual(self.sack.pkg_cache_evictions, 50 - len(self._cached()))
+        po = self._load(49)
+        self.assertTrue(self._load(49) is po)
+        self.assertTrue(self.sack.pkg_cache_hits >= 1)
+
+    def testUnlimited(self):
+        self.repo.pkg_cache_max = 0
+        for num in range(50):
+            self._load(num)
+        self.assertEqual(len(self._cached()), 50)
+        self.assertEqual(self.sack.pkg_cache_evictions, 0)
+
+    def testInUse(self):
+        # Something else (Eg. the transaction) still has the evicted package,
+        # so we have to give that back, and not a second copy.
+        po = self._load(0)
+        for num in range(1, 50):
+            self._load(num)
+        self.assertTrue(po.pkgKey not in self._cached())
+        misses = self.sack.pkg_cache_misses
+        self.assertTrue(self._load(0) is po)
+        self.assertEqual(self.sack.pkg_cache_misses, misses)
+        self.assertEqual(self.sack._pkgtup2pkgs[po.pkgtup], [po])
+        self.assertTrue(po.pkgKey in self.sack._key2pkg_ticks[self.repo])
+
+    def testNotInUse(self):
+        pkgtup = self._load(0).pkgtup
+        for num in range(1, 50):
+            self._load(num)
+        gc.collect()
+        misses = self.sack.pkg_cache_misses
+        po = self._load(0)
+        self.assertEqual(po.pkgtup, pkgtup)
+        self.assertEqual(self.sack.pkg_cache_misses, misses + 1)
+        self.assertEqual(self.sack._pkgtup2pkgs[po.pkgtup], [po])
+
+    def testRestore(self):
+        held = [self._load(num) for num in range(50)]
+        pkgs = self.sack.returnPackages()
+        self.assertEqual(len(pkgs), 50)
+        self.assertEqual(len(self._cached()), 50)
+        self.assertEqual(sorted(self.sack._key2pkg_ticks[self.repo]),
+                         sorted(self._cached()))
+        for po in held:
+            self.assertTrue(self._cached()[po.pkgKey] is po)
+
+_search_pkgs = [
+    {'name' : 'foo', 'summary' : 'A foo tool',
+     'description' : "Does 100% of the foo, it's fast.",
+     'url' : 'http://foo.example.com/'},
+    {'name' : 'foo-devel', 'summary' : 'Headers for foo',
+     'description' : 'Development files, for foo_bar.'},
+    {'name' : 'bar', 'summary' : 'The bar', 'description' : 'Not foo.',
+     'url' : 'http://example.com/bar'},
+    {'name' : 'baz', 'summary' : 'Baz', 'description' : 'Nothing here.'},
+    ]
+
+class SearchIndexTests(unittest.TestCase):
+    """ The search_index full text index gives the same results as looking
+        in the packages table. """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sqlitesack-')
+        self.plain = makeSqliteRepo(self.tmpdir, 'plain', _search_pkgs)
+        self.indexed = makeSqliteRepo(self.tmpdir, 'indexed', _search_pkgs)
+        self.indexed.search_index = True
+
+    def tearDown(self):
+        self.plain.sack.close()
+        self.indexed.sack.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _search(self, repo, fields, strings):
+        ret = repo.sack.searchPrimaryFieldsMultipleStrings(fields, strings)
+        return sorted([(po.pkgtup, num) for (po, num) in ret])
+
+    def testSame(self):
+        fields = ['name', 'summary', 'description', 'url']
+        for strings in (['foo'], ['FOO'], ['fo'], ['100%'], ['foo_'],
+                        ["it's"], ['example.com'], ['nomatch'],
+                        ['foo', 'bar'], ['foo', 'tool', 'headers']):
+            for flds in (fields, ['name'], ['summary', 'url']):
+                plain = self.plain.sack.searchPrimaryFields(flds, strings[0])
+                indexed = self.indexed.sack.searchPrimaryFields(flds,
+                                                                strings[0])
+                self.assertEqual(sorted([po.pkgtup for po in indexed]),
+                                 sorted([po.pkgtup for po in plain]))
+                self.assertEqual(self._search(self.indexed, flds, strings),
+                                 self._search(self.plain, flds, strings))
+        self.assertEqual(len(self.plain.sack.searchPrimaryFields(fields,
+                                                                 'foo')), 3)
+        self.assertTrue(self.indexed.sack._search_index[self.indexed]
+                        is not None)
+        self.assertEqual(self.plain.sack._search_index[self.plain], None)
+
+    def testOtherFields(self):
+        # The index doesn't have these, so we use the packages table.
+        pkgs = self.indexed.sack.searchPrimaryFields(['arch'], 'noarch')
+        self.assertEqual(len(pkgs), len(_search_pkgs))
+        self.assertFalse(self.indexed in self.indexed.sack._search_index)
+
+_attach_repos = {
+    'a' : [{'name' : 'foo', 'version' : '1.0', 'provides' : ['libfoo.so'],
+            'requires' : ['bar']},
+           {'name' : 'bar'}],
+    'b' : [{'name' : 'foo', 'version' : '2.0',
+            'provides' : ['libfoo.so', ('foo-api', 'EQ', ('0', '2', None))]},
+           {'name' : 'baz', 'arch' : 'x86_64',
+            'requires' : [('foo', 'GE', ('0', '2', None)), 'libfoo.so']}],
+    'c' : [{'name' : 'bar', 'version' : '2', 'provides' : ['bar-virtual'],
+            'requires' : [('foo-api', 'EQ', ('0', '2', None))]}],
+    }
+
+def _pkgtups(pkgs):
+    return sorted([po.pkgtup for po in pkgs])
+
+def _prcos(result):
+    return sorted([(po.pkgtup, sorted(vals)) for po, vals in result.items()])
+
+class AttachTests(unittest.TestCase):
+    """ Lookups with attach_primary_dbs give the same results as without. """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sqlitesack-')
+        self.plain = self._metaSack('plain')
+        self.attached = self._metaSack('attached')
+        sqlitesack.attachPrimaryDBs(self.attached.sacks.values())
+
+    def tearDown(self):
+        for sack in self.plain.sacks.values() + self.attached.sacks.values():
+            sack.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _metaSack(self, prefix):
+        ret = packageSack.MetaSack()
+        for repoid in sorted(_attach_repos):
+            repo = makeSqliteRepo(self.tmpdir, prefix + repoid,
+                                  _attach_repos[repoid])
+            ret.addSack(repo.id, repo.sack)
+        return ret
+
+    def testAttached(self):
+        for sack in self.attached.sacks.values():
+            self.assertTrue(sack._attached is not None)
+        for sack in self.plain.sacks.values():
+            self.assertTrue(sack._attached is None)
+
+    def testSearchNames(self):
+        for names in (['foo'], ['foo', 'bar', 'baz', 'nope'], ['nope']):
+            self.assertEqual(_pkgtups(self.attached.searchNames(names)),
+                             _pkgtups(self.plain.searchNames(names)))
+        self.assertEqual(len(self.attached.searchNames(['foo', 'bar'])), 4)
+
+    def testPrco(self):
+        reqs = [('libfoo.so', None, (None, None, None)),
+                ('foo', 'GE', ('0', '2', None)),
+                ('foo-api', 'EQ', ('0', '2', None)),
+                ('bar', None, (None, None, None)),
+                ('bar-virtual', None, (None, None, None)),
+                ('nope', None, (None, None, None))]
+        for (name, flags, evr) in reqs:
+            for prcotype in ('Provides', 'Requires'):
+                get = 'get' + prcotype
+                self.assertEqual(
+                    _prcos(getattr(self.attached, get)(name, flags, evr)),
+                    _prcos(getattr(self.plain, get)(name, flags, evr)))
+                search = 'search' + prcotype
+                self.assertEqual(
+                    _pkgtups(getattr(self.attached, search)(name)),
+                    _pkgtups(getattr(self.plain, search)(name)))
+        self.assertEqual(len(self.attached.getProvides('libfoo.so')), 2)
+        self.assertEqual(len(self.attached.getRequires('foo-api')), 1)
+
+class PrcoCacheTests(unittest.TestCase):
+    """ The on disk prco_cache. """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sqlitesack-')
+        self.repo = None
+
+    def tearDown(self):
+        if self.repo is not None:
+            self.repo.sack.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, pkgs):
+        """ Start a new run, with a repo. of pkgs. """
+        if self.repo is not None:
+            self.repo.sack.close()
+        self.repo = makeSqliteRepo(self.tmpdir, 'prco', pkgs)
+        self.repo.prco_cache = True
+        return self.repo.sack
+
+    def _cached(self):
+        """ The (prcotype, name) entries in the cache file. """
+        lines = open(self.repo.cachedir + '/gen/prco-cache').readlines()
+        return sorted([tuple(line.split('\t')[:2]) for line in lines[1:]])
+
+    def _lookup(self, sack):
+        return (_prcos(sack.getProvides('libfoo.so')),
+                _prcos(sack.getRequires('foo', 'GE', ('0', '2', None))),
+                _pkgtups(sack.searchProvides('nope')))
+
+    def testRoundTrip(self):
+        pkgs = _attach_repos['a'] + _attach_repos['b']
+        sack = self._run(pkgs)
+        result = self._lookup(sack)
+        self.assertEqual(len(result[0]), 2)
+        self.assertEqual(len(result[1]), 1)
+        sack.close()
+        self.assertEqual(self._cached(), [('provides', 'libfoo.so'),
+                                          ('requires', 'foo')])
+
+        sack = self._run(pkgs)
+        data = sack._prcoCacheLoad(self.repo)
+        self.assertEqual(sorted(data['provides']), ['libfoo.so'])
+        self.assertEqual(self._lookup(sack), result)
+        self.assertEqual(sack._prco_disk_dirty, set())
+
+    def testNewPrimary(self):
+        sack = self._run(_attach_repos['a'])
+        self.assertEqual(len(self._lookup(sack)[0]), 1)
+        sack.close()
+        self.assertEqual(len(self._cached()), 2)
+
+        sack = self._run(_attach_repos['a'] + _attach_repos['b'])
+        self.assertEqual(sack._prcoCacheLoad(self.repo),
+                         {'provides' : {}, 'requires' : {}})
+        result = self._lookup(sack)
+        self.assertEqual(len(result[0]), 2)
+        self.assertEqual(len(result[1]), 1)
+
+    def testMaxNames(self):
+        orig = sqlitesack._prco_cache_max_names
+        sqlitesack._prco_cache_max_names = 2
+        try:
+            pkgs = _attach_repos['a'] + _attach_repos['b']
+            self._lookup(self._run(pkgs))
+            self.repo.sack.close()
+            self.assertEqual(len(self._cached()), 2)
+
+            sack = self._run(pkgs)
+            sack.getProvides('libfoo.so')
+            sack.getRequires('bar')
+            sack.close()
+            self.assertEqual(self._cached(), [('provides', 'libfoo.so'),
+                                              ('requires', 'bar')])
+        finally:
+            sqlitesack._prco_cache_max_names = orig
+
+_exclude_pkgs = [
+    {'name' : 'foo', 'arch' : 'x86_64', 'version' : '1.0'},
+    {'name' : 'foo', 'arch' : 'i686', 'version' : '1.0'},
+    {'name' : 'foo-libs', 'version' : '1.0', 'release' : '2'},
+    {'name' : 'bar', 'arch' : 'x86_64', 'version' : '3'},
+    {'name' : 'bar', 'arch' : 'i686', 'version' : '3'},
+    {'name' : 'baz', 'arch' : 'x86_64', 'epoch' : '1', 'version' : '2.0'},
+    {'name' : 'Qux', 'version' : '0.1'},
+    ]
+
+class ExcluderTests(unittest.TestCase):
+    """ Compiled addPackageExcluder() answers match the per package ones. """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sqlitesack-')
+        self.repos = []
+
+    def tearDown(self):
+        for repo in self.repos:
+            repo.sack.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _names(self, excluders, compile):
+        repo = makeSqliteRepo(self.tmpdir, 'ex%d' % len(self.repos),
+                              _exclude_pkgs)
+        self.repos.append(repo)
+        sack = repo.sack
+        for excluder in excluders:
+            sack.addPackageExcluder(repo.id, None, *excluder)
+        if compile:
+            self.assertTrue(sack._compilePkgExcluder(repo, force=True)
+                            is not None)
+        names = sorted(set([pkg['name'] for pkg in _exclude_pkgs]))
+        pkgs = sack.searchNames(names)
+        self.assertEqual(repo in sack._pkgExcludeCompiled, compile)
+        return sorted(['%s-%s:%s-%s.%s' % (po.name, po.epoch, po.version,
+                                           po.release, po.arch)
+                       for po in pkgs])
+
+    def _check(self, excluders, num):
+        compiled = self._names(excluders, True)
+        self.assertEqual(compiled, self._names(excluders, False))
+        self.assertEqual(len(compiled), len(_exclude_pkgs) - num)
+
+    def testGlob(self):
+        self._check([('exclude.match', 'foo*')], 3)
+        self._check([('exclude.match', 'b?r')], 2)
+        self._check([('exclude.match', '*.i686')], 2)
+        self._check([('exclude.match', 'qux')], 1)
+        self._check([('exclude.name.match', 'ba*')], 3)
+        self._check([('exclude.arch.match', 'i?86')], 2)
+
+    def testNEVRA(self):
+        self._check([('exclude.match', 'bar.i686')], 1)
+        self._check([('exclude.match', 'foo-1.0')], 2)
+        self._check([('exclude.match', 'foo-libs-1.0-2')], 1)
+        self._check([('exclude.match', 'baz-1:2.0-1.x86_64')], 1)
+        self._check([('exclude.match', '1:baz-2.0-1.x86_64')], 1)
+        self._check([('exclude.eq', 'foo-1.0-1.x86_64')], 1)
+        self._check([('exclude.nevra.eq', 'bar-0:3-1.i686')], 1)
+        self._check([('exclude.nevr.eq', 'bar-0:3-1')], 2)
+        self._check([('exclude.nevra.in', set(['foo-0:1.0-1.i686',
+                                               'baz-1:2.0-1.x86_64']))], 2)
+        self._check([('exclude.pkgtup.in',
+                      set([('bar', 'x86_64', '0', '3', '1')]))], 1)
+
+    def testArch(self):
+        self._check([('exclude.arch.eq', 'i686')], 2)
+        self._check([('exclude.arch.match', 'noarch')], 2)
+
+    def testOrdering(self):
+        self._check([('include.name.eq', 'foo'), ('exclude.*',)], 5)
+        self._check([('mark.washed',), ('wash.match', 'foo*'),
+                     ('exclude.marked',)], 4)
+        self._check([('exclude.name.in', set(['bar', 'qux']))], 3)
+
+class BatchedPrcoTests(unittest.TestCase):
+    """ getProvidesMany() etc. give the same results as asking for each req,
+        for one sack and across the sacks of a MetaSack. """
+    reqs = [('libfoo.so', None, (None, None, None)),
+            ('libfoo.so', None, (None, None, None)),
+            ('foo', None, (None, None, None)),
+            ('foo', 'GE', ('0', '2', None)),
+            ('foo', 'LT', ('0', '2', None)),
+            ('foo', 'EQ', ('0', '1.0', '1')),
+            ('foo-api', 'EQ', ('0', '2', None)),
+            ('foo-api', 'GT', ('0', '2', None)),
+            ('bar', None, (None, None, None)),
+            ('bar-virtual', None, (None, None, None)),
+            ('/usr/bin/foo', None, (None, None, None)),
+            ('nope', None, (None, None, None))]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sqlitesack-')
+        self.num = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _metaSack(self):
+        ret = packageSack.MetaSack()
+        for repoid in sorted(_attach_repos):
+            self.num += 1
+            pkgs = _attach_repos[repoid]
+            if repoid == 'a':
+                pkgs = pkgs[:]
+                pkgs[0] = pkgs[0].copy()
+                pkgs[0]['files'] = ['/usr/bin/foo']
+            repo = makeSqliteRepo(self.tmpdir, '%s%d' % (repoid, self.num),
+                                  pkgs)
+            ret.addSack(repo.id, repo.sack)
+        return ret
+
+    def _check(self, prcotype, sack):
+        many = getattr(self._metaSack(), 'get%sMany' % prcotype)(self.reqs)
+        one = getattr(sack, 'get' + prcotype)
+        self.assertEqual(sorted(many), sorted(set(self.reqs)))
+        for req in self.reqs:
+            self.assertEqual(_prcos(many[req]), _prcos(one(*req)))
+        return many
+
+    def testProvides(self):
+        many = self._check('Provides', self._metaSack())
+        req = ('libfoo.so', None, (None, None, None))
+        self.assertEqual(len(many[req]), 2)
+        req = ('/usr/bin/foo', None, (None, None, None))
+        self.assertEqual(len(many[req]), 1)
+        req = ('foo', 'GE', ('0', '2', None))
+        self.assertEqual(len(many[req]), 1)
+
+    def testRequires(self):
+        many = self._check('Requires', self._metaSack())
+        req = ('foo-api', 'EQ', ('0', '2', None))
+        self.assertEqual(len(many[req]), 1)
+
+    def testSack(self):
+        # Each sack on its own.
+        meta = self._metaSack()
+        for sack in meta.sacks.values():
+            for prcotype in ('Provides', 'Requires'):
+                many = getattr(sack, 'get%sMany' % prcotype)(self.reqs)
+                for req in self.reqs:
+                    self.assertEqual(_prcos(many[req]),
+                        _prcos(getattr(sack, 'get' + prcotype)(*req)))
+
+    def testPrefetch(self):
+        # The depsolver looks up the requires of what's being installed in
+        # one go, and gets the same answers for them afterwards.
+        meta = self._metaSack()
+        plain = self._metaSack()
+        solver = YumBase()
+        solver.conf = FakeConf()
+        solver.rpmdb = FakeRpmDb()
+        solver.pkgSack = meta
+        tsInfo = transactioninfo.TransactionData()
+        tsInfo.setDatabases(solver.rpmdb, meta)
+        solver.tsInfo = solver._tsInfo = tsInfo
+        for po in meta.searchNames(['baz', 'bar']):
+            tsInfo.addInstall(po)
+        tsInfo._inSack = None # Make it ask the pkgSack
+        self.assertTrue(tsInfo.pkgSackPackages)
+
+        calls = []
+        orig = meta.getProvidesMany
+        def _many(reqs):
+            calls.append(sorted(reqs))
+            return orig(reqs)
+        meta.getProvidesMany = _many
+        solver._prefetchProvides()
+        reqs = [('foo', 'GE', ('0', '2', None)),
+                ('foo-api', 'EQ', ('0', '2', None)),
+                ('libfoo.so', None, (None, None, None))]
+        self.assertEqual(calls, [reqs])
+
+        for req in reqs:
+            self.assertEqual(_prcos(tsInfo.pkgSack.getProvides(*req)),
+                             _prcos(plain.getProvides(*req)))
+            for sack in meta.sacks.values():
+                self.assertTrue(req in sack._search_cache['provides'])
+
+_file_pkgs = [
+    {'name' : 'foo', 'files' : ['/usr/share/foo/README', '/usr/share/foo/a.txt',
+                                '/usr/share/foo/doc/b.txt',
+                                '/usr/lib/libfoo.so.1']},
+    {'name' : 'foo-devel', 'files' : ['/usr/lib/libfoo.so',
+                                      '/usr/include/foo.h']},
+    {'name' : 'bar', 'files' : ['/usr/share/bar/README', '/opt/bar/x/y.conf',
+                                '/opt/bar/z.conf']},
+    ]
+
+class FilelistsIndexTests(unittest.TestCase):
+    """ The filelists_index basename index gives the same results as
+        looking in the filelists. """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sqlitesack-')
+        self.plain = makeSqliteRepo(self.tmpdir, 'plain', _file_pkgs)
+        self.indexed = None
+
+    def tearDown(self):
+        self.plain.sack.close()
+        if self.indexed is not None:
+            self.indexed.sack.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _indexed(self, pkgs):
+        if self.indexed is not None:
+            self.indexed.sack.close()
+        self.indexed = makeSqliteRepo(self.tmpdir, 'indexed', pkgs)
+        self.indexed.filelists_index = True
+        return self.indexed.sack
+
+    def _index(self):
+        return self.indexed.cachedir + '/gen/filelists-basenames.sqlite'
+
+    def testSame(self):
+        sack = self._indexed(_file_pkgs)
+        for (name, num) in (('/usr/share/foo/README', 1),
+                            ('/usr/share/foo/nope', 0),
+                            ('/usr/share/*/README', 2),
+                            ('/usr/share/foo/*.txt', 1),
+                            ('/usr/share/foo/*', 1),
+                            ('/usr/lib/libfoo*', 2),
+                            ('/usr/lib/libfoo.so', 1),
+                            ('/opt/bar/*.conf', 1),
+                            ('/opt/*/*.conf', 1),
+                            ('/usr/*/libfoo.so.?', 1),
+                            ('/usr/share/foo/', 0),
+                            ('/nope/*', 0)):
+            indexed = _pkgtups(sack.searchFiles(name))
+            self.assertEqual(indexed,
+                             _pkgtups(self.plain.sack.searchFiles(name)),
+                             name)
+            self.assertEqual(len(indexed), num, name)
+        self.assertEqual(_pkgtups(sack.searchFiles('/usr/share/*/README',
+                                                   strict=True)), [])
+        self.assertTrue(sack._filelists_index[self.indexed] is not None)
+        self.assertEqual(self.plain.sack._filelists_index[self.plain], None)
+
+    def testRebuild(self):
+        sack = self._indexed(_file_pkgs)
+        self.assertEqual(len(sack.searchFiles('/usr/lib/libfoo.so')), 1)
+        ino = os.stat(self._index()).st_ino
+
+        # Same filelists_db, so the index is reused.
+        sack = self._indexed(_file_pkgs)
+        self.assertEqual(len(sack.searchFiles('/usr/lib/libfoo.so')), 1)
+        self.assertEqual(os.stat(self._index()).st_ino, ino)
+
+        # New filelists_db, so it's rebuilt.
+        pkgs = _file_pkgs[:]
+        pkgs[0] = {'name' : 'foo', 'version' : '2',
+                   'files' : ['/usr/lib/libfoo.so']}
+        sack = self._indexed(pkgs)
+        self.assertEqual(len(sack.searchFiles('/usr/lib/libfoo.so')), 2)
+        self.assertEqual(sack.searchFiles('/usr/share/foo/README'), [])
+        self.assertNotEqual(os.stat(self._index()).st_ino, ino)
+
+_newest_repos = {
+    'a' : [{'name' : 'foo', 'arch' : 'x86_64', 'version' : '1.0'},
+           {'name' : 'foo', 'arch' : 'x86_64', 'version' : '1.0',
+            'release' : '9'},
+           {'name' : 'foo', 'arch' : 'x86_64', 'version' : '1.0',
+            'release' : '10'},
+           {'name' : 'foo', 'arch' : 'i686', 'version' : '1.0',
+            'release' : '10'},
+           {'name' : 'bar', 'arch' : 'x86_64', 'version' : '1.9'},
+           {'name' : 'bar', 'arch' : 'x86_64', 'version' : '2.0'},
+           {'name' : 'bar', 'version' : '2.0'},
+           {'name' : 'baz', 'version' : '1.9'},
+           {'name' : 'baz', 'version' : '1.10'}],
+    'b' : [{'name' : 'foo', 'arch' : 'x86_64', 'epoch' : '1',
+            'version' : '0.5'},
+           {'name' : 'bar', 'version' : '2.0', 'release' : '0.1'},
+           {'name' : 'baz', 'version' : '1.10'}],
+    }
+
+class _Names(object):
+    """ Something that isn't a static container, so excluders using it can't
+        be compiled. """
+    def __init__(self, names, fail=False):
+        self.names = names
+        self.fail = fail
+
+    def __contains__(self, name):
+        if self.fail:
+            raise ValueError(name)
+        return name in self.names
+
+class NewestTests(unittest.TestCase):
+    """ The newest packages done in sqlite, with the yum_newest()
+        aggregate, are the same as those from the package lists. """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-sqlitesack-')
+        self.num = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _metaSack(self, repoids=None):
+        ret = packageSack.MetaSack()
+        for repoid in repoids or sorted(_newest_repos):
+            self.num += 1
+            repo = makeSqliteRepo(self.tmpdir, '%s%d' % (repoid, self.num),
+                                  _newest_repos[repoid])
+            ret.addSack(repo.id, repo.sack)
+        return ret
+
+    def _nevras(self, pkgs):
+        return sorted([(po.pkgtup, po.repoid[0]) for po in pkgs])
+
+    def _check(self, repoids=None, excluders=(), setup=None):
+        for patterns in (None, ['foo'], ['ba*'], ['foo.i686'], ['*.x86_64']):
+            sack = self._metaSack(repoids)
+            ref = self._metaSack(repoids)
+            for excluder in excluders:
+                sack.addPackageExcluder(None, None, *excluder)
+                ref.addPackageExcluder(None, None, *excluder)
+            if setup is not None:
+                setup(sack)
+                setup(ref)
+            pkgs = ref.returnPackages(patterns=patterns)
+            self.assertEqual(
+                self._nevras(sack.returnNewestByNameArch(patterns=patterns)),
+                self._nevras(packageSack.packagesNewestByNameArch(pkgs)))
+            self.assertEqual(
+                self._nevras(sack.returnNewestByName(patterns=patterns)),
+                self._nevras(packageSack.packagesNewestByName(pkgs)))
+            for sub in sack.sacks.values():
+                self.assertFalse(hasattr(sub, 'pkgobjlist'))
+
+    def testOneRepo(self):
+        self._check(['a'])
+        pkgs = self._metaSack(['a']).returnNewestByNameArch()
+        self.assertEqual(sorted([(po.name, po.arch) for po in pkgs]),
+                         [('bar', 'noarch'), ('bar', 'x86_64'),
+                          ('baz', 'noarch'), ('foo', 'i686'),
+                          ('foo', 'x86_64')])
+        for po in pkgs:
+            if po.name == 'bar':
+                self.assertEqual(po.version, '2.0')
+        # Ties between arches are all newest, by name.
+        pkgs = self._metaSack(['a']).returnNewestByName(patterns=['bar'])
+        self.assertEqual(len(pkgs), 2)
+        self.assertEqual(self._metaSack(['a']).sacks.values()[0].
+                         returnNewestByNameArch(patterns=['nope']), [])
+
+    def testRepos(self):
+        self._check()
+        pkgs = self._metaSack().returnNewestByName(patterns=['foo'])
+        self.assertEqual([po.pkgtup for po in pkgs],
+                         [('foo', 'x86_64', '1', '0.5', '1')])
+
+    def testExcluded(self):
+        self._check(excluders=[('exclude.match', 'foo-1:0.5-1.x86_64'),
+                               ('exclude.match', 'bar-2.0-1.x86_64')])
+
+    def testNotCompiled(self):
+        # Excluders we can't compile are checked on the newest packages.
+        self._check(excluders=[('exclude.match', 'foo-1:0.5-1.x86_64'),
+                               ('exclude.name.in', _Names(['baz']))])
+
+    def testDeleted(self):
+        def setup(sack):
+            for po in sack.returnPackages(patterns=['bar']):
+                if po.version == '2.0' and po.release == '1':
+                    sack.delPackage(po)
+        self._check(setup=setup)
+        sack = self._metaSack(['a'])
+        setup(sack)
+        pkgs = sack.returnNewestByNameArch(('bar', 'x86_64'))
+        self.assertEqual([po.version for po in pkgs], ['1.9'])
+
+    def testArchs(self):
+        self._check(setup=lambda sack: sack.excludeArchs(['x86_64', 'i686']))
+
+    def testExcluderErrors(self):
+        # The excludes aren't done in a sqlite callback, so errors are ours.
+        sack = self._metaSack(['a'])
+        names = _Names(['nope'], fail=True)
+        sack.addPackageExcluder(None, None, 'exclude.name.in', names)
+        self.assertRaises(ValueError, sack.returnNewestByName, 'foo')
+
+    def testNameArch(self):
+        sack = self._metaSack()
+        ref = self._metaSack().returnPackages()
+        for (name, arch) in (('foo', 'x86_64'), ('foo', 'i686'),
+                             ('bar', 'noarch'), ('baz', 'noarch')):
+            pkgs = [po for po in ref if po.name == name and po.arch == arch]
+            self.assertEqual(
+                self._nevras(sack.returnNewestByNameArch((name, arch))),
+                self._nevras(packageSack.packagesNewestByNameArch(pkgs)))
+            pkgs = [po for po in ref if po.name == name]
+            self.assertEqual(
+                self._nevras(sack.returnNewestByName(name)),
+                self._nevras(packageSack.packagesNewestByName(pkgs)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+import unittest
+import settestpath
+
+import os
+import gzip
+import time
+import shutil
+import tempfile
+
+import yum
+from yum import misc
+from yum import yumRepo
+from testbase import FakeConf
+
+_repomd = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+ <revision>%(revision)s</revision>
+%(data)s</repomd>
+"""
+
+_data = """ <data type="%(type)s">
+  <checksum type="sha256">%(checksum)s</checksum>
+  <open-checksum type="sha256">%(openchecksum)s</open-checksum>
+  <location href="repodata/%(checksum)s-%(type)s.xml.gz"/>
+  <timestamp>%(revision)s</timestamp>
+  <size>%(size)d</size>
+ </data>
+"""
+
+class _FakeRepos:
+    def __init__(self, repos):
+        self.repos = repos
+    def listEnabled(self):
+        return self.repos
+    def sort(self):
+        return self.repos
+    def close(self):
+        pass
+
+class StagedRefreshTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-staged-')
+        self.srcdir = self.tmpdir + '/src'
+        os.makedirs(self.srcdir + '/repodata')
+        self.cachedir = self.tmpdir + '/cache/stagedtest'
+        self._publish('1', {'updateinfo' : 'updates 1', 'group_gz' : 'groups'})
+        self.repo = self._repo()
+        self.repo.repoXML
+        self.assertEqual(self._gen('updateinfo'), 'updates 1')
+        self.assertEqual(self._gen('group_gz'), 'groups')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _publish(self, revision, files):
+        """ Write the files of a new version of the repo. """
+        data = []
+        for mdtype in sorted(files):
+            fname = self.srcdir + '/tmp.gz'
+            fo = gzip.GzipFile(fname, 'w', mtime=0)
+            fo.write(files[mdtype])
+            fo.close()
+            checksum = misc.checksum('sha256', fname)
+            dest = '%s/repodata/%s-%s.xml.gz' % (self.srcdir, checksum, mdtype)
+            os.rename(fname, dest)
+            os.utime(dest, (int(revision), int(revision)))
+            openchecksum = misc.Checksums(['sha256'])
+            openchecksum.update(files[mdtype])
+            data.append(_data % {'type' : mdtype, 'revision' : revision,
+                                 'checksum' : checksum,
+                                 'openchecksum' : openchecksum.hexdigest(),
+                                 'size' : os.path.getsize(dest)})
+        open(self.srcdir + '/repodata/repomd.xml', 'w').write(
+            _repomd % {'revision' : revision, 'data' : ''.join(data)})
+
+    def _repo(self):
+        """ A new repo. object for the cache, like a new yum process. """
+        repo = yumRepo.YumRepository('stagedtest')
+        repo.basecachedir = self.tmpdir + '/cache'
+        repo.base_persistdir = self.tmpdir + '/persist'
+        repo.baseurl = ['file://' + self.srcdir + '/']
+        repo.repo_gpgcheck = False
+        repo.mdpolicy = ['group:all']
+        return repo
+
+    def _gen(self, mdtype, repo=None):
+        """ Decompress the mdtype, and return the data. """
+        if repo is None:
+            repo = self.repo
+        fname = misc.repo_gen_decompress(repo.retrieveMD(mdtype),
+                                         mdtype + '.xml')
+        return open(fname).read()
+
+    def _expire(self):
+        cookie = self.cachedir + '/cachecookie'
+        old = time.time() - (7 * 24 * 60 * 60)
+        os.utime(cookie, (old, old))
+
+    def testCommit(self):
+        self._publish('2', {'updateinfo' : 'updates 2', 'group_gz' : 'groups'})
+        old = sorted(os.listdir(self.cachedir))
+        group = self.repo.retrieveMD('group_gz')
+
+        repo = self._repo()
+        repo.metadata_expire = 0
+        repo._stageSetup()
+        self.assertEqual(repo.cachedir, self.cachedir + '/staging')
+        staged = repo._parseRepoXML(repo.cachedir + '/repomd.xml')
+        self.assertEqual(staged.revision, '1')
+        self.assertEqual(repo.repoXML.revision, '2')
+        self.assertEqual(self._gen('updateinfo', repo), 'updates 2')
+        self.assertEqual(self._gen('group_gz', repo), 'groups')
+        # Unchanged metadata is shared, not copied or downloaded again.
+        staged = repo.retrieveMD('group_gz')
+        self.assertEqual(os.stat(staged).st_ino, os.stat(group).st_ino)
+
+        # Nothing in the real cachedir has changed.
+        self.assertEqual(sorted(os.listdir(self.cachedir)), old + ['staging'])
+        nrepo = self._repo()
+        self.assertEqual(nrepo.repoXML.revision, '1')
+        self.assertEqual(self._gen('updateinfo', nrepo), 'updates 1')
+
+        repo._stageCommit()
+        repo._stageClose()
+        self.assertEqual(repo.cachedir, self.cachedir)
+        self.assertFalse(os.path.exists(self.cachedir + '/staging'))
+        nrepo = self._repo()
+        self.assertEqual(nrepo.repoXML.revision, '2')
+        self.assertEqual(open(self.cachedir + '/gen/updateinfo.xml').read(),
+                         'updates 2')
+        # The old updateinfo is gone.
+        self.assertEqual(len(os.listdir(self.cachedir)), len(old))
+        self.assertFalse(os.path.exists(self.repo.retrieveMD('updateinfo')))
+
+    def testClose(self):
+        self._publish('2', {'updateinfo' : 'updates 2', 'group_gz' : 'groups'})
+        repo = self._repo()
+        repo.metadata_expire = 0
+        repo._stageSetup()
+        self.assertEqual(self._gen('updateinfo', repo), 'updates 2')
+        repo._stageClose()
+        self.assertFalse(os.path.exists(self.cachedir + '/staging'))
+        nrepo = self._repo()
+        self.assertEqual(nrepo.repoXML.revision, '1')
+        self.assertEqual(self._gen('updateinfo', nrepo), 'updates 1')
+
+    def testBackground(self):
+        self._publish('2', {'updateinfo' : 'updates 2', 'group_gz' : 'groups'})
+        self._expire()
+        repo = self._repo()
+        repo.metadata_refresh = 'background'
+        self.assertEqual(repo.repoXML.revision, '1')
+
+        self._expire()
+        repo = self._repo()
+        self.assertEqual(repo.repoXML.revision, '2')
+
+    def testPerRepoBackground(self):
+        #  Only the repo. says background, "yum makecache" and yum-cron still
+        # refresh it.
+        self._publish('2', {'updateinfo' : 'updates 2', 'group_gz' : 'groups'})
+        self._expire()
+        repo = self._repo()
+        repo.metadata_refresh = 'background'
+        yb = yum.YumBase()
+        yb._conf = FakeConf()
+        yb._conf.cachedir = self.tmpdir + '/cache'
+        del yb.prerepoconf
+        yb._repos = _FakeRepos([repo])
+        self.assertTrue(yb.stageMetadataNeeded())
+
+        yb.stageMetadata()
+        repo.metadata_expire = 0
+        self.assertEqual(repo.repoXML.revision, '2')
+        self.assertEqual(yb.commitStagedMetadata(), [repo])
+
+        repo = self._repo()
+        repo.metadata_refresh = 'background'
+        self.assertEqual(repo.repoXML.revision, '2')
+
+        yb._repos.repos[0].metadata_refresh = 'foreground'
+        self.assertFalse(yb.stageMetadataNeeded())
+
+    def testDecompressLinked(self):
+        gen = self.cachedir + '/gen/updateinfo.xml'
+        os.link(gen, self.tmpdir + '/linked')
+        os.utime(gen, (0, 0))
+        self._gen('updateinfo')
+        self.assertEqual(open(self.tmpdir + '/linked').read(), 'updates 1')
+        self.assertNotEqual(os.stat(gen).st_ino,
+                            os.stat(self.tmpdir + '/linked').st_ino)
@@ -1,6 +1,11 @@
 import os
 import sys
+import time
 import unittest
+import threading
+import BaseHTTPServer
+import SocketServer
+import StringIO
 
 import settestpath
 import logging
@@ -12,6 +17,12 @@ from yum import YumBase
 from yum import transactioninfo
 from yum import packages
 from yum import packageSack
+from yum import misc
+from yum import repoMDObject
+from yum import sqlitesack
+from yum import sqlutils
+from yum import xml2sqlite
+from yum import yumRepo
 from yum.constants import TS_INSTALL_STATES, TS_REMOVE_STATES
 from cli import YumBaseCli
 from yum.rpmsack import RPMDBPackageSack as _rpmdbsack
@@ -249,7 +260,187 @@ class DepSolveProgressCallBack:
     def downloadHeader(self, name):
         self.verbose_logger.log(logginglevels.INFO_2, _('---> Downloading header for %s '
             'to pack into transaction set.'), name)
-      
+
+
+class _HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves the files of a TestHTTPServer. """
+    def do_GET(self):
+        srv = self.server
+        cond = (self.headers.getheader('If-None-Match'),
+                self.headers.getheader('If-Modified-Since'))
+        rng = self.headers.getheader('Range')
+        srv.requests.append((self.path, cond, rng))
+        time.sleep(srv.delay)
+        if srv.error is not None:
+            self.send_response(srv.error)
+            self.end_headers()
+            return
+        if self.path not in srv.files:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        (version, data) = srv.files[self.path]
+        etag = '"v%d"' % version
+        modified = 'Mon, 0%d Jan 2024 00:00:00 GMT' % version
+        if cond == (etag, modified):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        if rng:
+            (start, end) = rng.split('=')[1].split('-')
+            (start, end) = (int(start), int(end) + 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, end - 1, len(data)))
+            data = data[start:end]
+            if srv.corrupt:
+                data = 'X' + data[1:]
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', modified)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class TestHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ A local HTTP server, running in a thread, for the download tests.
+        It serves the files from serve(), with an ETag and Last-Modified for
+        each version of them, 304s for conditional requests, and byte
+        ranges. """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _HTTPHandler)
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        self.files = {}    # path => (version, data)
+        self.requests = [] # (path, (If-None-Match, If-Modified-Since), Range)
+        self.delay = 0     # Seconds to wait before each response
+        self.error = None  # Respond with this code, instead of the file
+        self.corrupt = False # Damage the data in range responses
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def serve(self, path, data):
+        """ Serve data at path, as a new version if it's already there. """
+        version = self.files.get(path, (0, None))[0] + 1
+        self.files[path] = (version, data)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+def _sqlitePkgXML(pkg):
+    """ The primary and filelists XML for one of makeSqliteRepo()'s pkgs. """
+    def entries(tag, deps):
+        ret = ['    <rpm:%s>' % tag]
+        for dep in deps:
+            if isinstance(dep, basestring):
+                dep = (dep,)
+            attrs = ' name="%s"' % dep[0]
+            if len(dep) > 1:
+                (flags, (e, v, r)) = (dep[1], dep[2])
+                attrs += ' flags="%s" epoch="%s" ver="%s"' % (flags, e, v)
+                if r is not None:
+                    attrs += ' rel="%s"' % r
+            ret.append('      <rpm:entry%s/>' % attrs)
+        ret.append('    </rpm:%s>' % tag)
+        return '\n'.join(ret)
+
+    (n, a, e, v, r) = (pkg['name'], pkg.get('arch', 'noarch'),
+                       pkg.get('epoch', '0'), pkg.get('version', '1'),
+                       pkg.get('release', '1'))
+    pkgid = misc.checksum('sha256', StringIO.StringIO(repr(pkg)))
+    version = '<version epoch="%s" ver="%s" rel="%s"/>' % (e, v, r)
+    files = ['    <file>%s</file>' % fname for fname in pkg.get('files', [])]
+    provides = [(n, 'EQ', (e, v, r))] + pkg.get('provides', [])
+    primary = """<package type="rpm">
+  <name>%s</name>
+  <arch>%s</arch>
+  %s
+  <checksum type="sha256" pkgid="YES">%s</checksum>
+  <summary>%s</summary>
+  <description>%s</description>
+  <url>%s</url>
+  <location href="%s-%s-%s.%s.rpm"/>
+  <format>
+%s
+%s
+%s
+  </format>
+</package>
+""" % (n, a, version, pkgid, pkg.get('summary', n),
+       pkg.get('description', ''), pkg.get('url', ''), n, v, r, a,
+       entries('provides', provides), entries('requires',
+                                               pkg.get('requires', [])),
+       '\n'.join(files))
+    filelists = """<package pkgid="%s" name="%s" arch="%s">
+  %s
+%s
+</package>
+""" % (pkgid, n, a, version, '\n'.join(files))
+    return (primary, filelists)
+
+def makeSqliteRepo(tmpdir, repoid, pkgs):
+    """ Make a YumRepository, with a YumSqlitePackageSack, for pkgs. Each of
+        pkgs is a dict. with a name, and optional arch, epoch, version,
+        release, summary, description, url, files, provides and requires.
+        The provides and requires are names or (name, flags, (epoch, ver,
+        rel)). The sqlite DBs are made by xml2sqlite, and repomd.xml has
+        their checksums, so calling this again with different pkgs is a new
+        version of the repo. """
+    repodir = '%s/%s-repo' % (tmpdir, repoid)
+    if not os.path.exists(repodir):
+        os.makedirs(repodir)
+    xml = {'primary' : [], 'filelists' : []}
+    for pkg in pkgs:
+        (primary, filelists) = _sqlitePkgXML(pkg)
+        xml['primary'].append(primary)
+        xml['filelists'].append(filelists)
+
+    header = {'primary' : '<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">',
+              'filelists' : '<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="%d">'}
+    repomd = ['<?xml version="1.0" encoding="UTF-8"?>',
+              '<repomd xmlns="http://linux.duke.edu/metadata/repo">']
+    dbs = {}
+    for mdtype in ('primary', 'filelists'):
+        fname = '%s/%s.xml' % (repodir, mdtype)
+        fo = open(fname, 'w')
+        fo.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        fo.write(header[mdtype] % len(pkgs) + '\n')
+        fo.write(''.join(xml[mdtype]))
+        fo.write('</%s>\n' % header[mdtype].split()[0][1:])
+        fo.close()
+        csum = misc.checksum('sha256', fname)
+        dbname = '%s/%s.sqlite' % (repodir, mdtype)
+        misc.unlink_f(dbname)
+        xml2sqlite.xml2sqlite(fname, dbname, csum)
+        dbs[mdtype] = dbname
+        repomd.append('<data type="%s_db"><checksum type="sha256">%s</checksum>'
+                      '<location href="repodata/%s.sqlite"/></data>' %
+                      (mdtype, csum, mdtype))
+    repomd.append('</repomd>')
+    open(repodir + '/repomd.xml', 'w').write('\n'.join(repomd) + '\n')
+
+    repo = yumRepo.YumRepository(repoid)
+    repo.basecachedir = tmpdir
+    repo.base_persistdir = tmpdir + '/persist'
+    repo.repoXML = repoMDObject.RepoMD(repoid, repodir + '/repomd.xml')
+    repo._sack = sqlitesack.YumSqlitePackageSack(sqlitesack.YumAvailablePackageSqlite)
+    for (mdtype, datatype) in (('primary', 'metadata'),
+                               ('filelists', 'filelists')):
+        conn = sqlutils.sqlite.connect(dbs[mdtype])
+        conn.row_factory = sqlutils.sqlite.Row
+        repo.sack.addDict(repo, datatype, conn)
+    return repo
+
 #######################################################################
 ### Abstract super class for test cases ###############################
 #######################################################################
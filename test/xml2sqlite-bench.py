@@ -0,0 +1,144 @@
+#! /usr/bin/python -tt
+
+# Do either:
+# ./xml2sqlite-bench.py
+# ./xml2sqlite-bench.py <num packages>
+#
+# Generates primary.xml and filelists.xml files for a lot of fake packages
+# (20,000 by default, with 40 files each), and times converting them to
+# sqlite at a quarter, half and all of that size: with xml2sqlite, with
+# yum-metadata-parser if it's installed, and just loading them with MDParser
+# (as a list of package entries). Each is run in a child process, so the peak
+# memory (maxrss) of each can be shown.
+
+import sys, os, time, tempfile, shutil, resource, gc
+from yum import xml2sqlite
+from yum import mdparser
+
+try:
+    import sqlitecachec
+    if not hasattr(sqlitecachec.RepodataParserSqlite, 'getPrimary'):
+        sqlitecachec = None
+except ImportError:
+    sqlitecachec = None
+
+def _primary(fo, num):
+    fo.write("""<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">
+""" % num)
+    for i in xrange(num):
+        fo.write("""<package type="rpm">
+  <name>pkg%(i)d</name>
+  <arch>x86_64</arch>
+  <version epoch="0" ver="1.%(i)d" rel="1.fc20"/>
+  <checksum type="sha256" pkgid="YES">%(sum)064x</checksum>
+  <summary>Package number %(i)d</summary>
+  <description>This is package number %(i)d, it doesn't do much.</description>
+  <packager>Fedora Project</packager>
+  <url>http://example.com/pkg%(i)d</url>
+  <time file="1400000000" build="1390000000"/>
+  <size package="%(i)d000" installed="%(i)d0000" archive="%(i)d0100"/>
+  <location href="Packages/p/pkg%(i)d-1.%(i)d-1.fc20.x86_64.rpm"/>
+  <format>
+    <rpm:license>GPLv2+</rpm:license>
+    <rpm:vendor>Fedora Project</rpm:vendor>
+    <rpm:group>Applications/System</rpm:group>
+    <rpm:buildhost>builder.example.com</rpm:buildhost>
+    <rpm:sourcerpm>pkg%(i)d-1.%(i)d-1.fc20.src.rpm</rpm:sourcerpm>
+    <rpm:header-range start="880" end="%(i)d880"/>
+    <rpm:provides>
+      <rpm:entry name="pkg%(i)d" flags="EQ" epoch="0" ver="1.%(i)d" rel="1.fc20"/>
+      <rpm:entry name="pkg%(i)d(x86-64)" flags="EQ" epoch="0" ver="1.%(i)d" rel="1.fc20"/>
+      <rpm:entry name="libpkg%(i)d.so.1()(64bit)"/>
+    </rpm:provides>
+    <rpm:requires>
+      <rpm:entry name="/bin/sh" pre="1"/>
+      <rpm:entry name="libc.so.6()(64bit)"/>
+      <rpm:entry name="pkg%(dep)d" flags="GE" epoch="0" ver="1.0"/>
+    </rpm:requires>
+    <file>/usr/bin/pkg%(i)d</file>
+  </format>
+</package>
+""" % {'i' : i, 'sum' : i, 'dep' : (i * 7) % num})
+    fo.write("</metadata>\n")
+
+def _filelists(fo, num):
+    fo.write("""<?xml version="1.0" encoding="UTF-8"?>
+<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="%d">
+""" % num)
+    for i in xrange(num):
+        fo.write("""<package pkgid="%064x" name="pkg%d" arch="x86_64">
+  <version epoch="0" ver="1.%d" rel="1.fc20"/>
+""" % (i, i, i))
+        fo.write('  <file>/usr/bin/pkg%d</file>\n' % i)
+        fo.write('  <file type="dir">/usr/share/pkg%d</file>\n' % i)
+        for j in xrange(38):
+            fo.write('  <file>/usr/share/pkg%d/data/file%d.dat</file>\n' % (i, j))
+        fo.write("</package>\n")
+    fo.write("</filelists>\n")
+
+def _xml2sqlite(xml, db):
+    xml2sqlite.xml2sqlite(xml, db, 'bench')
+
+def _sqlitecachec(xml, db):
+    parser = sqlitecachec.RepodataParserSqlite(os.path.dirname(xml), 'bench')
+    if 'primary' in xml:
+        parser.getPrimary(xml, 'bench')
+    else:
+        parser.getFilelists(xml, 'bench')
+
+def _mdparser(xml, db):
+    pkgs = list(mdparser.MDParser(xml))
+
+def _run(func, xml, db):
+    """ Run func(xml, db) in a child, return (ms, maxrss KB). """
+    for fname in (db, xml + '.sqlite'):
+        if os.path.exists(fname):
+            os.unlink(fname)
+    sys.stdout.flush()
+    pid = os.fork()
+    if not pid:
+        gc.collect()
+        try:
+            func(xml, db)
+        except:
+            os._exit(1)
+        os._exit(0)
+    stime = time.time()
+    (pid, status, rusage) = os.wait4(pid, 0)
+    ms = (time.time() - stime) * 1000
+    if status:
+        return None
+    return (ms, rusage.ru_maxrss)
+
+def main():
+    num = 20000
+    if len(sys.argv) > 1:
+        num = int(sys.argv[1])
+
+    funcs = [("xml2sqlite", _xml2sqlite)]
+    if sqlitecachec is not None:
+        funcs.append(("sqlitecachec", _sqlitecachec))
+    funcs.append(("MDParser (list)", _mdparser))
+
+    tmpdir = tempfile.mkdtemp(prefix='yum-xml2sqlite-')
+    try:
+        for mdtype, gen in (('primary', _primary), ('filelists', _filelists)):
+            for size in (num / 4, num / 2, num):
+                xml = '%s/%s.xml' % (tmpdir, mdtype)
+                fo = open(xml, 'w')
+                gen(fo, size)
+                fo.close()
+                print "%s.xml, %d packages (%.1fMB):" % (
+                    mdtype, size, os.path.getsize(xml) / (1024.0 * 1024))
+                for (name, func) in funcs:
+                    ret = _run(func, xml, xml + '.db')
+                    if ret is None:
+                        print "  %-20s %10s" % (name, "failed")
+                        continue
+                    print "  %-20s %10.3fms %8dKB maxrss" % (name, ret[0], ret[1])
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
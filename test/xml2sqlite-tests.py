@@ -0,0 +1,171 @@
+import unittest
+import settestpath
+
+import os
+import shutil
+import tempfile
+
+from yum import xml2sqlite
+from yum.Errors import MiscError
+from yum.sqlutils import sqlite
+
+_primary = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="2">
+<package type="rpm">
+  <name>foo</name>
+  <arch>noarch</arch>
+  <version epoch="0" ver="1.0" rel="1"/>
+  <checksum type="sha256" pkgid="YES">aaaa</checksum>
+  <summary>The foo</summary>
+  <description>Foo, with \xc3\xbcnicode.</description>
+  <packager>Someone</packager>
+  <url>http://example.com/foo</url>
+  <time file="1400000001" build="1400000000"/>
+  <size package="100" installed="200" archive="300"/>
+  <location xml:base="http://example.com/base" href="foo-1.0-1.noarch.rpm"/>
+  <format>
+    <rpm:license>GPL</rpm:license>
+    <rpm:group>Tools</rpm:group>
+    <rpm:sourcerpm>foo-1.0-1.src.rpm</rpm:sourcerpm>
+    <rpm:header-range start="10" end="20"/>
+    <rpm:provides>
+      <rpm:entry name="foo" flags="EQ" epoch="0" ver="1.0" rel="1"/>
+    </rpm:provides>
+    <rpm:requires>
+      <rpm:entry name="/bin/sh" pre="1"/>
+      <rpm:entry name="bar" flags="GE" epoch="0" ver="2"/>
+    </rpm:requires>
+    <rpm:recommends>
+      <rpm:entry name="baz"/>
+    </rpm:recommends>
+    <file>/usr/bin/foo</file>
+    <file type="dir">/etc/foo</file>
+  </format>
+</package>
+<package type="rpm">
+  <name>bar</name>
+  <arch>x86_64</arch>
+  <version epoch="1" ver="2.0" rel="3"/>
+  <checksum type="sha256" pkgid="YES">bbbb</checksum>
+  <location href="bar-2.0-3.x86_64.rpm"/>
+  <format/>
+</package>
+</metadata>
+"""
+
+_filelists = """<?xml version="1.0" encoding="UTF-8"?>
+<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="2">
+<package pkgid="aaaa" name="foo" arch="noarch">
+  <version epoch="0" ver="1.0" rel="1"/>
+  <file>/usr/bin/foo</file>
+  <file type="dir">/etc/foo</file>
+  <file>/etc/foo/a.conf</file>
+  <file type="ghost">/etc/foo/b.conf</file>
+  <file>/usr/bin/foo2</file>
+</package>
+<package pkgid="bbbb" name="bar" arch="x86_64">
+  <version epoch="1" ver="2.0" rel="3"/>
+</package>
+</filelists>
+"""
+
+_other = """<?xml version="1.0" encoding="UTF-8"?>
+<otherdata xmlns="http://linux.duke.edu/metadata/other" packages="1">
+<package pkgid="aaaa" name="foo" arch="noarch">
+  <version epoch="0" ver="1.0" rel="1"/>
+  <changelog author="Someone &lt;a@b.c&gt; - 1.0-1" date="1400000000">- New.</changelog>
+  <changelog author="Someone" date="1300000000">- Old.</changelog>
+</package>
+</otherdata>
+"""
+
+class _Callback:
+    def __init__(self):
+        self.calls = []
+    def progressbar(self, current, total, name):
+        self.calls.append((current, total, name))
+
+class XML2SqliteTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='yum-xml2sqlite-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _convert(self, name, data, checksum='csum', callback=None):
+        xml = self.tmpdir + '/' + name + '.xml'
+        open(xml, 'w').write(data)
+        db = xml2sqlite.xml2sqlite(xml, xml + '.sqlite', checksum, callback,
+                                   'repoid')
+        self.assertEqual(db, xml + '.sqlite')
+        self.assertEqual(os.listdir(self.tmpdir).count(name + '.xml.sqlite'), 1)
+        self.assertEqual([x for x in os.listdir(self.tmpdir)
+                          if x.endswith('.tmp')], [])
+        return sqlite.connect(db)
+
+    def testPrimary(self):
+        callback = _Callback()
+        conn = self._convert('primary', _primary, callback=callback)
+        self.assertEqual(callback.calls, [(2, 2, 'repoid')])
+        self.assertEqual(list(conn.execute("SELECT * FROM db_info")),
+                         [(10, 'csum')])
+        rows = list(conn.execute("""SELECT pkgKey, pkgId, name, epoch, version,
+                                    release, description, time_file,
+                                    size_archive, location_base,
+                                    rpm_header_end, rpm_packager
+                                    FROM packages ORDER BY pkgKey"""))
+        self.assertEqual(rows, [(1, 'aaaa', 'foo', '0', '1.0', '1',
+                                 u'Foo, with \xfcnicode.', 1400000001, 300,
+                                 'http://example.com/base', 20, 'Someone'),
+                                (2, 'bbbb', 'bar', '1', '2.0', '3',
+                                 None, None, None, None, None, None)])
+        self.assertEqual(list(conn.execute("SELECT * FROM files")),
+                         [('/usr/bin/foo', 'file', 1), ('/etc/foo', 'dir', 1)])
+        self.assertEqual(list(conn.execute("SELECT * FROM requires")),
+                         [('/bin/sh', None, None, None, None, 1, 'TRUE'),
+                          ('bar', 'GE', '0', '2', None, 1, 'FALSE')])
+        self.assertEqual(list(conn.execute("SELECT name FROM recommends")),
+                         [('baz',)])
+        self.assertEqual(list(conn.execute("SELECT * FROM obsoletes")), [])
+        # The indexes yum-metadata-parser makes are there too.
+        indexes = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertTrue('packagename' in indexes)
+        self.assertTrue('pkgprovides' in indexes)
+
+    def testFilelists(self):
+        conn = self._convert('filelists', _filelists)
+        self.assertEqual(list(conn.execute("SELECT * FROM packages")),
+                         [(1, 'aaaa'), (2, 'bbbb')])
+        self.assertEqual(list(conn.execute("SELECT * FROM filelist")),
+                         [(1, '/usr/bin', 'foo/foo2', 'ff'),
+                          (1, '/etc', 'foo', 'd'),
+                          (1, '/etc/foo', 'a.conf/b.conf', 'fg')])
+
+    def testOther(self):
+        conn = self._convert('other', _other)
+        self.assertEqual(list(conn.execute("SELECT * FROM changelog")),
+                         [(1, 'Someone <a@b.c> - 1.0-1', 1400000000, '- New.'),
+                          (1, 'Someone', 1300000000, '- Old.')])
+
+    def testCurrent(self):
+        self._convert('primary', _primary).close()
+        db = self.tmpdir + '/primary.xml.sqlite'
+        st = os.stat(db)
+        self._convert('primary', _primary).close()
+        self.assertEqual(os.stat(db).st_ino, st.st_ino)
+        self._convert('primary', _primary, 'new').close()
+        self.assertNotEqual(os.stat(db).st_ino, st.st_ino)
+
+    def testBroken(self):
+        self._convert('primary', _primary).close()
+        db = self.tmpdir + '/primary.xml.sqlite'
+        open(self.tmpdir + '/primary.xml', 'w').write(_primary[:-100])
+        self.assertRaises(MiscError, xml2sqlite.xml2sqlite,
+                          self.tmpdir + '/primary.xml', db, 'new')
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['primary.xml', 'primary.xml.sqlite'])
+        open(self.tmpdir + '/primary.xml', 'w').write(
+            _primary.replace('metadata', 'notmetadata'))
+        self.assertRaises(MiscError, xml2sqlite.xml2sqlite,
+                          self.tmpdir + '/primary.xml', db, 'new')
@@ -421,12 +421,23 @@ class YumCronBase(yum.YumBase, YumOutput):
     def populateUpdateMetadata(self):
         """Populate the metadata for the packages in the update."""
 
-        for repo in self.repos.sort():
-            repo.metadata_expire = 0
-            repo.skip_if_unavailable = True
+        #  With metadata_refresh=background this is what refreshes it, still
+        # via. staging dirs so yum never sees partly updated metadata.
+        staged = self.stageMetadataNeeded()
+        if staged:
+            self.stageMetadata()
 
-        self.pkgSack # honor skip_if_unavailable
-        self.upinfo
+        try:
+            for repo in self.repos.sort():
+                repo.metadata_expire = 0
+                repo.skip_if_unavailable = True
+
+            self.pkgSack # honor skip_if_unavailable
+            self.upinfo
+            if staged:
+                self.commitStagedMetadata()
+        finally:
+            self.closeStagedMetadata()
 
     def refreshUpdates(self):
         """Check whether updates are available.
@@ -78,6 +78,7 @@ import depsolve
 import plugins
 import logginglevels
 import yumRepo
+import sqlitesack
 import callbacks
 import yum.history
 import yum.fssnapshots
@@ -107,6 +108,11 @@ try:
 except ImportError:
     cashe = None
 
+try:
+    import multiprocessing
+except ImportError: # python-2.4/2.5
+    multiprocessing = None
+
 __version__ = '3.4.3'
 __version_info__ = tuple([ int(num) for num in __version__.split('.')])
 
@@ -116,6 +122,26 @@ __version_info__ = tuple([ int(num) for num in __version__.split('.')])
 # multiple YumBase() objects.
 default_grabber.opts.user_agent += " yum/" + __version__
 
+_sigcheck_ts = None
+def _sigcheck_worker(args):
+    """ Run rpmUtils.miscutils.checkSig() on a package in a worker process,
+        with a transaction set of its own. Any problems are left for
+        sigCheckPkg() to find (and report) again. """
+    global _sigcheck_ts
+    (root, fname) = args
+    try:
+        if _sigcheck_ts is None:
+            _sigcheck_ts = rpmUtils.transaction.initReadOnlyTransaction(root)
+        return rpmUtils.miscutils.checkSig(_sigcheck_ts, fname)
+    except KeyboardInterrupt:
+        return None
+    except Exception:
+        return None
+
+def _sigcheck_stat(fname):
+    """ What identifies the version of the file a signature check was of. """
+    st = os.stat(fname)
+    return (st.st_ino, st.st_dev, st.st_mtime, st.st_size)
 
 class _YumPreBaseConf:
     """This is the configuration interface for the :class:`YumBase`
@@ -201,6 +227,8 @@ class YumBase(depsolve.Depsolve):
         self._igroups = None
         self._pkgSack = None
         self._lockfile = None
+        self._staging_lockfile = None
+        self._staged_repos = []
         self._tags = None
         self._upinfo = None
         self._fssnap = None
@@ -212,6 +240,9 @@ class YumBase(depsolve.Depsolve):
         self.verbose_logger = logging.getLogger("yum.verbose.YumBase")
         self.file_logger = logging.getLogger("yum.filelogging.YumBase")
         self._override_sigchecks = False
+        self._sigcheck_pool = None
+        self._sigcheck_queued = {}
+        self._sigcheck_results = {}
         self._repos = RepoStorage(self)
         self.repo_setopts = {} # since we have to use repo_setopts in base and 
                                # not in cli - set it up as empty so no one
@@ -256,6 +287,8 @@ class YumBase(depsolve.Depsolve):
         if self._repos:
             self._repos.close()
 
+        self._sigCheckAbort()
+
     def _transactionDataFactory(self):
         """Factory method returning TransactionData object"""
         return transactioninfo.TransactionData()
@@ -794,6 +827,8 @@ class YumBase(depsolve.Depsolve):
         if not self.repos.getPackageSack():
             return self.repos.getPackageSack() # ha ha, see above
         self._pkgSack = self.repos.getPackageSack()
+        if self.conf.attach_primary_dbs:
+            sqlitesack.attachPrimaryDBs(self._pkgSack.sacks.values())
         
         self.excludePackages()
         self._pkgSack.excludeArchs(archlist)
@@ -2339,6 +2374,86 @@ much more problems).
                 raise Errors.LockError(errno.EPERM, msg, oldpid)
         return oldpid
 
+    def stageMetadata(self, repos=None):
+        """Setup the repositories so that their metadata is refreshed in
+        staging directories, inside their caches. Nothing the other yum
+        commands use is changed, so the yum lock isn't needed while the
+        metadata is downloaded and set up. Then
+        :func:`commitStagedMetadata` (with the yum lock) moves it into the
+        caches. This must be called before the repositories are setup.
+
+        :param repos: the repositories to stage, defaults to all of the
+           enabled ones
+        :raises: :class:`yum.Errors.LockError` if another process is
+           staging metadata
+        """
+        lockfile = os.path.normpath(self.conf.cachedir + '/staging.pid')
+        mypid = str(os.getpid())
+        while not self._staging_lockfile:
+            ret = self._lock(lockfile, mypid, 0644)
+            if ret == 1:
+                self._staging_lockfile = lockfile
+                break
+            if ret == 2:
+                break # No cachedir, so nothing to stage
+            oldpid = self._get_locker(lockfile)
+            if not oldpid:
+                self._unlock(lockfile)
+                continue
+            msg = _('Existing lock %s: another copy is running as pid %s.') % (lockfile, oldpid)
+            raise Errors.LockError(0, msg, oldpid)
+
+        if repos is None:
+            repos = self.repos.listEnabled()
+        try:
+            for repo in repos:
+                repo._stageSetup()
+                self._staged_repos.append(repo)
+        except:
+            self.closeStagedMetadata()
+            raise
+
+    def stageMetadataNeeded(self):
+        """Return True if any of the enabled repositories have
+        metadata_refresh=background, so their metadata is only refreshed
+        by :func:`stageMetadata` (it doesn't expire otherwise).
+
+        :return: True if the metadata should be staged
+        """
+        for repo in self.repos.listEnabled():
+            if repo.metadata_refresh == 'background':
+                return True
+        return False
+
+    def commitStagedMetadata(self):
+        """Move the metadata from :func:`stageMetadata` into the caches of
+        the repositories which are still enabled, and remove the staging
+        directories. This should be called with the yum lock.
+
+        :return: a list of the repositories that were updated
+        """
+        ret = []
+        try:
+            enabled = self.repos.listEnabled()
+            for repo in self._staged_repos:
+                if repo in enabled:
+                    repo._stageCommit()
+                    ret.append(repo)
+        finally:
+            self.closeStagedMetadata()
+        return ret
+
+    def closeStagedMetadata(self):
+        """Point the repositories from :func:`stageMetadata` back at their
+        caches, without moving anything into them, and remove the staging
+        directories."""
+        for repo in self._staged_repos:
+            repo._stageClose()
+        self._staged_repos = []
+        if self._staging_lockfile:
+            self._unlock(self._staging_lockfile)
+            self._staging_lockfile = None
+
     def verifyPkg(self, fo, po, raiseError):
         """Check that the checksum of a remote package matches what we
         expect it to be.  If the checksum of the package file is
@@ -2433,9 +2548,14 @@ much more problems).
             a = apo.getDiscNum()
             b = bpo.getDiscNum()
             if a is None and b is None:
-                # deltas first to start rebuilding asap
-                return cmp(isinstance(bpo, DeltaPackage),
-                           isinstance(apo, DeltaPackage)) or cmp(apo, bpo)
+                #  deltas first to start rebuilding asap, then the biggest
+                # first. parallel_wait() starts them in this order, picking
+                # the mirror for each when it starts (from how fast they've
+                # been so far), so the small ones left at the end fill in
+                # around the big ones instead of a big one finishing last.
+                return (cmp(isinstance(bpo, DeltaPackage),
+                            isinstance(apo, DeltaPackage)) or
+                        cmp(bpo.size, apo.size) or cmp(apo, bpo))
             if a is None:
                 return -1
             if b is None:
@@ -2494,150 +2614,162 @@ much more problems).
                 po.basepath # prefetch now; fails when repos are closed
             return False
 
-        pkgs = []
-        for po in pkglist:
-            if hasattr(po, 'pkgtype') and po.pkgtype == 'local':
-                continue
-            if verify_local(po):
-                continue
-            if errors:
-                return errors
-            pkgs.append(po)
+        #  Check the signatures of the packages in worker processes, as they
+        # are downloaded, instead of one at a time in _checkSignatures().
+        if not downloadonly:
+            self._sigCheckStart(len(pkglist))
 
-        # download presto metadata and use drpms
-        presto = DeltaInfo(self, pkgs, adderror)
-        deltasize = rpmsize = 0
-        for po in pkgs:
-            if isinstance(po, DeltaPackage):
+        try:
+            pkgs = []
+            for po in pkglist:
+                if hasattr(po, 'pkgtype') and po.pkgtype == 'local':
+                    continue
                 if verify_local(po):
-                    # there's .drpm already, use it
-                    presto.rebuild(po)
+                    self._sigCheckQueue(po)
                     continue
-                deltasize += po.size
-                rpmsize += po.rpm.size
-            remote_pkgs.append(po)
-            remote_size += po.size
-        if deltasize:
-            self.verbose_logger.info(_('Delta RPMs reduced %s of updates to %s (%d%% saved)'),
-                format_number(rpmsize), format_number(deltasize), 100 - deltasize*100.0/rpmsize)
-
-        if downloadonly:
-            if hasattr(self, '_old_cachedir'):
-              # Try to link/copy them out, if we have somewhere to put them.
-
-              for po in pkglist:
-                if not po.localpath.startswith(self.conf.cachedir):
-                  continue
-
-                end = po.localpath[len(self.conf.cachedir):]
-                try:
-                  os.link(po.localpath, self._old_cachedir + end)
-                except:
-                  try:
-                    shutil.copy2(po.localpath, self._old_cachedir + end)
-                  except:
-                    pass
-
-            # close DBs, unlock
-            self.repos.close()
-            self.closeRpmDB()
-            self.doUnlock()
+                if errors:
+                    return errors
+                pkgs.append(po)
 
-        beg_download = time.time()
-        all_remote_pkgs = remote_pkgs
-        all_remote_size = remote_size
-        while True:
-            remote_pkgs.sort(mediasort)
-            #  This is kind of a hack and does nothing in non-Fedora versions,
-            # we'll fix it one way or anther soon.
-            if (hasattr(urlgrabber.progress, 'text_meter_total_size') and
-                len(remote_pkgs) > 1):
-                urlgrabber.progress.text_meter_total_size(remote_size)
-            i = 0
-            local_size = [0]
-            done_repos = set()
-            async = hasattr(urlgrabber.grabber, 'parallel_wait')
-            for po in remote_pkgs:
-                i += 1
-
-                def checkfunc(obj, po=po):
-                    self.verifyPkg(obj, po, 1)
-                    if po.localpath.endswith('.tmp'):
-                        rpmfile = po.localpath.rsplit('.', 2)[0]
-                        os.rename(po.localpath, rpmfile)
-                        po.localpath = rpmfile
-                    local_size[0] += po.size
-                    if hasattr(urlgrabber.progress, 'text_meter_total_size'):
-                        urlgrabber.progress.text_meter_total_size(remote_size,
-                                                                  local_size[0])
-                    if isinstance(po, DeltaPackage):
+            # download presto metadata and use drpms
+            presto = DeltaInfo(self, pkgs, adderror, self._sigCheckQueue)
+            deltasize = rpmsize = 0
+            for po in pkgs:
+                if isinstance(po, DeltaPackage):
+                    if verify_local(po):
+                        # there's .drpm already, use it
                         presto.rebuild(po)
-                        return
-                    else:
-                        presto.dequeue_max()
-
-                    if po.repoid not in done_repos:
-                        done_repos.add(po.repoid)
-                        #  Check a single package per. repo. ... to give a hint to
-                        # the user on big downloads.
-                        result, errmsg = self.sigCheckPkg(po)
-                        if result != 0:
-                            self.verbose_logger.warn("%s", errmsg)
-                    if po in errors:
-                        del errors[po]
-
-                text = os.path.basename(po.relativepath)
-                kwargs = {}
-                if async and po.repo._async:
-                    kwargs['failfunc'] = lambda obj, po=po: adderror(po, exception2msg(obj.exception))
-                    kwargs['async'] = True
-                elif not (i == 1 and not local_size[0] and remote_size == po.size):
-                    text = '(%s/%s): %s' % (i, len(remote_pkgs), text)
-                try:
-                    po.repo.getPackage(po,
-                                       checkfunc=checkfunc,
-                                       text=text,
-                                       cache=po.repo.http_caching != 'none',
-                                       **kwargs
-                                       )
-                except Errors.RepoError, e:
-                    adderror(po, exception2msg(e))
-            if async:
-                try:
-                    urlgrabber.grabber.parallel_wait()
-                except KeyboardInterrupt:
-                    for po in remote_pkgs:
+                        continue
+                    deltasize += po.size
+                    rpmsize += po.rpm.size
+                remote_pkgs.append(po)
+                remote_size += po.size
+            if deltasize:
+                self.verbose_logger.info(_('Delta RPMs reduced %s of updates to %s (%d%% saved)'),
+                    format_number(rpmsize), format_number(deltasize), 100 - deltasize*100.0/rpmsize)
+
+            if downloadonly:
+                if hasattr(self, '_old_cachedir'):
+                  # Try to link/copy them out, if we have somewhere to put them.
+
+                  for po in pkglist:
+                    if not po.localpath.startswith(self.conf.cachedir):
+                      continue
+
+                    end = po.localpath[len(self.conf.cachedir):]
+                    try:
+                      os.link(po.localpath, self._old_cachedir + end)
+                    except:
+                      try:
+                        shutil.copy2(po.localpath, self._old_cachedir + end)
+                      except:
+                        pass
+
+                # close DBs, unlock
+                self.repos.close()
+                self.closeRpmDB()
+                self.doUnlock()
+
+            beg_download = time.time()
+            all_remote_pkgs = remote_pkgs
+            all_remote_size = remote_size
+            while True:
+                remote_pkgs.sort(mediasort)
+                #  This is kind of a hack and does nothing in non-Fedora versions,
+                # we'll fix it one way or anther soon.
+                if (hasattr(urlgrabber.progress, 'text_meter_total_size') and
+                    len(remote_pkgs) > 1):
+                    urlgrabber.progress.text_meter_total_size(remote_size)
+                i = 0
+                local_size = [0]
+                done_repos = set()
+                async = hasattr(urlgrabber.grabber, 'parallel_wait')
+                for po in remote_pkgs:
+                    i += 1
+
+                    def checkfunc(obj, po=po):
+                        self.verifyPkg(obj, po, 1)
                         if po.localpath.endswith('.tmp'):
-                            misc.unlink_f(po.localpath)
-                        elif isinstance(po, DeltaPackage) and po.rpm.localpath.endswith('.tmp'):
-                            misc.unlink_f(po.rpm.localpath)
-                    raise
-            presto.dequeue_all()
-            presto.wait()
-
-            if hasattr(urlgrabber.progress, 'text_meter_total_size'):
-                urlgrabber.progress.text_meter_total_size(0)
-
-            fatal = False
-            for po in errors:
-                if not isinstance(po, DeltaPackage):
-                    fatal = True
+                            rpmfile = po.localpath.rsplit('.', 2)[0]
+                            os.rename(po.localpath, rpmfile)
+                            po.localpath = rpmfile
+                        local_size[0] += po.size
+                        if hasattr(urlgrabber.progress, 'text_meter_total_size'):
+                            urlgrabber.progress.text_meter_total_size(remote_size,
+                                                                      local_size[0])
+                        if isinstance(po, DeltaPackage):
+                            presto.rebuild(po)
+                            return
+                        else:
+                            presto.dequeue_max()
+                            self._sigCheckQueue(po)
+
+                        if po.repoid not in done_repos:
+                            done_repos.add(po.repoid)
+                            #  Check a single package per. repo. ... to give a hint to
+                            # the user on big downloads.
+                            result, errmsg = self.sigCheckPkg(po)
+                            if result != 0:
+                                self.verbose_logger.warn("%s", errmsg)
+                        if po in errors:
+                            del errors[po]
+
+                    text = os.path.basename(po.relativepath)
+                    kwargs = {}
+                    if async and po.repo._async:
+                        kwargs['failfunc'] = lambda obj, po=po: adderror(po, exception2msg(obj.exception))
+                        kwargs['async'] = True
+                    elif not (i == 1 and not local_size[0] and remote_size == po.size):
+                        text = '(%s/%s): %s' % (i, len(remote_pkgs), text)
+                    try:
+                        po.repo.getPackage(po,
+                                           checkfunc=checkfunc,
+                                           text=text,
+                                           cache=po.repo.http_caching != 'none',
+                                           **kwargs
+                                           )
+                    except Errors.RepoError, e:
+                        adderror(po, exception2msg(e))
+                if async:
+                    try:
+                        urlgrabber.grabber.parallel_wait()
+                    except KeyboardInterrupt:
+                        for po in remote_pkgs:
+                            if po.localpath.endswith('.tmp'):
+                                misc.unlink_f(po.localpath)
+                            elif isinstance(po, DeltaPackage) and po.rpm.localpath.endswith('.tmp'):
+                                misc.unlink_f(po.rpm.localpath)
+                        raise
+                presto.dequeue_all()
+                presto.wait()
+
+                if hasattr(urlgrabber.progress, 'text_meter_total_size'):
+                    urlgrabber.progress.text_meter_total_size(0)
+
+                fatal = False
+                for po in errors:
+                    if not isinstance(po, DeltaPackage):
+                        fatal = True
+                        break
+                if not errors or fatal:
                     break
-            if not errors or fatal:
-                break
 
-            # there were drpm related errors *only*
-            remote_pkgs = []
-            remote_size = 0
-            for po in errors:
-                po = po.rpm
-                remote_pkgs.append(po)
-                remote_size += po.size
-            # callback_total needs the total pkg count
-            all_remote_pkgs.extend(remote_pkgs)
-            all_remote_size += remote_size
-            errors.clear()
-            self.verbose_logger.warn(_('Some delta RPMs failed to download or rebuild. Retrying..'))
+                # there were drpm related errors *only*
+                remote_pkgs = []
+                remote_size = 0
+                for po in errors:
+                    po = po.rpm
+                    remote_pkgs.append(po)
+                    remote_size += po.size
+                # callback_total needs the total pkg count
+                all_remote_pkgs.extend(remote_pkgs)
+                all_remote_size += remote_size
+                errors.clear()
+                self.verbose_logger.warn(_('Some delta RPMs failed to download or rebuild. Retrying..'))
+            self._sigCheckFinish()
+        finally:
+            #  Anything still being checked when we leave early is thrown away.
+            self._sigCheckAbort()
         if callback_total and not errors:
             callback_total(all_remote_pkgs, all_remote_size, beg_download)
 
@@ -2742,6 +2874,107 @@ much more problems).
             po.hdrpath = hdrpath
             return
 
+    def _sigCheckStart(self, num):
+        """ Start the sigcheck_workers processes, to check the signatures of
+            upto num packages as they are downloaded. """
+        self._sigCheckAbort()
+        self._sigcheck_results = {}
+        workers = min(self.conf.sigcheck_workers, num)
+        if multiprocessing is None or workers < 2:
+            return
+
+        try:
+            self._sigcheck_pool = multiprocessing.Pool(workers)
+        except (OSError, ImportError), e:
+            self.verbose_logger.debug("Can't start signature check workers: %s"
+                                      % e)
+
+    def _sigCheckQueue(self, po):
+        """ Queue a signature check of the (downloaded) package, in the
+            workers from _sigCheckStart(). """
+        if self._sigcheck_pool is None or not self._sigCheckConf(po)[0]:
+            return
+        fname = po.localPkg()
+        try:
+            st = _sigcheck_stat(fname)
+        except OSError:
+            return
+        args = (self.conf.installroot, fname)
+        res = self._sigcheck_pool.apply_async(_sigcheck_worker, (args,))
+        self._sigcheck_queued[fname] = (st, res)
+
+    def _sigCheckFinish(self):
+        """ Wait for the queued signature checks, and keep the results for
+            sigCheckPkg(). """
+        pool = self._sigcheck_pool
+        if pool is None:
+            return
+        self._sigcheck_pool = None
+        try:
+            pool.close()
+            pool.join()
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+        for fname, (st, res) in self._sigcheck_queued.iteritems():
+            try:
+                self._sigcheck_results[fname] = (st, res.get(0))
+            except Exception:
+                pass
+        self._sigcheck_queued = {}
+
+    def _sigCheckAbort(self):
+        """ Throw away the workers from _sigCheckStart(), and any queued
+            signature checks. """
+        pool = self._sigcheck_pool
+        self._sigcheck_pool = None
+        self._sigcheck_queued = {}
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def _sigCheckResult(self, po):
+        """ Return the result of checkSig() on the package from the workers,
+            if it passed and the file hasn't changed since. Anything else is
+            checked again by sigCheckPkg(), so it is reported as normal (and
+            GPG keys might have been imported since). """
+        fname = po.localPkg()
+        if fname in self._sigcheck_queued:
+            #  Still in the workers, so wait for it rather than doing it all
+            # again. With a timeout, so ^C still works.
+            (st, res) = self._sigcheck_queued.pop(fname)
+            try:
+                self._sigcheck_results[fname] = (st, res.get(60 * 60))
+            except Exception:
+                pass
+        if fname not in self._sigcheck_results:
+            return None
+        (st, sigresult) = self._sigcheck_results[fname]
+        if sigresult != 0:
+            return None
+        try:
+            if _sigcheck_stat(fname) != st:
+                return None
+        except OSError:
+            return None
+        return sigresult
+
+    def _sigCheckConf(self, po):
+        """ Return (check, hasgpgkey) for the package, is a signature check
+            needed and does the repo. have GPG keys. """
+        if self._override_sigchecks:
+            check = False
+            hasgpgkey = 0
+        elif hasattr(po, 'pkgtype') and po.pkgtype == 'local':
+            check = self.conf.localpkg_gpgcheck
+            hasgpgkey = 0
+        else:
+            repo = self.repos.getRepo(po.repoid)
+            check = repo.gpgcheck
+            hasgpgkey = not not repo.gpgkey
+        return check, hasgpgkey
+
     def sigCheckPkg(self, po):
         """Verify the GPG signature of the given package object.
 
@@ -2754,20 +2987,13 @@ much more problems).
                     might help.
               2 = Fatal GPG verification error, give up.
         """
-        if self._override_sigchecks:
-            check = False
-            hasgpgkey = 0
-        elif hasattr(po, 'pkgtype') and po.pkgtype == 'local':
-            check = self.conf.localpkg_gpgcheck
-            hasgpgkey = 0
-        else:
-            repo = self.repos.getRepo(po.repoid)
-            check = repo.gpgcheck
-            hasgpgkey = not not repo.gpgkey 
+        (check, hasgpgkey) = self._sigCheckConf(po)
         
         if check:
-            ts = self.rpmdb.readOnlyTS()
-            sigresult = rpmUtils.miscutils.checkSig(ts, po.localPkg())
+            sigresult = self._sigCheckResult(po)
+            if sigresult is None:
+                ts = self.rpmdb.readOnlyTS()
+                sigresult = rpmUtils.miscutils.checkSig(ts, po.localPkg())
             localfn = os.path.basename(po.localPkg())
             
             if sigresult == 0:
@@ -2854,7 +3080,7 @@ much more problems).
     def cleanPackages(self):
         """Delete the package files from the yum cache."""
 
-        exts = ['rpm']
+        exts = ['rpm', 'seg']
         return self._cleanFiles(exts, 'pkgdir', 'package')
 
     def cleanSqlite(self):
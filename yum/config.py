@@ -829,10 +829,13 @@ class YumConf(StartupConf):
             allowed = ('ipv4', 'ipv6', 'whatever'),
             mapper  = {'4': 'ipv4', '6': 'ipv6'})
     max_connections = IntOption(0, range_min=0)
+    max_host_connections = IntOption(0, range_min=0)
+    download_segment_size = BytesOption(0)
     ftp_disable_epsv = BoolOption(False)
     deltarpm = IntOption(2, range_min=-16, range_max=128)
     deltarpm_percentage = IntOption(75, range_min=0, range_max=100)
     deltarpm_metadata_percentage = IntOption(100, range_min=0)
+    deltarpm_adaptive = BoolOption(False)
 
     http_caching = SelectionOption('all', ('none', 'packages', 'all',
                                            'lazy:packages'))
@@ -841,6 +844,8 @@ class YumConf(StartupConf):
                                              ('never', 'read-only:future',
                                               'read-only:present',
                                               'read-only:past'))
+    metadata_refresh = SelectionOption('foreground',
+                                       ('foreground', 'background'))
     # Time in seconds (1 day). NOTE: This isn't used when using metalinks
     mirrorlist_expire = SecondsOption(60 * 60 * 24)
     # XXX rpm_check_debug is unused, left around for API compatibility for now
@@ -852,6 +857,19 @@ class YumConf(StartupConf):
     # similar but better :).
     mdpolicy = ListOption(['group:small'])
     mddownloadpolicy = SelectionOption('sqlite', ('sqlite', 'xml'))
+    xml2sqlite = SelectionOption('sqlitecachec', ('sqlitecachec', 'python'))
+    prco_cache = BoolOption(False)
+    filelists_index = BoolOption(False)
+    search_index = BoolOption(False)
+    attach_primary_dbs = BoolOption(False)
+    pkg_cache_max = IntOption(0, range_min=0)
+    sqlite_read_only = BoolOption(False)
+    decompress_workers = IntOption(1, range_min=1)
+    sigcheck_workers = IntOption(1, range_min=1)
+    metadata_deltas = BoolOption(False)
+    repomd_manifest = BoolOption(True)
+    setup_connections = IntOption(1, range_min=1)
+    http_revalidate = BoolOption(True)
     #  ('instant', 'group:all', 'group:main', 'group:small', 'group:primary'))
     multilib_policy = SelectionOption(__main_multilib_policy_default__,
                                       ('best', 'all'))
@@ -1023,6 +1041,8 @@ class RepoConf(BaseConfig):
     throttle = Inherit(YumConf.throttle)
     timeout = Inherit(YumConf.timeout)
     ip_resolve = Inherit(YumConf.ip_resolve)
+    max_host_connections = Inherit(YumConf.max_host_connections)
+    download_segment_size = Inherit(YumConf.download_segment_size)
     #  This isn't inherited so that we can automatically disable file:// _only_
     # repos. if they haven't set an explicit deltarpm_percentage for the repo.
     deltarpm_percentage = IntOption(None, range_min=0, range_max=100)
@@ -1034,11 +1054,21 @@ class RepoConf(BaseConfig):
     http_caching = Inherit(YumConf.http_caching)
     metadata_expire = Inherit(YumConf.metadata_expire)
     metadata_expire_filter = Inherit(YumConf.metadata_expire_filter)
+    metadata_refresh = Inherit(YumConf.metadata_refresh)
     mirrorlist_expire = Inherit(YumConf.mirrorlist_expire)
     # NOTE: metalink expire _must_ be the same as metadata_expire, due to the
     #       checksumming of the repomd.xml.
     mdpolicy = Inherit(YumConf.mdpolicy)
     mddownloadpolicy = Inherit(YumConf.mddownloadpolicy)
+    xml2sqlite = Inherit(YumConf.xml2sqlite)
+    prco_cache = Inherit(YumConf.prco_cache)
+    filelists_index = Inherit(YumConf.filelists_index)
+    search_index = Inherit(YumConf.search_index)
+    pkg_cache_max = Inherit(YumConf.pkg_cache_max)
+    sqlite_read_only = Inherit(YumConf.sqlite_read_only)
+    metadata_deltas = Inherit(YumConf.metadata_deltas)
+    repomd_manifest = Inherit(YumConf.repomd_manifest)
+    http_revalidate = Inherit(YumConf.http_revalidate)
     cost = IntOption(1000)
     
     sslcacert = Inherit(YumConf.sslcacert)
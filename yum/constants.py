@@ -109,6 +109,13 @@ PATTERNS_MAX = 8
 #  We have another value here because name is indexed and sqlite is _much_
 # faster even at large numbers of patterns.
 PATTERNS_INDEXED_MAX = 128
+#  After this many exclude lookups in a repo. we run all the excluders over
+# every package in it once, and just do set lookups from then on.
+EXCLUDER_COMPILE_MIN = 256
+#  How much page cache (in KiB) and mmap space (in bytes) each of the read only
+# repo. metadata DBs get, see sqlutils.sql_read_only().
+SQLITE_RO_CACHE_KB = 16 * 1024
+SQLITE_RO_MMAP_SIZE = 256 * 1024 * 1024
 
 RPM_CHECKSUM_TYPES = { 1:'md5', 2:'sha1', 8:'sha256', 9:'sha384', 10:'sha512',
                        11:'sha224' } # from RFC 4880
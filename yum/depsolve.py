@@ -990,11 +990,31 @@ class Depsolve(object):
         
         return (2, [_('Success - deps resolved')])
 
+    def _prefetchProvides(self):
+        """ Lookup the providers of all the requires of the unresolved
+            install members in the pkgSack in one go, so the getProvides()
+            calls done by tsInfo for each require are answered from the
+            sack caches. Only useful when tsInfo has to use the pkgSack. """
+        if self.tsInfo._inSack is not None or not self.tsInfo.pkgSackPackages:
+            return
+
+        reqs = set()
+        for txmbr in self.tsInfo.getUnresolvedMembers():
+            if txmbr.output_state not in TS_INSTALL_STATES:
+                continue
+            for req in txmbr.po.returnPrco('requires'):
+                if req[0].startswith('rpmlib('):
+                    continue
+                reqs.add(req)
+        if reqs:
+            self.pkgSack.getProvidesMany(reqs)
+
     def _resolveRequires(self, errors):
         any_missing = False
         CheckDeps = False
         CheckInstalls = False
         CheckRemoves = False
+        self._prefetchProvides()
         # we need to check the opposite of install and remove for regular
         # tsInfo members vs removed members
         for txmbr in self.tsInfo.getUnresolvedMembers():
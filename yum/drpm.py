@@ -25,10 +25,20 @@ from yum.misc import checksum, repo_gen_decompress, unlink_f
 from urlgrabber import grabber, progress
 async = hasattr(grabber, 'parallel_wait')
 from xml.etree.cElementTree import iterparse
-import os, re
+import os, re, time
+import urlparse
 
 APPLYDELTA = '/usr/bin/applydeltarpm'
 
+# How much a new rebuild reading counts, against what we already have.
+_rate_weight = 0.3
+# When the rebuild rate is older than this, use a delta even if the full rpm
+# looks faster, to time a rebuild again.
+_rate_recheck = 24 * 60 * 60
+#  A wait() that returns sooner than this after we started it might have found
+# a job that exited a while ago, so we don't know how long it took.
+_wait_min = 0.01
+
 class DeltaPackage:
     def __init__(self, rpm, size, remote, csum, oldrpm):
         # copy what needed
@@ -46,6 +56,8 @@ class DeltaPackage:
         self.localpath = os.path.dirname(rpm.localpath) +'/'+ os.path.basename(remote)
         self.csum = csum
         self.oldrpm = oldrpm
+        self.rebuild_est = None # Predicted rebuild time, if we have one
+        self.rebuild_start = None
 
     def __str__(self):
         return 'Delta RPM of %s' % self.rpm
@@ -108,13 +120,96 @@ def _num_cpus_online(unknown=1):
 
     return unknown
 
+class RebuildRate:
+    """ How many seconds applydeltarpm takes per byte of the rpm it rebuilds,
+        as a moving average which is saved to a file. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rate = None
+        self.timestamp = 0
+        self.dirty = False
+        try:
+            vals = open(filename).read().split()
+            rate = float(vals[0])
+            if rate > 0:
+                self.rate = rate
+                self.timestamp = min(int(vals[1]), time.time())
+        except (EnvironmentError, ValueError, IndexError):
+            pass
+
+    def stale(self):
+        """ Is it time to check the rate with another rebuild. """
+        return self.timestamp + _rate_recheck < time.time()
+
+    def estimate(self, size):
+        """ Return how long rebuilding an rpm of size bytes should take, or
+            None if we haven't timed any rebuilds yet. """
+        if self.rate is None:
+            return None
+        return size * self.rate
+
+    def update(self, size, elapsed):
+        """ Add the reading from rebuilding an rpm of size bytes, in elapsed
+            seconds. """
+        if size <= 0 or elapsed <= 0:
+            return
+        rate = elapsed / size
+        if self.rate is not None:
+            rate = self.rate + _rate_weight * (rate - self.rate)
+        self.rate = rate
+        self.timestamp = int(time.time())
+        self.dirty = True
+
+    def save(self):
+        """ Save the rate, if it changed. """
+        if not self.dirty or not self.filename:
+            return
+        tmpname = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            fo = open(tmpname, 'w')
+            fo.write('%g %d\n' % (self.rate, self.timestamp))
+            fo.close()
+            os.rename(tmpname, self.filename)
+        except EnvironmentError:
+            unlink_f(tmpname)
+            return
+        self.dirty = False
+
+def _download_speed(repo):
+    """ Return the bytes/sec. we expect when downloading from the repo, the
+        best of urlgrabber's (timedhosts) estimates for its mirrors. Mirrors
+        we haven't downloaded from yet just get urlgrabber's default_speed,
+        so they are ignored. """
+    if not hasattr(grabber, '_TH'):
+        return None
+    grabber._TH.load()
+    speeds = []
+    for url in repo.urls:
+        # Same as _TH.estimate()
+        host = urlparse.urlsplit(url).netloc.split('@')[-1] or url
+        if host in grabber._TH.hosts:
+            speeds.append(grabber._TH.estimate(url)[0])
+    speeds = [speed for speed in speeds if speed > 0]
+    if not speeds:
+        return None
+    return max(speeds)
+
 class DeltaInfo:
-    def __init__(self, ayum, pkgs, adderror):
+    def __init__(self, ayum, pkgs, adderror, rebuilt=None):
+        """ adderror(po, msg) is called for any problems, and rebuilt(rpm)
+            when a rebuild has finished (and the rpm is in place). """
         self.verbose_logger = ayum.verbose_logger
         self.adderror = adderror
+        self.rebuilt = rebuilt
         self.jobs = {}
         self._future_jobs = []
         self.progress = None
+        self.rebuild_rate = None
+        self._rechecking = False
+        if ayum.conf.deltarpm_adaptive:
+            self.rebuild_rate = RebuildRate(ayum.conf.cachedir +
+                                            '/deltarpm-rebuild-rate')
         self.limit = ayum.conf.deltarpm
         if self.limit < 0:
             nprocs = _num_cpus_online()
@@ -194,6 +289,9 @@ class DeltaInfo:
         # parse metadata, create DeltaPackage instances
         for repo, cpath in mdpath.items():
             pinfo_repo = pinfo[repo]
+            speed = None
+            if self.rebuild_rate is not None:
+                speed = _download_speed(repo)
             path = repo_gen_decompress(cpath, 'prestodelta.xml',
                                        cached=repo.cache)
             for ev, el in iterparse(path):
@@ -230,8 +328,36 @@ class DeltaInfo:
                         csum = el.find('checksum')
                         csum = csum.get('type'), csum.text
                         pkgs[index] = DeltaPackage(po, size, remote, csum, oldrpm)
+                    if pkgs[index] is not po and speed:
+                        self._choose(pkgs, index, speed)
                 el.clear()
 
+    def _choose(self, pkgs, index, speed):
+        """ Use the delta at pkgs[index] only when downloading and rebuilding
+            it is expected to be faster than downloading the full rpm, at
+            speed bytes/sec. With no rebuilds timed yet, use it (which then
+            times one). When the timing is old, we use one delta anyway, so it
+            can recover from a slow rebuild. """
+        dpo = pkgs[index]
+        est = self.rebuild_rate.estimate(dpo.rpm.size)
+        if est is None:
+            return
+        dpo.rebuild_est = est
+        delta_time = dpo.size / speed + est
+        full_time = dpo.rpm.size / speed
+        if delta_time < full_time:
+            self.verbose_logger.debug('Using delta RPM for %s, expect %.1fs vs. %.1fs for the full RPM',
+                                      dpo.rpm, delta_time, full_time)
+            return
+        if not self._rechecking and self.rebuild_rate.stale():
+            self._rechecking = True
+            self.verbose_logger.debug('Using delta RPM for %s to time the rebuild, expect %.1fs vs. %.1fs for the full RPM',
+                                      dpo.rpm, delta_time, full_time)
+            return
+        self.verbose_logger.debug('Not using delta RPM for %s, expect %.1fs vs. %.1fs for the full RPM',
+                                  dpo.rpm, delta_time, full_time)
+        pkgs[index] = dpo.rpm
+
     def wait(self, num=None):
         """ Wait for "num" number of jobs to finish, or all of them. Blocks. """
         if num is None:
@@ -247,8 +373,15 @@ class DeltaInfo:
         num = 0
 
         while self.jobs:
+            #  We only know when a job exited if we were blocked waiting for
+            # it, the non-blocking reaping happens whenever we get to it.
+            exited = None
             if block:
+                start = time.time()
                 pid, code = os.wait()
+                now = time.time()
+                if now - start >= _wait_min:
+                    exited = now
             else:
                 pid, code = os.waitpid(-1, os.WNOHANG)
                 if not pid:
@@ -258,6 +391,9 @@ class DeltaInfo:
             # so we should never see an unknown pid here.
             assert pid in self.jobs
             po = self.jobs.pop(pid)
+            elapsed = None
+            if exited is not None and po.rebuild_start is not None:
+                elapsed = exited - po.rebuild_start
             if self.progress:
                 self.done += po.rpm.size
                 self.progress.update(self.done)
@@ -267,6 +403,7 @@ class DeltaInfo:
             elif not po.rpm.verifyLocalPkg():
                 self.adderror(po, _('Checksum of the delta-rebuilt RPM failed'))
             else:
+                self._rebuilt(po, elapsed)
                 # done with drpm file, unlink when local
                 if po.localpath.startswith(po.repo.pkgdir):
                     os.unlink(po.localpath)
@@ -275,13 +412,30 @@ class DeltaInfo:
                     rpmfile = po.rpm.localpath.rsplit('.', 2)[0]
                     os.rename(po.rpm.localpath, rpmfile)
                     po.rpm.localpath = rpmfile
+                if self.rebuilt is not None:
+                    self.rebuilt(po.rpm)
             num += 1
 
             # when blocking, one is enough
             if block:
                 break
+
+        if self.rebuild_rate is not None and not self.jobs:
+            self.rebuild_rate.save()
         return num
 
+    def _rebuilt(self, po, elapsed):
+        """ Add the time of a successful rebuild, if we know it, and report
+            it against the prediction we made when choosing the delta. """
+        if self.rebuild_rate is None or elapsed is None:
+            return
+        if po.rebuild_est is not None:
+            self.verbose_logger.debug('Rebuilt %s in %.1fs, predicted %.1fs',
+                                      po.rpm, elapsed, po.rebuild_est)
+        else:
+            self.verbose_logger.debug('Rebuilt %s in %.1fs', po.rpm, elapsed)
+        self.rebuild_rate.update(po.rpm.size, elapsed)
+
     def rebuild(self, po):
         """ Turn a drpm into an rpm, by adding it to the queue and trying to
             service the queue. """
@@ -348,4 +502,5 @@ class DeltaInfo:
         except OSError, e:
             raise MiscError, _('Couldn\'t spawn %s: %s') % (APPLYDELTA, exception2msg(e))
         self.jobs[pid] = po
+        po.rebuild_start = time.time()
         return True
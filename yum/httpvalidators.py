@@ -0,0 +1,157 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Per. repo. HTTP validators (ETag and Last-Modified) of the small metadata
+files we download each time the metadata expires (repomd.xml, metalink and
+mirrorlist), so they can be downloaded with a conditional request. When the
+server (or a caching proxy) answers "304 Not Modified" the copy we already
+have is current, and nothing is downloaded.
+
+The validators are saved with the checksum of the data they were for, so if
+our copy of the file changes (or goes away) they aren't used.
+"""
+
+import os
+
+from urlgrabber.grabber import URLGrabError
+
+import misc
+import Errors
+
+_sumtype = 'sha256'
+
+class HTTPValidators:
+    """ The ETag/Last-Modified of the URLs downloaded for a repo., which are
+        saved to a file. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.urls = {} # url => (checksum, etag, last-modified)
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            lines = open(self.filename).readlines()
+        except EnvironmentError:
+            return
+
+        for line in lines:
+            vals = line.rstrip('\n').split('\t')
+            if len(vals) != 4 or not vals[1] or not (vals[2] or vals[3]):
+                continue
+            self.urls[vals[0]] = tuple(vals[1:])
+
+    def save(self):
+        """ Save the validators, if anything changed. Returns False if they
+            couldn't be saved. """
+        if not self.dirty:
+            return True
+
+        tmpname = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            fo = open(tmpname, 'w')
+            for url in sorted(self.urls):
+                fo.write("%s\t%s\t%s\t%s\n" % ((url,) + self.urls[url]))
+            fo.close()
+            os.rename(tmpname, self.filename)
+        except EnvironmentError:
+            misc.unlink_f(tmpname)
+            return False
+        self.dirty = False
+        return True
+
+    def headers(self, url, local):
+        """ Return the HTTP headers for a conditional request of url, as a
+            list of 2-tuples, if we have validators for it and local is the
+            data they are for. Otherwise return an empty list. """
+        if url not in self.urls:
+            return []
+        (checksum, etag, modified) = self.urls[url]
+        try:
+            if misc.checksum(_sumtype, local) != checksum:
+                return []
+        except Errors.MiscError:
+            return []
+
+        ret = []
+        if etag:
+            ret.append(('If-None-Match', etag))
+        if modified:
+            ret.append(('If-Modified-Since', modified))
+        return ret
+
+    def set(self, url, filename, hdr):
+        """ Save the validators from the response headers (hdr) of
+            downloading url to filename. """
+        etag = hdr.getheader('ETag') or ''
+        modified = hdr.getheader('Last-Modified') or ''
+        vals = [url, etag, modified]
+        if not (etag or modified) or [x for x in vals if '\t' in x or '\n' in x]:
+            self.remove(url)
+            return
+        try:
+            checksum = misc.checksum(_sumtype, filename)
+        except Errors.MiscError:
+            self.remove(url)
+            return
+        if self.urls.get(url) != (checksum, etag, modified):
+            self.urls[url] = (checksum, etag, modified)
+            self.dirty = True
+
+    def remove(self, url):
+        """ Forget the validators for url. """
+        if url in self.urls:
+            del self.urls[url]
+            self.dirty = True
+
+
+def urlgrab_if_modified(grabber, url, filename, local, validators, **kwargs):
+    """ Like grabber.urlgrab(url, filename, **kwargs), but if validators has
+        the ETag/Last-Modified for url, and local is the data they are for,
+        the request is conditional. Returns None if the server says that
+        local is current (nothing is written to filename). The validators for
+        the download are saved for next time. """
+    headers = validators.headers(url, local)
+    if headers:
+        http_headers = kwargs.get('http_headers', grabber.opts.http_headers)
+        kwargs['http_headers'] = tuple(http_headers or ()) + tuple(headers)
+
+    fo = grabber.urlopen(url, **kwargs)
+    try:
+        try:
+            out = open(filename, 'wb')
+            while True:
+                data = fo.read(64 * 1024)
+                if not data:
+                    break
+                out.write(data)
+            out.close()
+        except IOError, e:
+            misc.unlink_f(filename)
+            raise URLGrabError(16, 'error writing %s from %s, IOError: %s' %
+                               (filename, url, e))
+        # Nothing is known about the response until it's been read.
+        code = fo.http_code
+        hdr = fo.hdr
+    finally:
+        fo.close()
+
+    if headers and code == 304:
+        misc.unlink_f(filename)
+        return None
+    validators.set(url, filename, hdr)
+    return filename
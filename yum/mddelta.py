@@ -0,0 +1,210 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Deltas for the sqlite repo. metadata (primary_db, filelists_db, other_db).
+
+A delta is a sqlite DB with the same tables as the DB it's for, containing
+just the packages which were added, and two extra tables:
+
+    delta_removed (pkgId TEXT) - the packages which were removed.
+    delta_info (pkgids_checksum TEXT, packages INTEGER,
+                content_checksum TEXT) - the sha256 of the sorted pkgIds, one
+                per line, of the new DB and how many there are. Then a
+                checksum of all the data in the new DB, see
+                content_checksum(). So we can check the result.
+
+The pkgKeys in the delta only need to be consistent within it. Applying a
+delta removes any package in it, or in delta_removed, and then adds the
+packages from it. So it can be applied to any DB older than the one it was
+made for, as long as it's newer than the one it was made against.
+
+In repomd.xml a delta is a <delta> inside the <data> of the DB, with the
+timestamp of the DB it was made against, see RepoData.getDelta().
+"""
+
+import os
+import shutil
+
+import misc
+from Errors import MiscError
+from sqlutils import sqlite, executeSQL
+
+def _tables(cur, db):
+    """ Return a dict of table name => list of columns, for the db. """
+    ret = {}
+    executeSQL(cur, "SELECT name FROM %s.sqlite_master WHERE type = 'table'"
+               % db)
+    for (name,) in cur.fetchall():
+        if name.startswith('sqlite_'):
+            continue
+        executeSQL(cur, "PRAGMA %s.table_info(%s)" % (db, name))
+        ret[name] = [row[1] for row in cur.fetchall()]
+    return ret
+
+def pkgids_checksum(cur, db='main'):
+    """ Return (sha256, num) of the sorted pkgIds in the db. """
+    sums = misc.Checksums(['sha256'])
+    num = 0
+    executeSQL(cur, "SELECT pkgId FROM %s.packages ORDER BY pkgId" % db)
+    for (pkgId,) in cur:
+        sums.update(str(pkgId) + '\n')
+        num += 1
+    return (sums.hexdigest(), num)
+
+def content_checksum(cur, db='main'):
+    """ Return a sha256 of all the data in the tables of the db, except the
+        pkgKeys (which are replaced by the pkgId of the package). This doesn't
+        depend on the order of the rows, so it can be compared between the
+        published DB and one made by applying a delta. """
+    sums = misc.Checksums(['sha256'])
+    tables = _tables(cur, db)
+    for name in sorted(tables):
+        if name.startswith('delta_'):
+            continue
+        cols = tables[name]
+        if name == 'packages':
+            sql = "SELECT %s FROM %s.packages" % (
+                ", ".join([col for col in cols if col != 'pkgKey']), db)
+        elif 'pkgKey' in cols:
+            sel = []
+            for col in cols:
+                if col == 'pkgKey':
+                    col = 'p.pkgId'
+                else:
+                    col = 't.' + col
+                sel.append(col)
+            sql = """SELECT %s FROM %s.%s AS t JOIN %s.packages AS p
+                     USING (pkgKey)""" % (", ".join(sel), db, name, db)
+        else:
+            sql = "SELECT * FROM %s.%s" % (db, name)
+        #  Add up the checksums of the rows, mod 2**256, so the order doesn't
+        # matter and we don't need to sort big tables like filelist.
+        total = 0
+        num = 0
+        executeSQL(cur, sql)
+        for row in cur:
+            rsum = misc.Checksums(['sha256'])
+            rsum.update(repr(tuple(row)))
+            total += long(rsum.hexdigest(), 16)
+            num += 1
+        sums.update("%s %s %d %x\n" % (name, ",".join(cols), num,
+                                       total % (2 ** 256)))
+    return sums.hexdigest()
+
+def create(old_fn, new_fn, delta_fn):
+    """ Create a delta in delta_fn, which turns the DB old_fn into new_fn. """
+    misc.unlink_f(delta_fn)
+    conn = sqlite.connect(delta_fn)
+    cur = conn.cursor()
+    executeSQL(cur, "ATTACH DATABASE ? AS old", (old_fn,))
+    executeSQL(cur, "ATTACH DATABASE ? AS new", (new_fn,))
+
+    executeSQL(cur, "SELECT name, sql FROM new.sqlite_master "
+                    "WHERE type = 'table'")
+    for (name, sql) in cur.fetchall():
+        if name.startswith('sqlite_'):
+            continue
+        executeSQL(cur, sql)
+    tables = _tables(cur, 'main')
+
+    executeSQL(cur, """INSERT INTO packages SELECT * FROM new.packages
+                       WHERE pkgId NOT IN (SELECT pkgId FROM old.packages)""")
+    for (name, cols) in tables.iteritems():
+        if name == 'packages':
+            continue
+        if 'pkgKey' in cols:
+            executeSQL(cur, """INSERT INTO %s SELECT * FROM new.%s WHERE
+                               pkgKey IN (SELECT pkgKey FROM packages)"""
+                       % (name, name))
+        else: # Eg. db_info
+            executeSQL(cur, "INSERT INTO %s SELECT * FROM new.%s"
+                       % (name, name))
+
+    executeSQL(cur, "CREATE TABLE delta_removed (pkgId TEXT)")
+    executeSQL(cur, """INSERT INTO delta_removed SELECT pkgId FROM old.packages
+                       WHERE pkgId NOT IN (SELECT pkgId FROM new.packages)""")
+    executeSQL(cur, "CREATE TABLE delta_info (pkgids_checksum TEXT, "
+                    "packages INTEGER, content_checksum TEXT)")
+    executeSQL(cur, "INSERT INTO delta_info VALUES (?, ?, ?)",
+               pkgids_checksum(cur, 'new') + (content_checksum(cur, 'new'),))
+    conn.commit()
+    conn.close()
+
+def _apply(cur, delta_fn):
+    executeSQL(cur, "ATTACH DATABASE ? AS delta", (delta_fn,))
+    tables = _tables(cur, 'main')
+    dtables = _tables(cur, 'delta')
+    if ('delta_info' not in dtables or 'delta_removed' not in dtables or
+        'packages' not in dtables or 'packages' not in tables or
+        'content_checksum' not in dtables['delta_info']):
+        raise MiscError, "Not a metadata delta: %s" % delta_fn
+    executeSQL(cur, """SELECT pkgids_checksum, packages, content_checksum
+                       FROM delta.delta_info""")
+    info = cur.fetchone()
+
+    executeSQL(cur, """CREATE TEMP TABLE delta_gone AS
+                       SELECT pkgKey FROM main.packages WHERE pkgId IN
+                         (SELECT pkgId FROM delta.delta_removed UNION
+                          SELECT pkgId FROM delta.packages)""")
+    for (name, cols) in tables.iteritems():
+        if name != 'packages' and 'pkgKey' in cols:
+            executeSQL(cur, """DELETE FROM main.%s WHERE
+                               pkgKey IN (SELECT pkgKey FROM delta_gone)"""
+                       % name)
+    executeSQL(cur, """DELETE FROM main.packages WHERE
+                       pkgKey IN (SELECT pkgKey FROM delta_gone)""")
+
+    # New pkgKeys for the added packages, after all the ones we have.
+    executeSQL(cur, "SELECT max(pkgKey) FROM main.packages")
+    offset = cur.fetchone()[0] or 0
+    for (name, cols) in tables.iteritems():
+        if name not in dtables:
+            continue
+        cols = [col for col in cols if col in dtables[name]]
+        if 'pkgKey' not in cols:
+            # Eg. db_info, we want the new version.
+            executeSQL(cur, "DELETE FROM main.%s" % name)
+        sel = []
+        for col in cols:
+            if col == 'pkgKey':
+                col = 'pkgKey + %d' % offset
+            sel.append(col)
+        executeSQL(cur, "INSERT INTO main.%s (%s) SELECT %s FROM delta.%s" %
+                   (name, ", ".join(cols), ", ".join(sel), name))
+
+    if info is None or pkgids_checksum(cur) != (info[0], info[1]):
+        raise MiscError, "Metadata delta %s doesn't match" % delta_fn
+    if content_checksum(cur) != info[2]:
+        raise MiscError, "Metadata delta %s doesn't match the data" % delta_fn
+
+def apply(db_fn, delta_fn, out_fn):
+    """ Apply the delta in delta_fn to a copy of the DB db_fn, in out_fn.
+        Raises MiscError if anything goes wrong, including the result not
+        having the packages, or the data, the delta says it should. """
+    try:
+        shutil.copyfile(db_fn, out_fn)
+        conn = sqlite.connect(out_fn)
+        try:
+            _apply(conn.cursor(), delta_fn)
+            conn.commit()
+        finally:
+            conn.close()
+    except (sqlite.Error, EnvironmentError), e:
+        misc.unlink_f(out_fn)
+        raise MiscError, "Error applying metadata delta %s: %s" % (delta_fn, e)
+    except MiscError:
+        misc.unlink_f(out_fn)
+        raise
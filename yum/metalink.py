@@ -22,6 +22,7 @@
 import sys
 import os
 import time
+import types
 from urlgrabber.progress import format_number
 
 import Errors
@@ -47,10 +48,25 @@ __ML_RESOURCES__ = """\
 {%(ml)s}resources\
 """ % __XML_FMT__
 
+def _manifest_line(vals):
+    """ Join the values into a manifest line, None values are empty. Returns
+        None if any of them can't be stored. """
+    ret = []
+    for val in vals:
+        if val is None:
+            val = ''
+        if type(val) != types.StringType or '\t' in val or '\n' in val:
+            return None
+        ret.append(val)
+    return '\t'.join(ret)
+
 class MetaLinkFile:
     """ Parse the file metadata out of a metalink file. """
 
     def __init__(self, elem):
+        if elem is None: # Loaded by parse_manifest()
+            return
+
         # We aren't "using" any of these, just storing them.
         chksums = set(["md5", 'sha1', 'sha256', 'sha512'])
 
@@ -85,6 +101,25 @@ SHA512:    %s
 """ % (time.ctime(self.timestamp), format_number(self.size), self.size,
        self.md5, self.sha1, self.sha256, self.sha512)
 
+    def dump_manifest(self, tag):
+        """ Return the data as a manifest line, or None if it can't be in
+            one. See MetaLinkRepoMD.dump_manifest(). """
+        ret = [tag, str(self.timestamp), str(self.size)]
+        for sumtype in sorted(self.chksums):
+            ret.extend([sumtype, self.chksums[sumtype]])
+        return _manifest_line(ret)
+
+    def parse_manifest(self, vals):
+        """ Load the data from the values of a manifest line. """
+        if len(vals) % 2 != 1:
+            raise MetaLinkRepoErrorParseFail, "Damaged metalink manifest"
+        try:
+            self.timestamp = int(vals[1])
+            self.size = int(vals[2])
+        except ValueError:
+            raise MetaLinkRepoErrorParseFail, "Damaged metalink manifest"
+        self.chksums = dict(zip(vals[3::2], vals[4::2]))
+
     def _get_md5(self):
         return self.chksums.get('md5', '')
     md5 = property(_get_md5)
@@ -126,6 +161,8 @@ class MetaLinkURL:
     """ Parse the URL metadata out of a metalink file. """
 
     def __init__(self, elem, max_connections):
+        if elem is None: # Loaded by parse_manifest()
+            return
         assert elem.tag == '{%s}url' % __XML_NS_ML__
 
         self.max_connections = max_connections
@@ -151,6 +188,28 @@ Private:         %s
 """ % (self.url, self.preference, self.max_connections,
        self.protocol, self.location, self.private)
 
+    def dump_manifest(self):
+        """ Return the data as a manifest line, or None if it can't be in
+            one. See MetaLinkRepoMD.dump_manifest(). """
+        return _manifest_line(['mirror', str(self.max_connections),
+                               str(self.preference), self.protocol,
+                               self.location, str(int(self.private)),
+                               self.url])
+
+    def parse_manifest(self, vals):
+        """ Load the data from the values of a manifest line. """
+        try:
+            (tag, max_connections, preference, protocol, location, private,
+             url) = vals
+            self.max_connections = int(max_connections)
+            self.preference      = int(preference)
+            self.private         = private == '1'
+        except ValueError:
+            raise MetaLinkRepoErrorParseFail, "Damaged metalink manifest"
+        self.protocol = protocol or None
+        self.location = location or None
+        self.url      = url or None
+
     def __cmp__(self, other):
         if other is None:
             return 1
@@ -175,12 +234,14 @@ Private:         %s
 class MetaLinkRepoMD:
     """ Parse a metalink file for repomd.xml. """
 
-    def __init__(self, filename):
+    def __init__(self, filename=None):
         self.name   = None
         self.repomd = None
         self.old_repomds = []
         self.mirrors = []
         self._host2mc = {}
+        if filename is None: # Loaded by parse_manifest()
+            return
         if not os.path.exists(filename):
             raise MetaLinkRepoErrorParseFail, "File %s does not exist" %filename
         try:
@@ -220,6 +281,43 @@ class MetaLinkRepoMD:
         if len(self.mirrors) < 1:
             raise MetaLinkRepoErrorParseFail, "No mirror"
 
+    def dump_manifest(self):
+        """ Return the parsed data as a list of lines, for a manifest of
+            metalink files (see yumRepo). Returns None if it can't be stored.
+            The format is tab separated values, with the first value saying
+            what the line is. """
+        lines = [_manifest_line(['name', self.name]),
+                 self.repomd.dump_manifest('repomd')]
+        lines.extend([orepomd.dump_manifest('old')
+                      for orepomd in self.old_repomds])
+        lines.extend([mirror.dump_manifest() for mirror in self.mirrors])
+        if None in lines:
+            return None
+        return lines
+
+    def parse_manifest(self, lines):
+        """ Load the parsed data from lines from dump_manifest(). """
+        for line in lines:
+            vals = line.split('\t')
+            if vals[0] == 'name' and len(vals) == 2:
+                self.name = vals[1] or None
+            elif vals[0] in ('repomd', 'old'):
+                repomd = MetaLinkFile(None)
+                repomd.parse_manifest(vals)
+                if vals[0] == 'repomd':
+                    self.repomd = repomd
+                else:
+                    self.old_repomds.append(repomd)
+            elif vals[0] == 'mirror':
+                mirror = MetaLinkURL(None, None)
+                mirror.parse_manifest(vals)
+                self.mirrors.append(mirror)
+            else:
+                raise MetaLinkRepoErrorParseFail, "Damaged metalink manifest"
+
+        if self.repomd is None or not self.mirrors:
+            raise MetaLinkRepoErrorParseFail, "Damaged metalink manifest"
+
     def urls(self):
         """ Iterate plain urls for the mirrors, like the old mirrorlist. """
 
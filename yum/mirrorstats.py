@@ -0,0 +1,223 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Per. repo. mirror statistics, kept across runs, and a urlgrabber MirrorGroup
+that tries the fastest mirrors first (failovermethod=fastest).
+
+For each mirror we keep the latency (how long small downloads take), the
+throughput (of big downloads) and a failure count. Each is a moving average,
+and as the readings get older they decay back towards the defaults ... so a
+mirror that was slow, or broken, gets tried again eventually.
+
+The defaults are those of a good mirror, so mirrors we haven't used yet are
+tried before ones that turned out to be slow, but not before fast ones.
+"""
+
+import os
+import time
+
+import urlgrabber.grabber
+import urlgrabber.mirror
+import urlgrabber.progress
+
+import misc
+
+# How much a new reading counts, against what we already have.
+_new_weight = 0.3
+# Readings go halfway back to the defaults in this time.
+_half_life = 7 * 24 * 60 * 60
+# Downloads smaller than this are used for latency, bigger ones for speed.
+_small_size = 64 * 1024
+# What we assume for a mirror we know nothing about.
+_default_latency = 0.1
+_default_speed = 2e6
+# Mirrors are scored on how long they'd take to download this much.
+_score_size = 1024 * 1024
+
+class MirrorStats:
+    """ The latency, throughput and failures of the mirrors of a repo., which
+        are saved to a file. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.mirrors = {} # mirror => (latency, speed, failures, timestamp)
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            lines = open(self.filename).readlines()
+        except EnvironmentError:
+            return
+
+        now = time.time()
+        for line in lines:
+            vals = line.split()
+            if len(vals) != 5:
+                continue
+            try:
+                (latency, speed, failures, ts) = [float(x) for x in vals[1:]]
+            except ValueError:
+                continue
+            if latency < 0 or speed <= 0 or failures < 0:
+                continue
+            self.mirrors[vals[0]] = (latency, speed, failures, min(ts, now))
+
+    def save(self):
+        """ Save the stats, if anything changed. Returns False if it couldn't
+            be saved. """
+        if not self.dirty:
+            return True
+
+        tmpname = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            fo = open(tmpname, 'w')
+            for mirror in sorted(self.mirrors):
+                fo.write("%s %.6f %.1f %.6f %d\n" %
+                         ((mirror,) + self.mirrors[mirror]))
+            fo.close()
+            os.rename(tmpname, self.filename)
+        except EnvironmentError:
+            misc.unlink_f(tmpname)
+            return False
+        self.dirty = False
+        return True
+
+    def get(self, mirror, now=None):
+        """ Return the (latency, speed, failures) of the mirror, decayed
+            towards the defaults by the age of the readings. """
+        if mirror not in self.mirrors:
+            return (_default_latency, _default_speed, 0)
+        if now is None:
+            now = time.time()
+
+        (latency, speed, failures, ts) = self.mirrors[mirror]
+        k = 2 ** ((ts - now) / _half_life)
+        return (k * latency + (1 - k) * _default_latency,
+                k * speed + (1 - k) * _default_speed,
+                k * failures)
+
+    def _set(self, mirror, latency, speed, failures, now):
+        if mirror != mirror.strip() or len(mirror.split()) != 1:
+            return # Can't save it.
+        self.mirrors[mirror] = (latency, speed, failures, now)
+        self.dirty = True
+
+    def success(self, mirror, size, elapsed):
+        """ Add the reading from downloading size bytes from the mirror, in
+            elapsed seconds. """
+        now = time.time()
+        (latency, speed, failures) = self.get(mirror, now)
+        weight = _new_weight
+        if mirror not in self.mirrors:
+            weight = 1 # First reading, the defaults are just a guess
+        if size < _small_size:
+            latency += weight * (elapsed - latency)
+        elif elapsed > 0:
+            speed += weight * ((size / elapsed) - speed)
+        self._set(mirror, latency, speed, failures / 2, now)
+
+    def failure(self, mirror):
+        """ Add a failed download from the mirror. """
+        now = time.time()
+        (latency, speed, failures) = self.get(mirror, now)
+        self._set(mirror, latency, speed, failures + 1, now)
+
+    def score(self, mirror):
+        """ Return how long we think a typical download from the mirror would
+            take, each failure doubles it. Lower is better. """
+        (latency, speed, failures) = self.get(mirror)
+        return (latency + (_score_size / speed)) * (2 ** failures)
+
+
+class _MirrorStatsGrabber:
+    """ Wraps the URLGrabber for a mirror, to time the downloads from it. """
+
+    def __init__(self, grabber, stats, mirror):
+        self.grabber = grabber
+        self.opts = grabber.opts
+        self.stats = stats
+        self.mirror = mirror
+
+    def urlgrab(self, url, filename=None, **kwargs):
+        if kwargs.get('async'): # Just queued, parallel_wait() picks a mirror
+            return self.grabber.urlgrab(url, filename, **kwargs)
+        stime = time.time()
+        ret = self.grabber.urlgrab(url, filename, **kwargs)
+        st = misc.stat_f(ret)
+        if st is not None:
+            self.stats.success(self.mirror, st.st_size, time.time() - stime)
+        return ret
+
+    def urlopen(self, url, **kwargs):
+        return self.grabber.urlopen(url, **kwargs)
+
+    def urlread(self, url, limit=None, **kwargs):
+        return self.grabber.urlread(url, limit, **kwargs)
+
+
+def _async_start_time(obj):
+    """ When parallel_wait() started the download, from its progress meter,
+        or None if there isn't one. """
+    progress = getattr(obj, '_progress', None)
+    if isinstance(progress, float): # No multi file meter, just the time.
+        return progress
+    return getattr(progress, 'start_time', None)
+
+class MGFastest(urlgrabber.mirror.MirrorGroup):
+    """ A mirror group that tries the mirrors in the order of their scores
+        in the MirrorStats, and updates them from the downloads. Failures need
+        to be added from the failure_callback, as that is also called for
+        async downloads. Like MGRandomOrder, the order is set at
+        initialization time. Async downloads are given a mirror by
+        parallel_wait(), so the order doesn't matter for them, but they are
+        still timed. """
+
+    def __init__(self, grabber, mirrors, stats=None, **kwargs):
+        urlgrabber.mirror.MirrorGroup.__init__(self, grabber, mirrors,
+                                               **kwargs)
+        self.stats = stats
+        if stats is None:
+            return
+
+        for mirror in self.mirrors:
+            mgrabber = mirror.get('grabber') or grabber
+            mirror['grabber'] = _MirrorStatsGrabber(mgrabber, stats,
+                                                    mirror['mirror'])
+        # Sorting is stable, so unknown mirrors keep their order.
+        self.mirrors.sort(key=lambda mirror: stats.score(mirror['mirror']))
+
+    def urlgrab(self, url, filename=None, **kwargs):
+        if self.stats is not None and kwargs.get('async'):
+            #  parallel_wait() runs checkfunc in this process when a download
+            # worked, so that's where we add the reading.
+            opts = self.grabber.opts
+            checkfunc = kwargs.get('checkfunc', opts.checkfunc)
+            kwargs['checkfunc'] = (self._asyncCheck, (checkfunc,), {})
+            if (not kwargs.get('progress_obj', opts.progress_obj) and
+                not kwargs.get('multi_progress_obj', opts.multi_progress_obj)):
+                # So parallel_wait() keeps the time it started the download.
+                kwargs['progress_obj'] = urlgrabber.progress.BaseMeter()
+        return urlgrabber.mirror.MirrorGroup.urlgrab(self, url, filename,
+                                                     **kwargs)
+
+    def _asyncCheck(self, obj, checkfunc):
+        if checkfunc is not None:
+            urlgrabber.grabber._run_callback(checkfunc, obj)
+        stime = _async_start_time(obj)
+        st = misc.stat_f(obj.filename)
+        if stime is not None and st is not None:
+            self.stats.success(obj.async[0], st.st_size, time.time() - stime)
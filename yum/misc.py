@@ -22,6 +22,7 @@ import pwd
 import fnmatch
 import bz2
 import gzip
+import zlib
 import shutil
 import urllib
 import string
@@ -818,12 +819,87 @@ def refineSearchPattern(arg):
     return restring
 
 
-def _decompress_chunked(source, dest, ztype):
+def _decompressor(ztype):
+    """ Return a new decompression object for a ztype stream. """
+    if ztype == 'bz2':
+        return bz2.BZ2Decompressor()
+    if ztype == 'xz':
+        return lzma.LZMADecompressor()
+    return zlib.decompressobj(16 + zlib.MAX_WBITS) # gzip header
+
+def _decompress_chunked_sums(source, dest, ztype, in_sums, out_sums):
+    """ Like _decompress_chunked(), but we read the compressed data ourself so
+        that we can checksum it, and the decompressed data, as we go. """
+    try:
+        s_fn = open(source, 'rb')
+    except (OSError, IOError), e:
+        msg = "Error reading from file %s: %s" % (source, str(e))
+        raise Errors.MiscError, msg
+
+    destination = open(dest, 'w')
+
+    decomp = _decompressor(ztype)
+    done = 0 # Bytes of output from the current stream
+    while True:
+        try:
+            data = s_fn.read(1024000)
+        except (OSError, IOError), e:
+            msg = "Error reading from file %s: %s" % (source, str(e))
+            raise Errors.MiscError, msg
+
+        if not data: break
+        if in_sums is not None:
+            in_sums.update(data)
+
+        while data:
+            try:
+                out = decomp.decompress(data)
+            except EOFError:
+                #  bz2 streams can end exactly at the end of a read, if there
+                # is more it's another stream (Eg. pbzip2).
+                if not done:
+                    raise Errors.MiscError, "Error reading from file %s" % source
+                decomp = _decompressor(ztype)
+                done = 0
+                continue
+            except Exception, e: # IOError, zlib.error, lzma.error, ...
+                msg = "Error reading from file %s: %s" % (source, str(e))
+                raise Errors.MiscError, msg
+            done += len(out)
+            data = getattr(decomp, 'unused_data', '')
+            if data: # Concatenated streams, start a new one.
+                decomp = _decompressor(ztype)
+                done = 0
+
+            if not out: continue
+            if out_sums is not None:
+                out_sums.update(out)
+            try:
+                destination.write(out)
+            except (OSError, IOError), e:
+                msg = "Error writing to file %s: %s" % (dest, str(e))
+                raise Errors.MiscError, msg
+
+    if hasattr(decomp, 'flush'):
+        out = decomp.flush()
+        if out_sums is not None:
+            out_sums.update(out)
+        destination.write(out)
+    destination.close()
+    s_fn.close()
+
+def _decompress_chunked(source, dest, ztype, in_sums=None, out_sums=None):
+    """ Decompress source into dest. If in_sums and/or out_sums (Checksums
+        objects) are given then the compressed and/or decompressed data is
+        also given to them, so one pass over the file does both. """
 
     if ztype not in _available_compression:
         msg = "%s compression not available" % ztype
         raise Errors.MiscError, msg
     
+    if in_sums is not None or out_sums is not None:
+        return _decompress_chunked_sums(source, dest, ztype, in_sums, out_sums)
+
     if ztype == 'bz2':
         s_fn = bz2.BZ2File(source, 'r')
     elif ztype == 'xz':
@@ -1175,9 +1251,12 @@ def get_uuid_obj(savepath):
     """ Like get_uuid() but doesn't create the uuid file until it's needed. """
     return _Dynamic_UUID(savepath)
         
-def decompress(filename, dest=None, fn_only=False, check_timestamps=False):
+def decompress(filename, dest=None, fn_only=False, check_timestamps=False,
+               in_sums=None, out_sums=None):
     """take a filename and decompress it into the same relative location.
-       if the file is not compressed just return the file"""
+       if the file is not compressed just return the file.
+       in_sums/out_sums are passed to _decompress_chunked(), they are left
+       empty if we don't need to decompress anything."""
     
     out = dest
     if not dest:
@@ -1217,23 +1296,30 @@ def decompress(filename, dest=None, fn_only=False, check_timestamps=False):
                 return None
 
     if not fn_only:
+        #  Write it via. a .tmp file, so nothing ever sees a partial file, and
+        # if out is a hardlink (Eg. into a staging dir) the other is untouched.
+        tmpname = '%s.%d.tmp' % (out, os.getpid())
         try:
-            _decompress_chunked(filename, out, ztype)
+            _decompress_chunked(filename, tmpname, ztype, in_sums, out_sums)
             if check_timestamps and fi:
-                os.utime(out, (fi.st_mtime, fi.st_mtime))
+                os.utime(tmpname, (fi.st_mtime, fi.st_mtime))
+            os.rename(tmpname, out)
         except:
+            unlink_f(tmpname)
             unlink_f(out)
             raise
         
     return out
     
-def repo_gen_decompress(filename, generated_name, cached=False):
+def repo_gen_decompress(filename, generated_name, cached=False,
+                        in_sums=None, out_sums=None):
     """ This is a wrapper around decompress, where we work out a cached
         generated name, and use check_timestamps. filename _must_ be from
         a repo. and generated_name is the type of the file. """
     dest = os.path.dirname(filename) + '/gen/' + generated_name
     try:
-        return decompress(filename, dest=dest, check_timestamps=True)
+        return decompress(filename, dest=dest, check_timestamps=True,
+                          in_sums=in_sums, out_sums=out_sums)
     except (OSError, IOError), e:
         if cached and e.errno == errno.EACCES:
             return None
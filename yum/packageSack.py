@@ -134,6 +134,22 @@ class PackageSackBase(object):
         """return dict { packages -> list of matching requires }"""
         raise NotImplementedError()
 
+    def getProvidesMany(self, reqs):
+        """return dict { req -> dict { packages -> list of matching provides } }
+           for a list of (name, flags, version) reqs"""
+        ret = {}
+        for req in reqs:
+            ret[req] = self.getProvides(*req)
+        return ret
+
+    def getRequiresMany(self, reqs):
+        """return dict { req -> dict { packages -> list of matching requires } }
+           for a list of (name, flags, version) reqs"""
+        ret = {}
+        for req in reqs:
+            ret[req] = self.getRequires(*req)
+        return ret
+
     def searchRequires(self, name):
         """return list of package requiring the name (any evr and flag)"""
         raise NotImplementedError()
@@ -413,6 +429,16 @@ class MetaSack(PackageSackBase):
         """return dict { packages -> list of matching requires }"""
         return self._computeAggregateDictResult("getRequires", name, flags, version)
 
+    def getProvidesMany(self, reqs):
+        """return dict { req -> dict { packages -> list of matching provides } }
+           for a list of (name, flags, version) reqs"""
+        return self._computeAggregateDictManyResult("getProvidesMany", reqs)
+
+    def getRequiresMany(self, reqs):
+        """return dict { req -> dict { packages -> list of matching requires } }
+           for a list of (name, flags, version) reqs"""
+        return self._computeAggregateDictManyResult("getRequiresMany", reqs)
+
     def searchRequires(self, name):
         """return list of package requiring the name (any evr and flag)"""
         return self._computeAggregateListResult("searchRequires", name)
@@ -615,6 +641,24 @@ class MetaSack(PackageSackBase):
                     result.update(sackResult)
         return result
 
+    def _computeAggregateDictManyResult(self, methodName, reqs):
+        reqs = list(reqs)
+        result = {}
+        for req in reqs:
+            result[req] = {}
+        for sack in sorted(self.sacks.values()):
+            if hasattr(sack, methodName):
+                method = getattr(sack, methodName)
+                try:
+                    sackResult = method(reqs)
+                except PackageSackError:
+                    continue
+
+                for req, pkgs in sackResult.iteritems():
+                    if pkgs:
+                        result[req].update(pkgs)
+        return result
+
 
 
 class PackageSack(PackageSackBase):
@@ -804,6 +804,7 @@ class YumAvailablePackage(PackageObject, RpmBase):
         self.state = None
         self._loadedfiles = False
         self._verify_local_pkg_cache = None
+        self._checksum_meter = None
 
         if pkgdict != None:
             self.importFromDict(pkgdict)
@@ -1003,10 +1004,17 @@ class YumAvailablePackage(PackageObject, RpmBase):
                 return True
 
         (csum_type, csum) = self.returnIdSum()
-        
+
+        #  If we are downloading it, see YumRepository.getPackage(), most of it
+        # has been checksummed already.
+        filesum = None
+        if getattr(self, '_checksum_meter', None) is not None:
+            filesum = self._checksum_meter.checksum(csum_type, nst)
+
         try:
-            filesum = misc.checksum(csum_type, self.localPkg(),
-                                    datasize=self.packagesize)
+            if filesum is None:
+                filesum = misc.checksum(csum_type, self.localPkg(),
+                                        datasize=self.packagesize)
         except Errors.MiscError:
             if from_cashe:
                 self._cashe.unlink()
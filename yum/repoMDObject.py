@@ -26,6 +26,18 @@ def ns_cleanup(qn):
     if qn.find('}') == -1: return qn 
     return qn.split('}')[1]
 
+def _manifest_line(vals):
+    """ Join the values into a manifest line, None values are empty. Returns
+        None if any of them can't be stored. """
+    ret = []
+    for val in vals:
+        if val is None:
+            val = ''
+        if type(val) != types.StringType or '\t' in val or '\n' in val:
+            return None
+        ret.append(val)
+    return '\t'.join(ret)
+
 class RepoData:
     """represents anything beneath a <data> tag"""
     def __init__(self, elem=None):
@@ -117,6 +129,35 @@ class RepoData:
         msg += bottom
         return msg
         
+    def dump_manifest(self, tag='data'):
+        """ Return the data as a line for a manifest, or None if it can't be
+            in one. See RepoMD.dump_manifest(). """
+        ret = [tag, self.type, self.location[0], self.location[1],
+               self.checksum[0], self.checksum[1],
+               self.openchecksum[0], self.openchecksum[1],
+               self.timestamp, self.dbversion, self.size, self.opensize]
+        ret = _manifest_line(ret)
+        if ret is None:
+            return None
+        ret = [ret]
+        for delta in self.deltas:
+            dline = delta.dump_manifest('delta')
+            if dline is None:
+                return None
+            ret.extend(dline)
+        return ret
+
+    def parse_manifest(self, vals):
+        """ Load the data from the values of a manifest line. """
+        if len(vals) != 12:
+            raise RepoMDError, "Damaged repomd manifest"
+        vals = [val or None for val in vals]
+        self.type = vals[1]
+        self.location = (vals[2], vals[3])
+        self.checksum = (vals[4], vals[5])
+        self.openchecksum = (vals[6], vals[7])
+        (self.timestamp, self.dbversion, self.size, self.opensize) = vals[8:]
+
     def getDelta(self, old_timestamp):
         old_timestamp = int(old_timestamp)
         for deltamd in self.deltas:
@@ -136,6 +177,9 @@ class RepoMD:
         self.length    = 0
         self.revision  = None
         self.tags      = {'content' : set(), 'distro' : {}, 'repo': set()}
+        #  Which of the duplicate data entries we used depends on what is in
+        # the cachedir, so this can't go in a manifest keyed on repomd.xml.
+        self._cache_dependent = False
     
         if srcfile:
             self.parse(srcfile)
@@ -166,10 +210,12 @@ class RepoMD:
                     old = self.repoData.get(thisdata.type)
                     if (old and old.size and old.size < thisdata.size
                         and old.location[1].rsplit('.', 1)[1] in _available_compression
-                        and srcfile and stat_f(srcfile.rsplit('/', 1)[0] +'/'+
-                                               thisdata.location[1].rsplit('/', 1)[1]) is None):
-                        # previous is smaller, can unzip it, and next is not cached
-                        thisdata = old
+                        and srcfile):
+                        self._cache_dependent = True
+                        if stat_f(srcfile.rsplit('/', 1)[0] +'/'+
+                                  thisdata.location[1].rsplit('/', 1)[1]) is None:
+                            # previous is smaller, can unzip it, and next is not cached
+                            thisdata = old
                     self.repoData[thisdata.type] = thisdata
                     try:
                         # NOTE: This will fail on float timestamps, this is
@@ -197,6 +243,65 @@ class RepoMD:
         except SyntaxError, e:
             raise RepoMDError, "Damaged repomd.xml file"
             
+    def dump_manifest(self):
+        """ Return the parsed data as a list of lines, for a manifest of
+            repomd.xml files. Returns None if it can't be stored (Eg. it has
+            non-ASCII data, or depends on the cached files). The format is
+            tab separated values, with the first value saying what the line
+            is. """
+        if self._cache_dependent:
+            return None
+        ret = []
+        lines = [['repomd', str(self.timestamp), str(self.length),
+                  self.revision]]
+        lines.extend([['checksum', csum, self.checksums[csum]]
+                      for csum in sorted(self.checksums)])
+        lines.extend([['content', val] for val in self.tags['content']])
+        lines.extend([['repo', val] for val in self.tags['repo']])
+        for cpeid in self.tags['distro']:
+            lines.extend([['distro', cpeid, val]
+                          for val in self.tags['distro'][cpeid]])
+        for vals in lines:
+            line = _manifest_line(vals)
+            if line is None:
+                return None
+            ret.append(line)
+        for ft in sorted(self.repoData):
+            lines = self.repoData[ft].dump_manifest()
+            if lines is None:
+                return None
+            ret.extend(lines)
+        return ret
+
+    def parse_manifest(self, lines):
+        """ Load the parsed data from lines from dump_manifest(). """
+        thisdata = None
+        for line in lines:
+            vals = line.split('\t')
+            if vals[0] == 'repomd' and len(vals) == 4:
+                try:
+                    self.timestamp = int(vals[1])
+                    self.length    = int(vals[2])
+                except ValueError:
+                    raise RepoMDError, "Damaged repomd manifest"
+                self.revision = vals[3] or None
+            elif vals[0] == 'checksum' and len(vals) == 3:
+                self.checksums[vals[1]] = vals[2]
+            elif vals[0] in ('content', 'repo') and len(vals) == 2:
+                self.tags[vals[0]].add(vals[1])
+            elif vals[0] == 'distro' and len(vals) == 3:
+                self.tags['distro'].setdefault(vals[1], set()).add(vals[2])
+            elif vals[0] == 'data':
+                thisdata = RepoData()
+                thisdata.parse_manifest(vals)
+                self.repoData[thisdata.type] = thisdata
+            elif vals[0] == 'delta' and thisdata is not None:
+                delta = RepoData()
+                delta.parse_manifest(vals)
+                thisdata.deltas.append(delta)
+            else:
+                raise RepoMDError, "Damaged repomd manifest"
+
     def fileTypes(self):
         """return list of metadata file types available"""
         return self.repoData.keys()
@@ -26,6 +26,46 @@ import urlgrabber.grabber
 
 from weakref import proxy as weakref
 
+try:
+    import multiprocessing
+except ImportError: # python-2.4/2.5
+    multiprocessing = None
+
+def _repo_gen_decompress_worker(args):
+    """ Run misc.repo_gen_decompress() in a worker process, any problems are
+        left for populate() to find (and report) again. """
+    try:
+        return misc.repo_gen_decompress(*args)
+    except KeyboardInterrupt:
+        return None
+    except Exception:
+        return None
+
+def decompressMD(todo, workers):
+    """ Decompress the (filename, generated_name, cached) files in todo, as
+        from YumPackageSack._decompress_list(), using upto workers processes.
+        If we can't use more than one process we do nothing, and let
+        populate() do them one at a time. """
+    workers = min(workers, len(todo))
+    if multiprocessing is None or workers < 2:
+        return
+
+    try:
+        pool = multiprocessing.Pool(workers)
+    except (OSError, ImportError), e:
+        logger = logging.getLogger("yum.verbose.Repos")
+        logger.debug("Can't start decompression workers: %s" % e)
+        return
+    try:
+        pool.map(_repo_gen_decompress_worker, todo, 1)
+        pool.close()
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.join()
+
+
 class _wrap_ayum_getKeyForRepo:
     """ This is a wrapper for calling YumBase.getKeyForRepo() because
         otherwise we take a real reference through the bound method and
@@ -80,38 +120,72 @@ class RepoStorage:
         if not hasattr(urlgrabber.grabber, 'parallel_wait'):
             return
 
-        repos = []
-        for repo in self.listEnabled():
-            if repo.cache:
-                continue
-            try:
-                dl = repo._async and repo._commonLoadRepoXML(repo)
-            except Errors.RepoError, e:
-                if not repo.skip_if_unavailable:
-                    raise
-                self.disableRepo(repo.id)
-                dl = False
-            if dl:
-                mdtypes = repo._mdpolicy2mdtypes()
-                downloading = repo._commonRetrieveDataMD_list(mdtypes)
-                repos.append((repo, downloading, [False]))
-
-        # with sizes first, then without sizes..
-        for no_size in (False, True):
-            for repo, downloading, error in repos:
-                def failfunc(obj, error=error):
-                    error[0] = True
-                for (ndata, nmdtype) in downloading:
-                    if (ndata.size is None) == no_size:
-                        repo._retrieveMD(nmdtype, async=True, failfunc=failfunc)
-            urlgrabber.grabber.parallel_wait()
+        connections = getattr(self.ayum.conf, 'setup_connections', 1)
+        try:
+            if connections > 1:
+                self._prefetchAllRepoXML(connections)
 
-        # done or revert
-        for repo, downloading, error in repos:
-            if error[0]: # some MD failed?
-                repo._revertOldRepoXML()
-            else:
-                repo._commonRetrieveDataMD_done(downloading)
+            repos = []
+            for repo in self.listEnabled():
+                if repo.cache:
+                    continue
+                try:
+                    dl = repo._async and repo._commonLoadRepoXML(repo)
+                except Errors.RepoError, e:
+                    if not repo.skip_if_unavailable:
+                        raise
+                    self.disableRepo(repo.id)
+                    dl = False
+                if dl:
+                    mdtypes = repo._mdpolicy2mdtypes()
+                    downloading = repo._commonRetrieveDataMD_list(mdtypes)
+                    repos.append((repo, downloading, [False]))
+
+            # with sizes first, then without sizes..
+            for no_size in (False, True):
+                for repo, downloading, error in repos:
+                    def failfunc(obj, error=error):
+                        error[0] = True
+                    for (ndata, nmdtype) in downloading:
+                        if (ndata.size is None) == no_size:
+                            repo._retrieveMD(nmdtype, async=True, failfunc=failfunc)
+                urlgrabber.grabber.parallel_wait()
+
+            # done or revert
+            for repo, downloading, error in repos:
+                if error[0]: # some MD failed?
+                    repo._revertOldRepoXML()
+                else:
+                    repo._commonRetrieveDataMD_done(downloading)
+        finally:
+            #  Even if a repo. failed, don't leave the prefetched files of the
+            # others around for the next run.
+            if connections > 1:
+                for repo in self.repos.values():
+                    if hasattr(repo, '_asyncDone'):
+                        repo._asyncDone()
+
+    def _prefetchAllRepoXML(self, connections):
+        """ Download the metalinks, and then the repomd.xml files, of all the
+            enabled repos. in parallel, upto connections at once. They are then
+            checked (and any GPG keys imported) as each repo. is setup, as
+            normal. Any errors here are ignored, the repo. will hit them again
+            when it's setup and that handles skip_if_unavailable as normal. """
+        repos = [repo for repo in self.listEnabled()
+                 if repo._async and not repo.cache]
+        max_connections = urlgrabber.grabber.default_grabber.opts.max_connections
+        urlgrabber.grabber.default_grabber.opts.max_connections = connections
+        try:
+            for func in ('_asyncMetalink', '_asyncRepoXML'):
+                for repo in repos:
+                    try:
+                        getattr(repo, func)()
+                    except Errors.RepoError, e:
+                        self.logger.debug("Not prefetching for %s: %s" %
+                                          (repo.ui_id, e))
+                urlgrabber.grabber.parallel_wait()
+        finally:
+            urlgrabber.grabber.default_grabber.opts.max_connections = max_connections
 
     def doSetup(self, thisrepo = None):
         
@@ -380,6 +454,19 @@ class RepoStorage:
                     sack._retrieve_async(repo, data)
             urlgrabber.grabber.parallel_wait()
 
+        workers = getattr(self.ayum.conf, 'decompress_workers', 1)
+        if workers > 1:
+            # Decompress all the DBs we'll need in parallel, populate() will
+            # then see they are up to date.
+            todo = []
+            for repo in myrepos:
+                try:
+                    todo.extend(repo.getPackageSack()._decompress_list(repo,
+                                                                       data))
+                except Errors.RepoError:
+                    pass # populate() will deal with it.
+            decompressMD(todo, workers)
+
         for repo in myrepos:
             sack = repo.getPackageSack()
             try:
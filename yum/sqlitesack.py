@@ -25,6 +25,7 @@ import fnmatch
 
 import yumRepo
 from packages import PackageObject, RpmBase, YumAvailablePackage, parsePackages
+from packageSack import packagesNewestByName, packagesNewestByNameArch
 import Errors
 import misc
 
@@ -38,6 +39,7 @@ from yum.i18n import to_utf8, to_unicode
 import sys
 import re
 import warnings
+import weakref
 
 def catchSqliteException(func):
     """This decorator converts sqlite exceptions into RepoError"""
@@ -175,6 +177,104 @@ def _excluder_match(excluder, match, regexp_match, data, e,v,r,a):
 
     return False
 
+#  Containers which an "in" excluder can hold that don't change underneath us,
+# anything else (Eg. the cost excluder) has to be asked every time.
+_static_excluder_in_types = (set, frozenset, dict, list, tuple)
+
+def _pkg_excluders_match(excluders, n,e,v,r,a):
+    """ Run the split (type, match type, match, regexp_match) excluders
+        against a package, return True if the package is excluded. """
+    data = {'n' : n.lower(), 'pkgtup' : (n, a, e, v, r), 'marked' : False}
+    e = e.lower()
+    v = v.lower()
+    r = r.lower()
+    a = a.lower()
+
+    for exT, exM, match, regexp_match in excluders:
+        if False: pass
+        elif exT == 'exclude':
+            if _excluder_match(exM, match, regexp_match, data, e,v,r,a):
+                return True
+
+        elif exT == 'include':
+            if _excluder_match(exM, match, regexp_match, data, e,v,r,a):
+                break
+
+        elif exT == 'mark':
+            if data['marked']:
+                pass # Speed opt. don't do matches we don't need to do.
+            elif _excluder_match(exM, match, regexp_match, data, e,v,r,a):
+                data['marked'] = True
+
+        elif exT == 'wash':
+            if not data['marked']:
+                pass # Speed opt. don't do matches we don't need to do.
+            elif _excluder_match(exM, match, regexp_match, data, e,v,r,a):
+                data['marked'] = False
+
+        else:
+            assert False, 'Bad excluder: ' + exT
+
+    return False
+
+def _search_req(name, flags, version):
+    """ Turn the name/flags/version args. of getProvides() etc. into the
+        (name, flags, (e, v, r)) requirement used by _search(). """
+    name = to_unicode(name)
+    if flags == 0:
+        flags = None
+    if type(version) in (str, type(None), unicode):
+        return (name, flags, rpmUtils.miscutils.stringToVersion(version))
+    # would this ever be a list?
+    return (name, flags, tuple(version))
+
+class _NewestEVR:
+    """ The yum_newest(pkgKey, epoch, version, release, ties) aggregate, the
+        pkgKey of the newest EVR in the group (or all of the newest ones, space
+        separated, with ties). """
+    def __init__(self):
+        self.evr = None
+        self.pkgKeys = []
+
+    def step(self, pkgKey, e, v, r, ties):
+        if e is None:
+            e = '0'
+        if self.evr is None:
+            cval = 1
+        else:
+            cval = rpmUtils.miscutils.compareEVR((e, v, r), self.evr)
+        if cval > 0:
+            self.evr = (e, v, r)
+            self.pkgKeys = [pkgKey]
+        elif cval == 0 and ties:
+            self.pkgKeys.append(pkgKey)
+
+    def finalize(self):
+        return " ".join([str(pkgKey) for pkgKey in self.pkgKeys])
+
+#  The packages fields in the _searchIndex() full text index, these are the ones
+# "yum search" looks at.
+_search_index_fields = ('name', 'summary', 'description', 'url')
+
+#  The most names we keep in the on disk prco cache, for each repo. When there
+# are more than this, only the ones used in this run are written out, so it
+# doesn't keep growing over the life of a primary_db.
+_prco_cache_max_names = 20000
+
+def _prco_row_val(x):
+    """ Make the (name, flags, evr) tuple for a prco table row. """
+    val = (_share_data(x['name']), _share_data(x['flags']),
+           (_share_data(x['epoch']), _share_data(x['version']),
+            _share_data(x['release'])))
+    return _share_data(val)
+
+def _db_filename(cache):
+    """ Return the filename of a sqlite connection's main DB, or None. """
+    for ob in cache.execute("PRAGMA database_list"):
+        if ob[1] == 'main':
+            return ob[2] or None
+    return None
+
 def _deduplicate(cur, field):
     """Eliminate duplicate rows from cursor based on field.
 
@@ -191,22 +291,35 @@ def _deduplicate(cur, field):
         yield ob
 
 
+#  The prco data of a package that hasn't been loaded yet (tuples), this is
+# shared by all packages until they load some, see returnPrco().
+_prco_unloaded = { 'obsoletes': (),
+                   'conflicts': (),
+                   'requires': (),
+                   'provides': (),
+                   'suggests': (),
+                   'enhances': (),
+                   'recommends': (),
+                   'supplements': () }
+
 class YumAvailablePackageSqlite(YumAvailablePackage, PackageObject, RpmBase):
+    #  We create one of these for every package in the repos. when doing
+    # "list available" etc. so the attributes every package has are in slots,
+    # and the defaults are on the class. A __dict__ is only created for
+    # packages that load more data (Eg. prco, files or via. __getattr__).
+    __slots__ = ('name', 'arch', 'epoch', 'version', 'release', 'pkgtup',
+                 'ver', 'rel', 'pkgKey', 'pkgId', 'id', '_checksums',
+                 'sack', 'repoid', 'repo', '_hash')
+    prco = _prco_unloaded
+    state = None
+    _loadedfiles = False
+    _files = None
+    _changelog = None
+
     def __init__(self, repo, db_obj):
-        self.prco = { 'obsoletes': (),
-                      'conflicts': (),
-                      'requires': (),
-                      'provides': (),
-                      'suggests': (),
-                      'enhances': (),
-                      'recommends': (),
-                      'supplements': () }
         self.sack = repo.sack
         self.repoid = repo.id
         self.repo = repo
-        self.state = None
-        self._loadedfiles = False
-        self._files = None
         self._read_db_obj(db_obj)
         # for stupid metadata created without epochs listed in the version tag
         # die die
@@ -217,7 +330,6 @@ class YumAvailablePackageSqlite(YumAvailablePackage, PackageObject, RpmBase):
         self.rel = self.release 
         self.pkgtup = (self.name, self.arch, self.epoch, self.version, self.release)
 
-        self._changelog = None
         self._hash = None
         
 
@@ -433,6 +545,8 @@ class YumAvailablePackageSqlite(YumAvailablePackage, PackageObject, RpmBase):
             sql = "SELECT name, version, release, epoch, flags " \
                   "FROM %s WHERE pkgKey = ?" % prcotype
             cur = self._sql_MD('primary', sql, (self.pkgKey,))
+            if self.prco is _prco_unloaded:
+                self.prco = _prco_unloaded.copy()
             self.prco[prcotype] = [ ]
             for ob in cur:
                 if not ob['name']:
@@ -489,7 +603,25 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
         self._arch_allowed = None
         self._pkgExcluder = []
         self._pkgExcludeIds = {}
+        self._pkgExcluderRepo = {}     # of [repo] => (excluders, static)
+        self._pkgExcludeCompiled = {}  # of [repo] => set() of pkgKey's
+        self._pkgExcludeLookups = {}   # of [repo] => num. uncompiled lookups
+        self._prco_disk = {}         # of [repo] => (fname, csum, data) or None
+        self._prco_disk_dirty = set() # of repo
+        self._prco_disk_used = {}    # of [repo] => set() of (prcotype, name)
+        self._filelists_index = {}   # of [repo] => sqlite conn. or None
+        self._search_index = {}      # of [repo] => sqlite conn. or None
+        self._prco_rows = {}         # of [repo] => {prcotype => {name => rows}}
+        self._attached = None        # _AttachedPrimaryDBs we are in
+        self._key2pkg_ticks = {}     # of [repo] => {pkgKey => last use}
+        self._key2pkg_tick = 0
+        self._key2pkg_evicted = {}   # of [repo] => weak {pkgKey => po}
         self._pkgobjlist_dirty = False
+        #  How well the package object cache (_key2pkg) is doing, see the
+        # pkg_cache_max option.
+        self.pkg_cache_hits = 0
+        self.pkg_cache_misses = 0
+        self.pkg_cache_evictions = 0
 
     @catchSqliteException
     def _sql_MD(self, MD, repo, sql, *args):
@@ -547,6 +679,8 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             del self.pkgobjlist
         self._pkgobjlist_dirty = False
         self._key2pkg = {}
+        self._key2pkg_ticks = {}
+        self._key2pkg_evicted = {}
         self._pkgname2pkgkeys = {}
         self._pkgnames_loaded = set()
         self._pkgmatch_fails = set()
@@ -556,16 +690,26 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             'provides' : { },
             'requires' : { },
             }
+        self._prco_rows = {}
         misc.unshare_data()
 
     @catchSqliteException
     def close(self):
+        self._prcoCacheSave()
         self.dropCachedData()
+        if self._attached is not None:
+            self._attached.close()
 
         for dataobj in self.primarydb.values() + \
                        self.filelistsdb.values() + \
                        self.otherdb.values():
             dataobj.close()
+        for dataobj in self._filelists_index.values() + \
+                       self._search_index.values():
+            if dataobj is not None:
+                dataobj.close()
+        self._filelists_index = {}
+        self._search_index = {}
         self.primarydb = {}
         self.filelistsdb = {}
         self.otherdb = {}
@@ -575,6 +719,12 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
         self._all_excludes = {}
         self._pkgExcluder = []
         self._pkgExcludeIds = {}
+        self._pkgExcluderRepo = {}
+        self._pkgExcludeCompiled = {}
+        self._pkgExcludeLookups = {}
+        self._prco_disk = {}
+        self._prco_disk_dirty = set()
+        self._prco_disk_used = {}
         self._pkgobjlist_dirty = False
 
         yumRepo.YumPackageSack.close(self)
@@ -592,6 +742,10 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             Note that this doesn't update self.exclude. '''
         self._excludes.add((repo, pkgKey))
         # Don't keep references around, just wastes memory.
+        if repo in self._key2pkg_ticks:
+            self._key2pkg_ticks[repo].pop(pkgKey, None)
+        if repo in self._key2pkg_evicted:
+            self._key2pkg_evicted[repo].pop(pkgKey, None)
         if repo in self._key2pkg:
             po = self._key2pkg[repo].pop(pkgKey, None)
             if po is not None: # Will also be in the pkgtup2pkgs cache...
@@ -614,10 +768,15 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
     def _delAllPackages(self, repo):
         """ Exclude all packages from the repo. """
         self._all_excludes[repo] = True
+        self._pkgExcludeCompiled.pop(repo, None)
         if repo in self.excludes:
             del self.excludes[repo]
         if repo in self._key2pkg:
             del self._key2pkg[repo]
+        if repo in self._key2pkg_ticks:
+            del self._key2pkg_ticks[repo]
+        if repo in self._key2pkg_evicted:
+            del self._key2pkg_evicted[repo]
         if repo in self._pkgname2pkgkeys:
             del self._pkgname2pkgkeys[repo]
 
@@ -636,6 +795,69 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
 
         return self._excludes and (repo, pkgKey) in self._excludes
 
+    def _repoPkgExcluder(self, repo):
+        """ Return the addPackageExcluder() data that applies to the repo.
+            split into (type, match type, match, regexp_match), and whether
+            it's static (so the answers can be compiled). """
+        if repo in self._pkgExcluderRepo:
+            return self._pkgExcluderRepo[repo]
+
+        excluders = []
+        static = True
+        for repoid, excluder, match, regexp_match in self._pkgExcluder:
+            if repoid is not None and repoid != repo.id:
+                continue
+
+            exSPLIT = excluder.split('.', 1)
+            if len(exSPLIT) != 2:
+                assert False, 'Bad excluder: ' + excluder
+                continue
+
+            exT, exM = exSPLIT
+            if (exM.endswith('.in') and
+                not isinstance(match, _static_excluder_in_types)):
+                static = False
+            excluders.append((exT, exM, match, regexp_match))
+
+        self._pkgExcluderRepo[repo] = (excluders, static)
+        return self._pkgExcluderRepo[repo]
+
+    @catchSqliteException
+    def _compilePkgExcluder(self, repo, force=False):
+        """ Run the excluders for a repo. against all of its packages in one
+            pass, and keep the set of excluded pkgKeys. After that the exclude
+            question for the repo. is just a set lookup. We only do this once
+            the repo. has had enough lookups (or force is set, because we are
+            going to look at every package anyway). Returns None if the
+            excluders aren't compiled. """
+        if repo in self._pkgExcludeCompiled:
+            return self._pkgExcludeCompiled[repo]
+
+        excluders, static = self._repoPkgExcluder(repo)
+        if not static:
+            return None
+
+        if not force:
+            num = self._pkgExcludeLookups.get(repo, 0) + 1
+            self._pkgExcludeLookups[repo] = num
+            if num < constants.EXCLUDER_COMPILE_MIN:
+                return None
+
+        excluded = set()
+        if excluders:
+            sql = """SELECT pkgKey, name, epoch, version, release, arch
+                     FROM packages"""
+            for x in self._sql_MD('primary', repo, sql):
+                e = x['epoch']
+                if e is None:
+                    e = '0'
+                if _pkg_excluders_match(excluders, x['name'], e,
+                                        x['version'], x['release'], x['arch']):
+                    excluded.add(x['pkgKey'])
+        self._pkgExcludeCompiled[repo] = excluded
+        self._pkgExcludeLookups.pop(repo, None)
+        return excluded
+
     def _pkgExcludedRKNEVRA(self, repo,pkgKey, n,e,v,r,a):
         ''' Main function to use for "can we use this package" question.
                 . Tests repo against allowed repos.
@@ -657,46 +879,17 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
         if not self._pkgExcluder:
             return False
 
-        data = {'n' : n.lower(), 'pkgtup' : (n, a, e, v, r), 'marked' : False}
-        e = e.lower()
-        v = v.lower()
-        r = r.lower()
-        a = a.lower()
-
-        for repoid, excluder, match, regexp_match in self._pkgExcluder:
-            if repoid is not None and repoid != repo.id:
-                continue
-
-            exSPLIT = excluder.split('.', 1)
-            if len(exSPLIT) != 2:
-                assert False, 'Bad excluder: ' + excluder
-                continue
-
-            exT, exM = exSPLIT
-            if False: pass
-            elif exT == 'exclude':
-                if _excluder_match(exM, match, regexp_match, data, e,v,r,a):
-                    self._delPackageRK(repo, pkgKey)
-                    return True
-
-            elif exT == 'include':
-                if _excluder_match(exM, match, regexp_match, data, e,v,r,a):
-                    break
-
-            elif exT == 'mark':
-                if data['marked']:
-                    pass # Speed opt. don't do matches we don't need to do.
-                elif _excluder_match(exM, match, regexp_match, data, e,v,r,a):
-                    data['marked'] = True
-
-            elif exT == 'wash':
-                if not data['marked']:
-                    pass # Speed opt. don't do matches we don't need to do.
-                elif _excluder_match(exM, match, regexp_match, data, e,v,r,a):
-                    data['marked'] = False
+        excluded = self._compilePkgExcluder(repo)
+        if excluded is not None:
+            if pkgKey in excluded:
+                self._delPackageRK(repo, pkgKey)
+                return True
+            return False
 
-            else:
-                assert False, 'Bad excluder: ' + excluder
+        excluders, static = self._repoPkgExcluder(repo)
+        if _pkg_excluders_match(excluders, n,e,v,r,a):
+            self._delPackageRK(repo, pkgKey)
+            return True
 
         self._exclude_whitelist.add((repo, pkgKey))
         return False
@@ -757,6 +950,13 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
         if excluderid is not None:
             self._pkgExcludeIds[excluderid] = len(self._pkgExcluder)
 
+        # Any compiled excludes for the affected repos. are now wrong.
+        for repo in self._pkgExcluderRepo.keys():
+            if repoid is None or repoid == repo.id:
+                del self._pkgExcluderRepo[repo]
+                self._pkgExcludeCompiled.pop(repo, None)
+                self._pkgExcludeLookups.pop(repo, None)
+
         self._exclude_whitelist = set()
         self._pkgobjlist_dirty  = True
 
@@ -779,15 +979,12 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
                 raise Errors.RepoError(msg, repo=repo)
             if exclude and self._pkgExcludedRKD(repo, pkgKey, data):
                 return None
-            po = self.pc(repo, data)
-            self._key2pkg[repo][pkgKey] = po
-            self._pkgtup2pkgs.setdefault(po.pkgtup, []).append(po)
-            pkgkeys = self._pkgname2pkgkeys[repo].setdefault(data['name'], [])
-            pkgkeys.append(pkgKey)
-        elif exclude and self._pkgExcluded(self._key2pkg[repo][pkgKey]):
+            if not self._key2pkgRevive(repo, pkgKey):
+                return self._key2pkgAdd(repo, pkgKey, data)
+        if exclude and self._pkgExcluded(self._key2pkg[repo][pkgKey]):
             self._delPackageRK(repo, pkgKey)
             return None
-        return self._key2pkg[repo][pkgKey]
+        return self._key2pkgHit(repo, pkgKey)
         
     def _packageByKeyData(self, repo, pkgKey, data, exclude=True):
         """ Like _packageByKey() but we already have the data for .pc() """
@@ -798,12 +995,95 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             self._key2pkg[repo] = {}
             self._pkgname2pkgkeys[repo] = {}
         if data['pkgKey'] not in self._key2pkg.get(repo, {}):
-            po = self.pc(repo, data)
-            self._key2pkg[repo][pkgKey] = po
-            self._pkgtup2pkgs.setdefault(po.pkgtup, []).append(po)
-            pkgkeys = self._pkgname2pkgkeys[repo].setdefault(data['name'], [])
+            if not self._key2pkgRevive(repo, pkgKey):
+                return self._key2pkgAdd(repo, pkgKey, data)
+        return self._key2pkgHit(repo, data['pkgKey'])
+
+    def _key2pkgAdd(self, repo, pkgKey, data):
+        """ Create the package object for pkgKey, and put it in the cache. """
+        self.pkg_cache_misses += 1
+        po = self.pc(repo, data)
+        pkgkeys = self._pkgname2pkgkeys[repo].setdefault(data['name'], [])
+        #  If we evicted the pkg. it's still here, so we don't need to load all
+        # the packages for the name again.
+        if pkgKey not in pkgkeys:
             pkgkeys.append(pkgKey)
-        return self._key2pkg[repo][data['pkgKey']]
+        self._key2pkgPut(repo, pkgKey, po)
+        return po
+
+    def _key2pkgPut(self, repo, pkgKey, po):
+        """ Put the package object for pkgKey in the cache, pruning the least
+            recently used ones if we have too many. """
+        self._key2pkg.setdefault(repo, {})[pkgKey] = po
+        self._pkgtup2pkgs.setdefault(po.pkgtup, []).append(po)
+        if repo in self._key2pkg_evicted:
+            self._key2pkg_evicted[repo].pop(pkgKey, None)
+
+        max_pkgs = getattr(repo, 'pkg_cache_max', 0)
+        if max_pkgs > 0:
+            ticks = self._key2pkg_ticks.setdefault(repo, {})
+            self._key2pkg_tick += 1
+            ticks[pkgKey] = self._key2pkg_tick
+            if len(ticks) > max_pkgs:
+                self._key2pkgPrune(repo, max_pkgs)
+
+    def _key2pkgRevive(self, repo, pkgKey):
+        """ If we evicted the package object for pkgKey, but something else
+            (Eg. the transaction) still has it, put it back in the cache. So
+            we never have two objects for the same package. """
+        evicted = self._key2pkg_evicted.get(repo)
+        if not evicted:
+            return False
+        po = evicted.get(pkgKey)
+        if po is None:
+            return False
+        self._key2pkgPut(repo, pkgKey, po)
+        return True
+
+    def _key2pkgHit(self, repo, pkgKey):
+        """ Return the cached package object for pkgKey, and mark it as used. """
+        self.pkg_cache_hits += 1
+        ticks = self._key2pkg_ticks.get(repo)
+        if ticks is not None:
+            self._key2pkg_tick += 1
+            ticks[pkgKey] = self._key2pkg_tick
+        return self._key2pkg[repo][pkgKey]
+
+    def _key2pkgPrune(self, repo, max_pkgs):
+        """ Drop the least recently used package objects for the repo, so we
+            are under max_pkgs. We drop an extra 10% so we don't have to sort
+            on every new package. """
+        #  Everything is referenced from the pkgobjlist anyway, and dropping
+        # them from here would just create a second copy when they are used.
+        if hasattr(self, 'pkgobjlist'):
+            return
+
+        ticks = self._key2pkg_ticks[repo]
+        pkgs = self._key2pkg.get(repo, {})
+        if repo not in self._key2pkg_evicted:
+            self._key2pkg_evicted[repo] = weakref.WeakValueDictionary()
+        evicted = self._key2pkg_evicted[repo]
+        num = len(ticks) - max_pkgs + (max_pkgs / 10)
+        old = sorted(ticks.iteritems(), key=operator.itemgetter(1))[:num]
+        for pkgKey, tick in old:
+            del ticks[pkgKey]
+            po = pkgs.pop(pkgKey, None)
+            if po is None:
+                continue
+            self.pkg_cache_evictions += 1
+            evicted[pkgKey] = po
+            #  Leave the pkgtup, _YumCostExclude uses it to know the package
+            # exists in this repo.
+            pos = self._pkgtup2pkgs.get(po.pkgtup, [])
+            self._pkgtup2pkgs[po.pkgtup] = [x for x in pos if x is not po]
+
+    def _key2pkgRestore(self, pkgs):
+        """ Put back any of the pkgs we dropped from the cache while loading
+            them, so we don't create a second copy of them later. """
+        for po in pkgs:
+            if po.pkgKey in self._key2pkg.get(po.repo, {}):
+                continue
+            self._key2pkgPut(po.repo, po.pkgKey, po)
 
     def _pkgtupByKeyData(self, repo, pkgKey, data):
         """ Like _packageByKeyData() but we don't create the package, we just
@@ -850,6 +1130,9 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
 
         if datatype == 'metadata':
             self.primarydb[repo] = dataobj
+            dataobj.create_aggregate("yum_newest", 5, _NewestEVR)
+            if self._attached is not None: # It doesn't know about this one
+                self._attached.close()
         elif datatype == 'filelists':
             self.filelistsdb[repo] = dataobj
         elif datatype == 'otherdata':
@@ -934,6 +1217,146 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             self._cached_fRFE = self._have_fastReturnFileEntries()
         return self._cached_fRFE
 
+    def _repoDBChecksum(self, repo, mdtype):
+        """ Return the repomd.xml checksum of the repo.'s mdtype DB, as a
+            "type:value" string, for keying data we generate from it. None
+            if we can't tie the DB to it. """
+        #  With local XML => sqlite conversion the pkgKeys aren't tied to
+        # anything in repomd.xml, so don't trust them across runs.
+        if getattr(repo, '_xml2sqlite_local', False):
+            return None
+        try:
+            data = repo.repoXML.getData(mdtype)
+        except (Errors.RepoError, Errors.RepoMDError):
+            return None
+        csum = "%s:%s" % data.checksum
+        #  A DB updated with a delta has the same packages as the real one, but
+        # not the same pkgKeys.
+        fname = getattr(repo, '_deltaMDValid', lambda x, y: None)(data, mdtype)
+        if fname:
+            csum += ":delta:%d" % int(os.stat(fname).st_mtime)
+        return csum
+
+    def _genIndexDB(self, repo, name, csum, build):
+        """ Return a connection to the sqlite DB name in the repo.'s gen/ dir,
+            if it was made for the csum DB checksum. If not, make a new one
+            by calling build(cursor) and write it out via. a .tmp file.
+            None if that fails, or gen/ isn't writable. """
+        fname = repo.cachedir + '/gen/' + name
+        if os.path.exists(fname):
+            try:
+                conn = sqlutils.sqlite.connect(fname)
+                cur = conn.cursor()
+                executeSQL(cur, "SELECT checksum FROM db_info")
+                for ob in cur:
+                    if ob[0] == csum:
+                        conn.row_factory = sqlutils.sqlite.Row
+                        return conn
+                conn.close()
+            except sqlutils.sqlite.Error:
+                pass
+
+        if not os.access(os.path.dirname(fname), os.W_OK):
+            return None
+
+        misc.unlink_f(fname + '.tmp')
+        try:
+            conn = sqlutils.sqlite.connect(fname + '.tmp')
+            cur = conn.cursor()
+            executeSQL(cur, "PRAGMA synchronous = OFF")
+            executeSQL(cur, "CREATE TABLE db_info (checksum TEXT)")
+            build(cur)
+            executeSQL(cur, "INSERT INTO db_info VALUES (?)", (csum,))
+            conn.commit()
+            conn.close()
+            os.rename(fname + '.tmp', fname)
+            conn = sqlutils.sqlite.connect(fname)
+        except (sqlutils.sqlite.Error, OSError):
+            misc.unlink_f(fname + '.tmp')
+            return None
+
+        conn.row_factory = sqlutils.sqlite.Row
+        return conn
+
+    def _filelistsIndex(self, repo, cache):
+        """ Return a connection to the basename => (pkgKey, dirname) index of
+            the repo.'s filelists, building it in the gen/ dir if it's not
+            there or is for an older filelists_db. None if the repo. doesn't
+            use one, or we can't build it. """
+        if repo in self._filelists_index:
+            return self._filelists_index[repo]
+
+        self._filelists_index[repo] = None
+        if not getattr(repo, 'filelists_index', False):
+            return None
+        csum = self._repoDBChecksum(repo, 'filelists_db')
+        if csum is None:
+            return None
+
+        def _basenames(cur):
+            for (pkgKey, dirname, filenames) in cur:
+                for filename in filenames.split('/'):
+                    yield (filename, dirname, pkgKey)
+
+        def _build(cur):
+            executeSQL(cur, """CREATE TABLE basenames
+                               (basename TEXT, dirname TEXT, pkgKey INTEGER)""")
+            fcur = cache.cursor()
+            executeSQL(fcur, "SELECT pkgKey, dirname, filenames FROM filelist")
+            cur.executemany("INSERT INTO basenames VALUES (?, ?, ?)",
+                            _basenames(fcur))
+            executeSQL(cur, "CREATE INDEX basename ON basenames (basename)")
+            executeSQL(cur, "CREATE INDEX dirname ON basenames (dirname)")
+
+        conn = self._genIndexDB(repo, 'filelists-basenames.sqlite', csum, _build)
+        self._filelists_index[repo] = conn
+        return conn
+
+    def _searchIndex(self, repo, cache, fields):
+        """ Return a connection to the full text index of the repo.'s
+            primary_db, if it covers all the fields, building it in the gen/
+            dir if it's not there or is for an older primary_db. The index
+            is an FTS5 "search" table using the trigram tokenizer, with the
+            pkgKey as the rowid, so it answers the same LIKE '%foo%'
+            queries as the packages table. None if the repo. doesn't use
+            one, or this sqlite can't build it. """
+        for field in fields:
+            if field not in _search_index_fields:
+                return None
+
+        if repo in self._search_index:
+            return self._search_index[repo]
+
+        self._search_index[repo] = None
+        if not getattr(repo, 'search_index', False):
+            return None
+        csum = self._repoDBChecksum(repo, 'primary_db')
+        if csum is None:
+            return None
+
+        def _build(cur):
+            fields = ", ".join(_search_index_fields)
+            executeSQL(cur, """CREATE VIRTUAL TABLE search USING
+                               fts5(%s, tokenize='trigram')""" % fields)
+            pcur = cache.cursor()
+            executeSQL(pcur, "SELECT pkgKey, %s FROM packages" % fields)
+            sql = "INSERT INTO search (rowid, %s) VALUES (?%s)"
+            sql = sql % (fields, ", ?" * len(_search_index_fields))
+            cur.executemany(sql, (tuple(ob) for ob in pcur))
+
+        conn = self._genIndexDB(repo, 'primary-search.sqlite', csum, _build)
+        self._search_index[repo] = conn
+        return conn
+
+    def buildIndexes(self, repo):
+        """ Build the gen/ indexes the repo. uses, for the DBs we have loaded,
+            if they aren't already there. So they are ready before the first
+            search (Eg. from "yum makecache"). """
+        if repo in self.filelistsdb:
+            self._filelistsIndex(repo, self.filelistsdb[repo])
+        if repo in self.primarydb:
+            self._searchIndex(repo, self.primarydb[repo], _search_index_fields)
+
     @catchSqliteException
     def searchFiles(self, name, strict=False):
         """search primary if file will be in there, if not, search filelists, use globs, if possible"""
@@ -989,6 +1412,27 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
                 raise Errors.RepoError('Check of Primary and Filelists sync. failed.', repo=repo)
             repo._checked_filelists_pkgs = True
 
+        #  The basename index can answer anything where the basename is either
+        # a literal or the only glob. Note that a glob in the basename can
+        # still match files in subdirs. of dirname, like the normal search.
+        idx_sql = None
+        if not glob:
+            idx_sql = """SELECT pkgKey FROM basenames
+                         WHERE basename = ? AND dirname = ?"""
+            idx_params = [filename, dirname]
+        elif not file_glob:
+            idx_sql = """SELECT pkgKey FROM basenames
+                         WHERE basename = ? AND dirname GLOB ?"""
+            idx_params = [filename, dirname]
+        elif not misc.re_glob(dirname):
+            idx_sql = """SELECT pkgKey FROM basenames
+                         WHERE dirname = ? AND basename GLOB ?
+                         UNION
+                         SELECT pkgKey FROM basenames
+                         WHERE dirname GLOB ? AND
+                               dirname || '/' || basename GLOB ?"""
+            idx_params = [dirname, filename, dirname.rstrip('/') + '/*', name]
+
         sql_params = []
         dirname_check = ""
         if not glob:
@@ -1020,6 +1464,14 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             if rep in self._all_excludes:
                 continue
 
+            if idx_sql is not None:
+                idx = self._filelistsIndex(rep, cache)
+                if idx is not None:
+                    cur = idx.cursor()
+                    executeSQL(cur, idx_sql, idx_params)
+                    self._sql_pkgKey2po(rep, cur, pkgs)
+                    continue
+
             cur = cache.cursor()
 
             # grab the entries that are a single file in the 
@@ -1072,14 +1524,22 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
         
         searchstring = searchstring.replace("'", "''")
         (searchstring, esc) = sql_esc(searchstring)
-        sql = "select DISTINCT pkgKey from packages where %s like '%%%s%%'%s " % (fields[0], searchstring, esc)
-        
-        for f in fields[1:]:
-            sql = "%s or %s like '%%%s%%'%s " % (sql, f, searchstring, esc)
+        def _sql(table, key):
+            #  The packages table, or the search index (where the pkgKey is
+            # the rowid) have the same fields.
+            sql = "select DISTINCT %s AS pkgKey from %s where %s like '%%%s%%'%s " % (key, table, fields[0], searchstring, esc)
+            for f in fields[1:]:
+                sql = "%s or %s like '%%%s%%'%s " % (sql, f, searchstring, esc)
+            return sql
         
         for (rep,cache) in self.primarydb.items():
-            cur = cache.cursor()
-            executeSQL(cur, sql)
+            idx = self._searchIndex(rep, cache, fields)
+            if idx is not None:
+                cur = idx.cursor()
+                executeSQL(cur, _sql('search', 'rowid'))
+            else:
+                cur = cache.cursor()
+                executeSQL(cur, _sql('packages', 'pkgKey'))
             self._sql_pkgKey2po(rep, cur, result)
         return result    
 
@@ -1113,21 +1573,27 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
         #SELECT pkgkey, SUM(cumul) AS total FROM (SELECT pkgkey, 1 
         #AS cumul FROM packages WHERE description LIKE '%foo%' UNION ... ) 
         #GROUP BY pkgkey ORDER BY total DESC;
-        selects = []
-        
-        for s in searchstrings:         
-            s = s.replace("'", "''")
-            (s, esc) = sql_esc(s)
-            sql="select pkgKey,1 AS cumul from packages where %s like '%%%s%%'%s " % (fields[0], s, esc)
-            for f in fields[1:]:
-                sql = "%s or %s like '%%%s%%'%s " % (sql, f, s, esc)
-            selects.append(sql)
-        
-        totalstring = unionstring + " UNION ALL ".join(selects) + endunionstring
+        def _sql(table, key):
+            #  The packages table, or the search index (where the pkgKey is
+            # the rowid) have the same fields.
+            selects = []
+            for s in searchstrings:         
+                s = s.replace("'", "''")
+                (s, esc) = sql_esc(s)
+                sql="select %s AS pkgKey,1 AS cumul from %s where %s like '%%%s%%'%s " % (key, table, fields[0], s, esc)
+                for f in fields[1:]:
+                    sql = "%s or %s like '%%%s%%'%s " % (sql, f, s, esc)
+                selects.append(sql)
+            return unionstring + " UNION ALL ".join(selects) + endunionstring
 
         for (rep,cache) in self.primarydb.items():
-            cur = cache.cursor()
-            executeSQL(cur, totalstring)
+            idx = self._searchIndex(rep, cache, fields)
+            if idx is not None:
+                cur = idx.cursor()
+                executeSQL(cur, _sql('search', 'rowid'))
+            else:
+                cur = cache.cursor()
+                executeSQL(cur, _sql('packages', 'pkgKey'))
             for ob in cur:
                 pkg = self._packageByKey(rep, ob['pkgKey'])
                 if pkg is None:
@@ -1219,20 +1685,183 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             setattr(self, '_memoize_' + prcotype, memoize)
         return getattr(self, '_memoize_' + prcotype)
 
+    def _prcoCacheFile(self, repo):
+        """ Return the filename of the on disk prco cache for the repo., and
+            the primary_db checksum it is for. Or (None, None) if the repo.
+            doesn't use one. """
+        if not getattr(repo, 'prco_cache', False):
+            return None, None
+        csum = self._repoDBChecksum(repo, 'primary_db')
+        if csum is None:
+            return None, None
+        return repo.cachedir + '/gen/prco-cache', csum
+
+    def _prcoCacheLoad(self, repo):
+        """ Return the on disk prco cache data for the repo., loading it the
+            first time. This is a dict of prcotype => name => [(pkgKey, val)]
+            from the primary_db, so excludes are applied after it. None if
+            the repo. doesn't use one. """
+        if repo in self._prco_disk:
+            if self._prco_disk[repo] is None:
+                return None
+            return self._prco_disk[repo][2]
+
+        self._prco_disk[repo] = None
+        fname, csum = self._prcoCacheFile(repo)
+        if fname is None:
+            return None
+
+        data = {'provides' : {}, 'requires' : {}}
+        self._prco_disk[repo] = (fname, csum, data)
+        try:
+            fo = open(fname)
+        except IOError:
+            return data
+        if fo.readline()[:-1] != csum:
+            return data
+
+        try:
+            for line in fo:
+                line = to_unicode(line[:-1], errors='strict').split('\t')
+                prcotype, name = _share_data(line[0]), _share_data(line[1])
+                if prcotype not in data or len(line) % 5 != 2:
+                    raise ValueError
+                rows = []
+                for num in xrange(2, len(line), 5):
+                    pkgKey = int(line[num])
+                    vals = [_share_data(x or None) for x in line[num+1:num+5]]
+                    val = _share_data((name, vals[0], tuple(vals[1:])))
+                    rows.append((pkgKey, val))
+                data[prcotype][name] = rows
+        except (ValueError, IndexError):
+            # Just ignore it, and write a good one out at the end.
+            data['provides'].clear()
+            data['requires'].clear()
+            self._prco_disk_dirty.add(repo)
+        return data
+
+    def _prcoCacheSave(self):
+        """ Write out the on disk prco cache for the repos. that have new
+            data in it. """
+        for repo in self._prco_disk_dirty:
+            if self._prco_disk.get(repo) is None:
+                continue
+            fname, csum, data = self._prco_disk[repo]
+            if not os.access(os.path.dirname(fname), os.W_OK):
+                continue
+            used = None
+            if sum(map(len, data.values())) > _prco_cache_max_names:
+                used = self._prco_disk_used.get(repo, set())
+
+            try:
+                fo = open(fname + '.tmp', 'w')
+                fo.write("%s\n" % csum)
+                for prcotype in sorted(data):
+                    for name in sorted(data[prcotype]):
+                        if '\t' in name or '\n' in name:
+                            continue
+                        if used is not None and (prcotype, name) not in used:
+                            continue
+                        line = [prcotype, name]
+                        for pkgKey, val in data[prcotype][name]:
+                            line.append(str(pkgKey))
+                            line.append(val[1] or '')
+                            line.extend([x or '' for x in val[2]])
+                        fo.write(to_utf8("\t".join(line)) + "\n")
+                fo.close()
+                os.rename(fname + '.tmp', fname)
+            except (IOError, OSError):
+                misc.unlink_f(fname + '.tmp')
+        self._prco_disk_dirty = set()
+
+    def _prcoRowCache(self, repo):
+        """ Return the prcotype => name => [(pkgKey, val)] dict we keep the
+            prco rows of the repo. in. That's the on disk prco cache, if the
+            repo. has one, or an in memory dict if we are attached to other
+            sacks (so they can fill it in for us). Otherwise None. """
+        disk = self._prcoCacheLoad(repo)
+        if disk is not None:
+            return disk
+        if self._attached is None:
+            return None
+        if repo not in self._prco_rows:
+            self._prco_rows[repo] = {'provides' : {}, 'requires' : {}}
+        return self._prco_rows[repo]
+
+    def _prcoRowsAdd(self, repo, prcotype, names, rows):
+        """ Store the looked up rows for the names, in the repo.'s prco row
+            cache. Names not in rows have no entries. """
+        rcache = self._prcoRowCache(repo)
+        if rcache is None:
+            return
+
+        added = False
+        for name in names:
+            if name not in rcache[prcotype]:
+                rcache[prcotype][name] = rows.get(name, [])
+                added = True
+        if self._prco_disk.get(repo) is not None:
+            self._prcoCacheUsed(repo, prcotype, names)
+            if added:
+                self._prco_disk_dirty.add(repo)
+
+    def _prcoCacheUsed(self, repo, prcotype, names):
+        """ Note that the names were used from the on disk prco cache, so we
+            keep them if it gets too big. """
+        used = self._prco_disk_used.setdefault(repo, set())
+        used.update([(prcotype, name) for name in names])
+
+    def _prcoRows(self, repo, cache, prcotype, names):
+        """ Return a dict of name => [(pkgKey, val)] for all the prcotype
+            entries with one of the names in the repo., val being the
+            (name, flags, evr) tuple. Uses the prco row cache, if the
+            repo. has one. """
+        ret = {}
+        rcache = self._prcoRowCache(repo)
+        if rcache is None:
+            todo = names
+        else:
+            todo = []
+            for name in names:
+                if name in rcache[prcotype]:
+                    ret[name] = rcache[prcotype][name]
+                else:
+                    todo.append(name)
+            if ret and self._prco_disk.get(repo) is not None:
+                self._prcoCacheUsed(repo, prcotype, ret)
+
+        if todo and self._attached is not None:
+            #  Look them up for all the attached sacks at once, which puts the
+            # answers for us in rcache.
+            self._attached.prcoRows(prcotype, todo)
+            for name in todo:
+                ret[name] = rcache[prcotype][name]
+            return ret
+
+        max_entries = constants.PATTERNS_INDEXED_MAX
+        for tnames in seq_max_split(todo, max_entries):
+            if not tnames:
+                break
+            sql = "select * from %s where name in (%s)"
+            sql = sql % (prcotype, ",".join("?" * len(tnames)))
+            cur = cache.cursor()
+            executeSQL(cur, sql, tnames)
+            for x in cur:
+                val = _prco_row_val(x)
+                ret.setdefault(val[0], []).append((x['pkgKey'], val))
+
+        if rcache is not None and todo:
+            self._prcoRowsAdd(repo, prcotype, todo, ret)
+        return ret
+
     @catchSqliteException
     def _search(self, prcotype, name, flags, version):
 
         if self._skip_all():
             return {}
         
-        name = to_unicode(name)
-        if flags == 0:
-            flags = None
-        if type(version) in (str, type(None), unicode):
-            req = (name, flags, rpmUtils.miscutils.stringToVersion(
-                version))
-        elif type(version) in (tuple, list): # would this ever be a list?
-            req = (name, flags, version)
+        req  = _search_req(name, flags, version)
+        name = req[0]
 
         prcotype = _share_data(prcotype)
         req      = _share_data(req)
@@ -1272,17 +1901,11 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             if rep in self._all_excludes:
                 continue
 
-            cur = cache.cursor()
-            executeSQL(cur, "select * from %s where name=?" % prcotype,
-                       (name,))
+            rows = self._prcoRows(rep, cache, prcotype, [name])
             tmp = { }
-            for x in cur:
-                val = (_share_data(x['name']), _share_data(x['flags']),
-                       (_share_data(x['epoch']), _share_data(x['version']),
-                        _share_data(x['release'])))
-                val = _share_data(val)
+            for pkgKey, val in rows.get(name, []):
                 if rpmUtils.miscutils.rangeCompare(req, val):
-                    tmp.setdefault(x['pkgKey'], []).append(val)
+                    tmp.setdefault(pkgKey, []).append(val)
             for pkgKey, hits in tmp.iteritems():
                 pkg = self._packageByKey(rep, pkgKey)
                 if pkg is None:
@@ -1316,6 +1939,70 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
     def getRequires(self, name, flags=None, version=(None, None, None)):
         return self._search("requires", name, flags, version)
 
+    @catchSqliteException
+    def _searchMany(self, prcotype, reqs):
+        """ Like _search() but for a list of (name, flags, version) reqs.
+            The names are looked up PATTERNS_INDEXED_MAX at a time in each
+            repo. (see _prcoRows()), instead of one query per req per repo. The results go into
+            the _search_cache, so later _search() calls are free. Returns a
+            dict of req => { packages -> list of matching prcos }. """
+
+        if self._skip_all():
+            return {}
+
+        ret = {}
+        todo = {} # name => { _search_req() => [reqs] }
+        prcotype = _share_data(prcotype)
+        for oreq in reqs:
+            (name, flags, version) = oreq
+            req = _share_data(_search_req(name, flags, version))
+            if req in self._search_cache[prcotype]:
+                ret[oreq] = self._search_cache[prcotype][req]
+            elif prcotype == 'provides' and req[0][0] == '/':
+                # Files need the filelists, so just use the normal path.
+                ret[oreq] = self._search(prcotype, name, flags, version)
+            else:
+                todo.setdefault(req[0], {}).setdefault(req, []).append(oreq)
+
+        results = {} # _search_req() => { packages -> list of matching prcos }
+        for (rep,cache) in self.primarydb.items():
+            if rep in self._all_excludes:
+                continue
+
+            rows = self._prcoRows(rep, cache, prcotype, todo.keys())
+            tmp = { }
+            for name, vals in rows.iteritems():
+                for pkgKey, val in vals:
+                    for req in todo[name]:
+                        if rpmUtils.miscutils.rangeCompare(req, val):
+                            pkgkeys = tmp.setdefault(req, {})
+                            pkgkeys.setdefault(pkgKey, []).append(val)
+            for req, pkgkeys in tmp.iteritems():
+                result = results.setdefault(req, {})
+                for pkgKey, hits in pkgkeys.iteritems():
+                    pkg = self._packageByKey(rep, pkgKey)
+                    if pkg is None:
+                        continue
+                    result[pkg] = hits
+
+        for name in todo:
+            for req in todo[name]:
+                result = results.get(req, {})
+                self._search_cache[prcotype][req] = result
+                for oreq in todo[name][req]:
+                    ret[oreq] = result
+        return ret
+
+    def getProvidesMany(self, reqs):
+        """return dict { req -> dict { packages -> list of matching provides } }
+           for a list of (name, flags, version) reqs, in a few queries."""
+        return self._searchMany("provides", reqs)
+
+    def getRequiresMany(self, reqs):
+        """return dict { req -> dict { packages -> list of matching requires } }
+           for a list of (name, flags, version) reqs, in a few queries."""
+        return self._searchMany("requires", reqs)
+
     @catchSqliteException
     def searchNames(self, names=[], return_pkgtups=False):
         """return a list of packages matching any of the given names. This is 
@@ -1349,6 +2036,14 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
                 returnList.extend(self.searchNames(names, return_pkgtups))
             return returnList
 
+        if self._attached is not None and not return_pkgtups:
+            #  Load them for all the attached sacks at once, which marks them
+            # as loaded for us.
+            self._attached.searchNames(names)
+            for pkgname in names:
+                returnList.extend(self._packagesByName(pkgname))
+            return returnList
+
         pat_sqls = []
         qsql = """select pkgId,pkgKey,name,epoch,version,release,arch
                       from packages where """
@@ -1487,22 +2182,123 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
                 'url': db['url'], 'vendor': db['rpm_vendor'], 'license': db['rpm_license'] }
         return y
 
+    @catchSqliteException
+    def _sql_newest(self, repo, cache, sql, args, group, ties=False):
+        """ Run sql, which selects pkgKey,name,epoch,version,release,arch rows
+            from the repo., grouping them by group with the yum_newest()
+            aggregate. So the EVR comparisons are done in the DB, and only the
+            newest package in each group (or all the newest ones, with ties)
+            is turned into a package object. The excludes we know about are
+            done in the SQL, the packages we get are then checked and if any
+            of them are excluded we ask again without them. """
+        if repo in self._all_excludes:
+            return []
+
+        excluded = set()
+        if self._pkgExcluder:
+            compiled = self._compilePkgExcluder(repo, force=True)
+            if compiled is not None:
+                excluded.update(compiled)
+        where = []
+        args = list(args)
+        if self._arch_allowed is not None:
+            arches = list(self._arch_allowed)
+            where.append("arch IN (%s)" % ",".join("?" * len(arches)))
+            args.extend(arches)
+
+        cur = cache.cursor()
+        while True:
+            nsql = """SELECT yum_newest(pkgKey, epoch, version, release, %d)
+                      AS pkgKeys FROM (%s)""" % (bool(ties), sql)
+            nwhere = where[:]
+            if excluded:
+                # These are all ints. from the DB.
+                nwhere.append("pkgKey NOT IN (%s)" %
+                              ",".join([str(pkgKey) for pkgKey in excluded]))
+            if nwhere:
+                nsql += " WHERE " + " AND ".join(nwhere)
+            nsql += " GROUP BY " + group
+            executeSQL(cur, nsql, args)
+            pkgKeys = []
+            for ob in cur:
+                pkgKeys.extend([int(pkgKey) for pkgKey in ob['pkgKeys'].split()])
+
+            rows = []
+            max_entries = constants.PATTERNS_INDEXED_MAX
+            for pkgKeys in seq_max_split(pkgKeys, max_entries):
+                if not pkgKeys:
+                    break
+                qsql = """SELECT pkgId,pkgKey,name,epoch,version,release,arch
+                          FROM packages WHERE pkgKey IN (%s)"""
+                qsql = qsql % ",".join("?" * len(pkgKeys))
+                executeSQL(cur, qsql, pkgKeys)
+                rows.extend(cur.fetchall())
+
+            bad = set()
+            for ob in rows:
+                if self._pkgExcludedRKD(repo, ob['pkgKey'], ob):
+                    bad.add(ob['pkgKey'])
+            if not bad:
+                break
+            excluded.update(bad)
+
+        return self._sql_pkgKey2po(repo, rows, have_data=True)
+
+    def _returnNewest(self, patterns, ignore_case, by_name):
+        """ Do returnNewestByName()/returnNewestByNameArch() for patterns via.
+            _sql_newest(). Returns None if that can't be done, and the
+            package list should be used instead. """
+        if hasattr(self, 'pkgobjlist'):
+            # Already have all the packages, so just use them.
+            return None
+
+        data = self._setupPkgObjList(None, patterns, ignore_case)
+        (need_full, spatterns, fields, names) = data
+        if names:
+            spatterns = [(pat, '=') for pat in spatterns]
+        elif patterns and not spatterns:
+            return None # Too many patterns, so they are matched in python.
+
+        query = self._sqlDataListQuery(spatterns, fields, ignore_case)
+        if query is None:
+            return []
+        qsql, pat_data = query
+        if by_name:
+            group = "name"
+        else:
+            group = "name, arch"
+
+        ret = []
+        for (repo, cache) in self.primarydb.items():
+            ret.extend(self._sql_newest(repo, cache, qsql, pat_data, group,
+                                        ties=by_name))
+        if len(self.primarydb) > 1:
+            if by_name:
+                ret = packagesNewestByName(ret)
+            else:
+                ret = packagesNewestByNameArch(ret)
+        return ret
+
     @catchSqliteException
     def returnNewestByNameArch(self, naTup=None, patterns=None, ignore_case=False):
 
         # If naTup is set do it from the database otherwise use our parent's
         # returnNewestByNameArch
         if (not naTup):
+            ret = self._returnNewest(patterns, ignore_case, by_name=False)
+            if ret is not None:
+                return ret
             return yumRepo.YumPackageSack.returnNewestByNameArch(self, naTup,
                                                                  patterns,
                                                                  ignore_case)
 
-        # First find all packages that fulfill naTup
+        # First find the newest packages that fulfill naTup, in each repo.
         allpkg = []
         for (rep,cache) in self.primarydb.items():
-            cur = cache.cursor()
-            executeSQL(cur, "select pkgId,pkgKey,name,epoch,version,release,arch from packages where name=? and arch=?", naTup)
-            self._sql_pkgKey2po(rep, cur, allpkg, have_data=True)
+            sql = """select pkgKey,name,epoch,version,release,arch
+                     from packages where name=? and arch=?"""
+            allpkg.extend(self._sql_newest(rep, cache, sql, naTup,
+                                           "name, arch", ties=True))
         
         # if we've got zilch then raise
         if not allpkg:
@@ -1522,16 +2318,20 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             return []
 
         if (not name):
+            ret = self._returnNewest(patterns, ignore_case, by_name=True)
+            if ret is not None:
+                return ret
             return yumRepo.YumPackageSack.returnNewestByName(self, name,
                                                              patterns,
                                                              ignore_case)
 
-        # First find all packages that fulfill name
+        # First find the newest packages that fulfill name, in each repo.
         allpkg = []
         for (rep,cache) in self.primarydb.items():
-            cur = cache.cursor()
-            executeSQL(cur, "select pkgId,pkgKey,name,epoch,version,release,arch from packages where name=?", (name,))
-            self._sql_pkgKey2po(rep, cur, allpkg, have_data=True)
+            sql = """select pkgKey,name,epoch,version,release,arch
+                     from packages where name=?"""
+            allpkg.extend(self._sql_newest(rep, cache, sql, (name,), "name",
+                                           ties=True))
         
         # if we've got zilch then raise
         if not allpkg:
@@ -1608,10 +2408,9 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
             patterns = tmp
         return (need_full, patterns, fields, False)
 
-    # @catchSqliteException has no effect on generators
-    def _yieldSQLDataList(self, repoid, patterns, fields, ignore_case):
-        """Yields all the package data for the given params. Excludes are done
-           at this stage. """
+    def _sqlDataListQuery(self, patterns, fields, ignore_case):
+        """ Return the (sql, args) to select the package data for the patterns
+            (from _setupPkgObjList()) or None if nothing can match. """
 
         pat_sqls = []
         pat_data = []
@@ -1626,16 +2425,30 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
                     pat_sqls.append("%s %s ?" % (field, rest))
                 pat_data.append(pattern)
         if patterns and not pat_sqls:
-            return
+            return None
 
         if pat_sqls:
             qsql = _FULL_PARSE_QUERY_BEG + " OR ".join(pat_sqls)
         else:
             qsql = """select pkgId, pkgKey, name,epoch,version,release,arch
                       from packages"""
+        return qsql, pat_data
+
+    # @catchSqliteException has no effect on generators
+    def _yieldSQLDataList(self, repoid, patterns, fields, ignore_case):
+        """Yields all the package data for the given params. Excludes are done
+           at this stage. """
+
+        query = self._sqlDataListQuery(patterns, fields, ignore_case)
+        if query is None:
+            return
+        qsql, pat_data = query
 
         for (repo,cache) in self.primarydb.items():
             if (repoid == None or repoid == repo.id):
+                if not patterns and self._pkgExcluder:
+                    # Looking at everything, so do all the excludes up front.
+                    self._compilePkgExcluder(repo, force=True)
                 cur = cache.cursor()
                 executeSQL(cur, qsql, pat_data)
                 for x in cur:
@@ -1663,6 +2476,8 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
         if not patterns and repoid is None:
             self.pkgobjlist = returnList
             self._pkgnames_loaded = set() # Save memory
+            if self._key2pkg_ticks:
+                self._key2pkgRestore(returnList)
         if not need_full and repoid is None:
             # Mark all the processed pkgnames as fully loaded
             self._pkgnames_loaded.update([po.name for po in returnList])
@@ -1820,6 +2635,151 @@ class YumSqlitePackageSack(yumRepo.YumPackageSack):
                 self._delAllPackages(rep)
                 return
 
+class _AttachedPrimaryDBs(object):
+    """ The primary DBs of a number of sacks, ATTACHed to as few sqlite
+        connections as we can, so a lookup can be done for all of them with
+        one UNION ALL query per connection. The rows are handed back to each
+        sack, which then does what it always does with them. """
+
+    def __init__(self, sacks):
+        self._members = [] # of (sack, repo), index is the attached_num
+        self._conns = []   # of (conn, [attached_num])
+
+        conn = None
+        for sack in sacks:
+            #  All or nothing per sack, as they trust us to have looked up
+            # everything for them.
+            fnames = []
+            for (repo, cache) in sack.primarydb.items():
+                fname = _db_filename(cache)
+                if fname is None:
+                    break
+                fnames.append((repo, fname))
+            else:
+                if not fnames:
+                    continue
+                conn = self._attach(conn, sack, fnames)
+                if conn is None: # Failed, just don't attach anything else.
+                    break
+
+    def _new_conn(self):
+        conn = sqlutils.sqlite.connect(':memory:')
+        conn.row_factory = sqlutils.sqlite.Row
+        executeSQL(conn.cursor(), "CREATE TABLE attached_names (name TEXT)")
+        self._conns.append((conn, []))
+        return conn
+
+    def _attach(self, conn, sack, fnames):
+        """ Attach the sack's DBs to conn, or to new connections if it's
+            full. Returns the connection to use next, or None on failure. """
+        nums = []
+        for repo, fname in fnames:
+            while True:
+                if conn is None:
+                    conn = self._new_conn()
+                conn_nums = self._conns[-1][1]
+                try:
+                    sql = "ATTACH DATABASE ? AS r%d" % len(conn_nums)
+                    executeSQL(conn.cursor(), sql, (fname,))
+                except sqlutils.sqlite.Error:
+                    if not conn_nums: # Can't attach anything.
+                        self._detach(nums)
+                        return None
+                    # Probably hit SQLITE_MAX_ATTACHED, use a new connection.
+                    conn = None
+                    continue
+                conn_nums.append(len(self._members))
+                nums.append(len(self._members))
+                self._members.append((sack, repo))
+                break
+        sack._attached = self
+        return conn
+
+    def _detach(self, nums):
+        """ Forget about the attached_nums, which are all at the end. """
+        for (conn, conn_nums) in self._conns:
+            while conn_nums and conn_nums[-1] in nums:
+                conn_nums.pop()
+                executeSQL(conn.cursor(), "DETACH DATABASE r%d" % len(conn_nums))
+        for num in nums:
+            self._members.pop()
+
+    def close(self):
+        for (sack, repo) in self._members:
+            sack._attached = None
+        for (conn, conn_nums) in self._conns:
+            conn.close()
+        self._members = []
+        self._conns = []
+
+    @catchSqliteException
+    def _query(self, sql, names):
+        """ Run the sql, which has %(num)d for the attached_num and %(db)s
+            for the DB and can use the attached_names table, on all the
+            attached DBs. Returns a list of (attached_num, row). """
+        ret = []
+        for (conn, conn_nums) in self._conns:
+            cur = conn.cursor()
+            executeSQL(cur, "DELETE FROM attached_names")
+            cur.executemany("INSERT INTO attached_names VALUES (?)",
+                            ((name,) for name in names))
+            sqls = []
+            for db_num, num in enumerate(conn_nums):
+                sqls.append(sql % {'num' : num, 'db' : 'r%d' % db_num})
+            executeSQL(cur, " UNION ALL ".join(sqls))
+            for ob in cur:
+                ret.append((ob['attached_num'], ob))
+        return ret
+
+    def prcoRows(self, prcotype, names):
+        """ Lookup the prcotype rows for the names, in all the attached DBs,
+            and give them to the sacks for their prco row caches. """
+        sql = """SELECT %%(num)d AS attached_num,
+                        pkgKey, name, flags, epoch, version, release
+                 FROM %%(db)s.%s
+                 WHERE name IN (SELECT name FROM attached_names)"""
+        sql = sql % prcotype
+
+        rows = {} # attached_num => name => [(pkgKey, val)]
+        for num, x in self._query(sql, names):
+            val = _prco_row_val(x)
+            rows.setdefault(num, {}).setdefault(val[0], []).append((x['pkgKey'],
+                                                                    val))
+        for num, (sack, repo) in enumerate(self._members):
+            sack._prcoRowsAdd(repo, prcotype, names, rows.get(num, {}))
+
+    def searchNames(self, names):
+        """ Load the packages with the names, in all the attached DBs, into
+            their sacks and mark those names as loaded. """
+        sql = """SELECT %(num)d AS attached_num,
+                        pkgId, pkgKey, name, epoch, version, release, arch
+                 FROM %(db)s.packages
+                 WHERE name IN (SELECT name FROM attached_names)"""
+
+        rows = {} # attached_num => [row]
+        for num, ob in self._query(sql, names):
+            rows.setdefault(num, []).append(ob)
+
+        sacks = []
+        for num, (sack, repo) in enumerate(self._members):
+            if sack._skip_all() or hasattr(sack, 'pkgobjlist'):
+                continue
+            sack._sql_pkgKey2po(repo, rows.get(num, []), have_data=True)
+            if not sacks or sacks[-1] is not sack:
+                sacks.append(sack)
+        for sack in sacks:
+            sack._pkgnames_loaded.update(names)
+
+def attachPrimaryDBs(sacks):
+    """ ATTACH the primary DBs of all the sqlite sacks to shared connections,
+        so provides/requires and name lookups are done for all of them with a
+        single query. Any previous attaching of the sacks is undone. """
+    sacks = [sack for sack in sacks if isinstance(sack, YumSqlitePackageSack)]
+    for sack in sacks:
+        if sack._attached is not None:
+            sack._attached.close()
+    return _AttachedPrimaryDBs(sacks)
+
 # Simple helper functions
 
 # Return a string representing filenamelist (filenames can not contain /)
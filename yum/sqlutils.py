@@ -24,6 +24,8 @@ try:
 except ImportError:
     import sqlite
 
+from constants import SQLITE_RO_CACHE_KB, SQLITE_RO_MMAP_SIZE
+
 class TokenizeError(Exception):
     """Tokenizer error class"""
     pass
@@ -197,3 +199,21 @@ def sql_esc_glob(patterns):
         pattern = pattern.replace("?", "_")
         ret.append((pattern, esc))
     return ret
+
+def sql_read_only(db, cache_kb=SQLITE_RO_CACHE_KB,
+                  mmap_size=SQLITE_RO_MMAP_SIZE):
+    """ Setup a sqlite connection for reading a DB that won't change, like the
+        repo. metadata DBs once their checksum has been checked. The DB is
+        mmap'd, we use a bigger page cache, temp. tables/indexes are kept in
+        memory and writes fail. Older sqlite versions just ignore the PRAGMAs
+        they don't know. """
+    cur = db.cursor()
+    try:
+        executeSQL(cur, "PRAGMA query_only = ON")
+        executeSQL(cur, "PRAGMA temp_store = MEMORY")
+        executeSQL(cur, "PRAGMA cache_size = -%d" % cache_kb)
+        if mmap_size:
+            executeSQL(cur, "PRAGMA mmap_size = %d" % mmap_size)
+    except sqlite.Error:
+        pass # It's just a speedup, so don't care if it fails.
+    return db
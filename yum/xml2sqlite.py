@@ -0,0 +1,320 @@
+#!/usr/bin/python -tt
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""
+Convert the primary, filelists and other XML metadata into the same sqlite
+DBs that yum-metadata-parser (sqlitecachec) makes, for repos. without the
+*_db metadata (xml2sqlite=python).
+
+The XML is read with iterparse, and each <package> is turned straight into
+rows and cleared (along with the root's reference to it), so memory use
+doesn't depend on the size of the file. The rows are inserted with
+executemany() every _batch_size packages, all in one transaction, and the
+indexes are made at the end. The DB is written via. a .tmp file.
+"""
+
+import os
+
+from mdparser import iterparse
+import misc
+from Errors import MiscError
+from sqlutils import sqlite, executeSQL
+from constants import DBVERSION
+
+# Packages worth of rows we keep before inserting them.
+_batch_size = 1000
+
+_common_ns = '{http://linux.duke.edu/metadata/common}'
+_rpm_ns = '{http://linux.duke.edu/metadata/rpm}'
+_filelists_ns = '{http://linux.duke.edu/metadata/filelists}'
+_other_ns = '{http://linux.duke.edu/metadata/other}'
+_xml_base = '{http://www.w3.org/XML/1998/namespace}base'
+
+_prco_types = ('provides', 'requires', 'conflicts', 'obsoletes',
+               'suggests', 'enhances', 'recommends', 'supplements')
+
+_filetypes = {'file' : 'f', 'dir' : 'd', 'ghost' : 'g'}
+
+_schema = {
+    'primary' : ["""CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY,
+                        pkgId TEXT, name TEXT, arch TEXT, version TEXT,
+                        epoch TEXT, release TEXT, summary TEXT,
+                        description TEXT, url TEXT, time_file INTEGER,
+                        time_build INTEGER, rpm_license TEXT,
+                        rpm_vendor TEXT, rpm_group TEXT, rpm_buildhost TEXT,
+                        rpm_sourcerpm TEXT, rpm_header_start INTEGER,
+                        rpm_header_end INTEGER, rpm_packager TEXT,
+                        size_package INTEGER, size_installed INTEGER,
+                        size_archive INTEGER, location_href TEXT,
+                        location_base TEXT, checksum_type TEXT)""",
+                 """CREATE TABLE files (name TEXT, type TEXT,
+                        pkgKey INTEGER)"""] +
+                ["""CREATE TABLE %s (name TEXT, flags TEXT, epoch TEXT,
+                        version TEXT, release TEXT, pkgKey INTEGER %s)""" %
+                 (prcotype, prcotype == 'requires' and
+                  ', pre BOOLEAN DEFAULT FALSE' or '')
+                 for prcotype in _prco_types],
+    'filelists' : ["""CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY,
+                          pkgId TEXT)""",
+                   """CREATE TABLE filelist (pkgKey INTEGER, dirname TEXT,
+                          filenames TEXT, filetypes TEXT)"""],
+    'other' : ["""CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY,
+                      pkgId TEXT)""",
+               """CREATE TABLE changelog (pkgKey INTEGER, author TEXT,
+                      date INTEGER, changelog TEXT)"""],
+    }
+
+_indexes = {
+    'primary' : ["CREATE INDEX packagename ON packages (name)",
+                 "CREATE INDEX packageId ON packages (pkgId)",
+                 "CREATE INDEX filenames ON files (name)",
+                 "CREATE INDEX pkgfiles ON files (pkgKey)"] +
+                ["CREATE INDEX pkg%s ON %s (pkgKey)" % (prcotype, prcotype)
+                 for prcotype in _prco_types] +
+                ["CREATE INDEX %sname ON %s (name)" % (prcotype, prcotype)
+                 for prcotype in _prco_types] +
+                ["""CREATE TRIGGER removals AFTER DELETE ON packages
+                    BEGIN
+                     DELETE FROM files WHERE pkgKey = old.pkgKey;
+                     %s
+                    END""" %
+                 "\n".join(["DELETE FROM %s WHERE pkgKey = old.pkgKey;" % x
+                            for x in _prco_types])],
+    'filelists' : ["CREATE INDEX keyfile ON filelist (pkgKey)",
+                   "CREATE INDEX pkgId ON packages (pkgId)",
+                   "CREATE INDEX dirnames ON filelist (dirname)",
+                   """CREATE TRIGGER remove_filelist AFTER DELETE ON packages
+                      BEGIN
+                       DELETE FROM filelist WHERE pkgKey = old.pkgKey;
+                      END"""],
+    'other' : ["CREATE INDEX keychange ON changelog (pkgKey)",
+               "CREATE INDEX pkgId ON packages (pkgId)",
+               """CREATE TRIGGER remove_changelogs AFTER DELETE ON packages
+                  BEGIN
+                   DELETE FROM changelog WHERE pkgKey = old.pkgKey;
+                  END"""],
+    }
+
+_roots = {_common_ns + 'metadata' : 'primary',
+          _filelists_ns + 'filelists' : 'filelists',
+          _other_ns + 'otherdata' : 'other'}
+
+
+class _Rows:
+    """ The rows for each table, waiting to be inserted. """
+
+    def __init__(self, cur):
+        self.cur = cur
+        self.rows = {}
+        self.sql = {}
+        executeSQL(cur, "SELECT name FROM sqlite_master WHERE type = 'table'")
+        for (table,) in cur.fetchall():
+            executeSQL(cur, "PRAGMA table_info(%s)" % table)
+            cols = len(cur.fetchall())
+            self.rows[table] = []
+            self.sql[table] = "INSERT INTO %s VALUES (%s)" % (
+                table, ", ".join(["?"] * cols))
+
+    def flush(self):
+        for table in self.rows:
+            if self.rows[table]:
+                self.cur.executemany(self.sql[table], self.rows[table])
+                self.rows[table] = []
+
+
+def _primary(rows, pkgKey, elem):
+    """ Add the rows for the primary <package> elem. """
+    p = {}
+    for child in elem:
+        tag = child.tag
+        if tag == _common_ns + 'format':
+            _primary_format(rows, pkgKey, child, p)
+        elif tag == _common_ns + 'version':
+            p['epoch'] = child.get('epoch')
+            p['version'] = child.get('ver')
+            p['release'] = child.get('rel')
+        elif tag == _common_ns + 'checksum':
+            p['checksum_type'] = child.get('type')
+            p['pkgId'] = child.text
+        elif tag == _common_ns + 'time':
+            p['time_file'] = child.get('file')
+            p['time_build'] = child.get('build')
+        elif tag == _common_ns + 'size':
+            p['size_package'] = child.get('package')
+            p['size_installed'] = child.get('installed')
+            p['size_archive'] = child.get('archive')
+        elif tag == _common_ns + 'location':
+            p['location_href'] = child.get('href')
+            p['location_base'] = child.get(_xml_base)
+        elif tag == _common_ns + 'packager':
+            p['rpm_packager'] = child.text
+        else:
+            p[tag[len(_common_ns):]] = child.text
+
+    g = p.get
+    rows.rows['packages'].append((pkgKey, g('pkgId'), g('name'), g('arch'),
+                                  g('version'), g('epoch'), g('release'),
+                                  g('summary'), g('description'), g('url'),
+                                  g('time_file'), g('time_build'),
+                                  g('rpm_license'), g('rpm_vendor'),
+                                  g('rpm_group'), g('rpm_buildhost'),
+                                  g('rpm_sourcerpm'), g('rpm_header_start'),
+                                  g('rpm_header_end'), g('rpm_packager'),
+                                  g('size_package'), g('size_installed'),
+                                  g('size_archive'), g('location_href'),
+                                  g('location_base'), g('checksum_type')))
+
+def _primary_format(rows, pkgKey, elem, p):
+    files = rows.rows['files']
+    for child in elem:
+        tag = child.tag
+        if tag == _common_ns + 'file':
+            files.append((child.text, child.get('type', 'file'), pkgKey))
+            continue
+        name = tag[len(_rpm_ns):]
+        if name in _prco_types:
+            prco = rows.rows[name]
+            for entry in child:
+                get = entry.get
+                row = (get('name'), get('flags'), get('epoch'), get('ver'),
+                       get('rel'), pkgKey)
+                if name == 'requires':
+                    row += (get('pre') in ('1', 'true') and 'TRUE' or 'FALSE',)
+                prco.append(row)
+        elif name == 'header-range':
+            p['rpm_header_start'] = child.get('start')
+            p['rpm_header_end'] = child.get('end')
+        else:
+            p['rpm_' + name] = child.text
+
+def _filelists(rows, pkgKey, elem):
+    """ Add the rows for the filelists <package> elem, one for each dir. """
+    rows.rows['packages'].append((pkgKey, elem.get('pkgid')))
+    dirs = {}
+    order = []
+    for child in elem:
+        if child.tag != _filelists_ns + 'file' or not child.text:
+            continue
+        (dirname, filename) = os.path.split(child.text)
+        if not dirname:
+            dirname = '.'
+        if dirname not in dirs:
+            dirs[dirname] = ([], [])
+            order.append(dirname)
+        dirs[dirname][0].append(filename)
+        dirs[dirname][1].append(_filetypes.get(child.get('type'), 'f'))
+    for dirname in order:
+        (filenames, filetypes) = dirs[dirname]
+        rows.rows['filelist'].append((pkgKey, dirname, '/'.join(filenames),
+                                      ''.join(filetypes)))
+
+def _other(rows, pkgKey, elem):
+    """ Add the rows for the other <package> elem. """
+    rows.rows['packages'].append((pkgKey, elem.get('pkgid')))
+    changelog = rows.rows['changelog']
+    for child in elem:
+        if child.tag != _other_ns + 'changelog':
+            continue
+        changelog.append((pkgKey, child.get('author'), child.get('date'),
+                          child.text))
+
+_handlers = {'primary' : _primary, 'filelists' : _filelists, 'other' : _other}
+
+
+def _current(dbfile, checksum):
+    """ Is dbfile already the DB for the XML with checksum. """
+    if not os.path.exists(dbfile):
+        return False
+    try:
+        conn = sqlite.connect(dbfile)
+        try:
+            cur = conn.cursor()
+            executeSQL(cur, "SELECT dbversion, checksum FROM db_info")
+            for (dbversion, csum) in cur:
+                return str(dbversion) == DBVERSION and csum == checksum
+        finally:
+            conn.close()
+    except sqlite.Error:
+        pass
+    return False
+
+def _convert(xmlfile, dbfile, callback, repoid):
+    fo = open(xmlfile)
+    try:
+        parser = iterparse(fo, events=('start', 'end'))
+        (event, root) = parser.next()
+        if root.tag not in _roots:
+            raise MiscError('Unknown repodata type "%s" in %s' % (root.tag,
+                                                                  xmlfile))
+        mdtype = _roots[root.tag]
+        handler = _handlers[mdtype]
+        total = int(root.get('packages', 0))
+
+        conn = sqlite.connect(dbfile)
+        cur = conn.cursor()
+        executeSQL(cur, "PRAGMA synchronous = OFF")
+        executeSQL(cur, "PRAGMA journal_mode = OFF")
+        executeSQL(cur, "CREATE TABLE db_info (dbversion INTEGER, checksum TEXT)")
+        for sql in _schema[mdtype]:
+            executeSQL(cur, sql)
+        rows = _Rows(cur)
+
+        pkgKey = 0
+        for (event, elem) in parser:
+            if event != 'end' or elem.tag[-8:] != '}package':
+                continue
+            pkgKey += 1
+            handler(rows, pkgKey, elem)
+            elem.clear()
+            root.clear()
+            if not pkgKey % _batch_size:
+                rows.flush()
+                if callback is not None:
+                    callback.progressbar(pkgKey, total, repoid)
+        rows.flush()
+        if callback is not None:
+            callback.progressbar(pkgKey, total, repoid)
+
+        for sql in _indexes[mdtype]:
+            executeSQL(cur, sql)
+        return conn
+    finally:
+        fo.close()
+
+def xml2sqlite(xmlfile, dbfile, checksum, callback=None, repoid=None):
+    """ Convert the (uncompressed) primary, filelists or other XML metadata
+        in xmlfile into the sqlite DB dbfile, unless it's already the DB for
+        the checksum of the XML. callback.progressbar(num, total, repoid) is
+        called as packages are done. Returns dbfile, raises MiscError if
+        anything goes wrong. """
+    if _current(dbfile, checksum):
+        return dbfile
+
+    tmpname = '%s.%d.tmp' % (dbfile, os.getpid())
+    misc.unlink_f(tmpname)
+    try:
+        conn = _convert(xmlfile, tmpname, callback, repoid)
+        executeSQL(conn.cursor(), "INSERT INTO db_info VALUES (?, ?)",
+                   (int(DBVERSION), checksum))
+        conn.commit()
+        conn.close()
+        os.rename(tmpname, dbfile)
+    except (SyntaxError, EnvironmentError, sqlite.Error), e:
+        misc.unlink_f(tmpname)
+        raise MiscError('Error converting %s: %s' % (xmlfile, e))
+    except:
+        misc.unlink_f(tmpname)
+        raise
+    return dbfile
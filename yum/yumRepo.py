@@ -28,12 +28,18 @@ from urlgrabber.grabber import default_grabber
 from urlgrabber.progress import format_number
 import urlgrabber.mirror
 from urlgrabber.grabber import URLGrabError
+from urlgrabber.grabber import CallbackObject
 import repoMDObject
 import packageSack
 from repos import Repository
 import parser
 import sqlitecachec
 import sqlitesack
+import sqlutils
+import mddelta
+import xml2sqlite
+import mirrorstats
+import httpvalidators
 from yum import config
 from yum import misc
 from yum import comps
@@ -50,6 +56,7 @@ import glob
 import shutil
 import stat
 import errno
+import fcntl
 import tempfile
 
 # This is unused now, probably nothing uses it but it was global/public.
@@ -100,12 +107,365 @@ def _xattr_set_chksum(filename, chktype, chksum):
 
     return True
 
+#  Parsing the repomd.xml (and metalink.xml) for every repo. on every run is a
+# noticeable part of startup for things like "yum -C list installed", so we
+# keep the parsed data for all the repos. in one file in the base cachedir.
+# Each entry is keyed on the mtime/size/inode of the file it came from, so any
+# change to that file (new download, revert, "yum clean") means we parse it
+# again. New entries are appended (the last one for a file wins), and the file
+# is rewritten without the old ones when they are most of it.
+
+_repomd_manifest_hdr = 'yum-repomd-manifest 1'
+_repomd_manifest_types = ('repomd.xml', 'metalink.xml')
+_repomd_manifests = {} # manifest filename => {file => (key, lines)}
+_repomd_manifest_entries = {} # manifest filename => entries in the file
+
+def _repomd_manifest_key(filename):
+    st = misc.stat_f(filename)
+    if st is None:
+        return None
+    return "%.6f:%d:%d" % (st.st_mtime, st.st_size, st.st_ino)
+
+def _repomd_manifest_load(filename):
+    """ Load the manifest file, only once per. process. """
+    if filename in _repomd_manifests:
+        return _repomd_manifests[filename]
+
+    ret = {}
+    _repomd_manifests[filename] = ret
+    _repomd_manifest_entries[filename] = None # Needs rewriting
+    try:
+        lines = open(filename).read().split('\n')
+    except EnvironmentError:
+        return ret
+    if lines[0] != _repomd_manifest_hdr:
+        return ret
+
+    #  Each entry is a "repomd.xml" (or "metalink.xml") line, the data and a
+    # "." line. So if we get interrupted appending, the partial entry is
+    # ignored.
+    entries = 0
+    entry = None
+    for line in lines[1:]:
+        vals = line.split('\t')
+        if vals[0] in _repomd_manifest_types:
+            entry = None
+            if len(vals) == 3 and os.path.basename(vals[1]) == vals[0]:
+                entry = (vals[1], vals[2], [])
+        elif line == '.' and entry is not None:
+            ret[entry[0]] = (entry[1], entry[2])
+            entries += 1
+            entry = None
+        elif line and entry is not None:
+            entry[2].append(line)
+    _repomd_manifest_entries[filename] = entries
+    return ret
+
+def _repomd_manifest_entry(local, key, data):
+    hdr = '%s\t%s\t%s' % (os.path.basename(local), local, key)
+    return '\n'.join([hdr] + data + ['.', ''])
+
+def _repomd_manifest_add(filename, local, key, data):
+    """ Add the data for the repomd.xml (or metalink.xml) file local to the
+        manifest, returns False if it couldn't be written. """
+    if os.path.basename(local) not in _repomd_manifest_types:
+        return False
+    if '\t' in local or '\n' in local:
+        return False
+    manifest = _repomd_manifest_load(filename)
+    manifest[local] = (key, data)
+
+    entries = _repomd_manifest_entries[filename]
+    if entries is not None and entries < (len(manifest) * 2) + 8:
+        #  Other yum processes (Eg. "yum -C" as a user) can be appending at
+        # the same time, so lock it. If it was rewritten while we waited for
+        # the lock, we'd be appending to the old file.
+        try:
+            fo = open(filename, 'a')
+            try:
+                fcntl.flock(fo.fileno(), fcntl.LOCK_EX)
+                st = misc.stat_f(filename)
+                if st is None or st.st_ino != os.fstat(fo.fileno()).st_ino:
+                    return False
+                fo.write(_repomd_manifest_entry(local, key, data))
+            finally:
+                fo.close()
+        except EnvironmentError:
+            return False
+        _repomd_manifest_entries[filename] += 1
+        return True
+
+    # Rewrite it, dropping entries for files which have gone.
+    msg = [_repomd_manifest_hdr + '\n']
+    for fname in sorted(manifest):
+        (key, data) = manifest[fname]
+        if _repomd_manifest_key(fname) != key:
+            del manifest[fname]
+            continue
+        msg.append(_repomd_manifest_entry(fname, key, data))
+
+    try:
+        (fd, tmpname) = tempfile.mkstemp(prefix='repomd.manifest.',
+                                         dir=os.path.dirname(filename))
+    except EnvironmentError:
+        return False
+    try:
+        os.write(fd, ''.join(msg))
+        os.close(fd)
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, filename)
+    except EnvironmentError:
+        misc.unlink_f(tmpname)
+        return False
+    _repomd_manifest_entries[filename] = len(manifest)
+    return True
+
+
+#  The small files that say which metadata we have, and where we got it from.
+# When staging new metadata these are copied, and they are moved back in this
+# order (so the cookie, saying it's all current, goes last).
+_staged_state_files = ('mirrorlist.txt', 'mirrorstats.txt', 'validators.txt',
+                       'metalink.xml', 'repomd.xml.asc', 'repomd.xml')
 
 warnings.simplefilter("ignore", Errors.YumFutureDeprecationWarning)
 
 logger = logging.getLogger("yum.Repos")
 verbose_logger = logging.getLogger("yum.verbose.Repos")
 
+class _ChecksumMeter:
+    """ A progress meter, wrapping the real one (if any), that checksums the
+        file being downloaded as it grows. urlgrabber doesn't give us the
+        data it writes, but reading what was appended since the last progress
+        update gets it from the page cache while we're waiting on the network
+        anyway, so verifyLocalPkg() only needs to read the last bit of the
+        file. """
+
+    def __init__(self, meter, filename, sumtype):
+        self.meter = meter
+        self.filename = filename
+        self.sumtype = sumtype
+        self._fd = None
+        self._csum = None
+        self.start_time = None
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+        self._csum = None
+
+    def _read(self):
+        """ Checksum whatever has been written since last time. """
+        if self._csum is None:
+            return
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.filename, os.O_RDONLY)
+            while True:
+                data = os.read(self._fd, 2**16)
+                if not data:
+                    break
+                self._csum.update(data)
+        except (IOError, OSError):
+            self.close()
+
+    def start(self, *args, **kwargs):
+        #  A new attempt (another mirror, or a reget) rewrites the file from
+        # the start, or appends to it, so just start again from the top.
+        self.close()
+        self.start_time = kwargs.get('now') or time.time()
+        try:
+            self._csum = misc.Checksums([self.sumtype])
+        except Errors.MiscError:
+            self._csum = None
+        if self.meter is not None:
+            self.meter.start(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        self._read()
+        if self.meter is not None:
+            self.meter.update(*args, **kwargs)
+
+    def end(self, *args, **kwargs):
+        if self.meter is not None:
+            self.meter.end(*args, **kwargs)
+
+    def failure(self, *args, **kwargs):
+        if self.meter is not None:
+            self.meter.failure(*args, **kwargs)
+
+    def checksum(self, sumtype, nst):
+        """ Return the checksum of the downloaded file, as long as it's
+            still the file (stat result nst) we read all of, else None. """
+        if sumtype != self.sumtype:
+            return None
+        self._read()
+        if self._fd is None:
+            return None
+        ost = os.fstat(self._fd)
+        if (ost.st_ino != nst.st_ino or ost.st_dev != nst.st_dev or
+            self._csum.length != nst.st_size):
+            return None
+        return self._csum.hexdigest(sumtype)
+
+class _ChecksumMultiMeter(object):
+    """ Stands in for the multi file meter (if any) of one async download.
+        parallel_wait() only gives the progress of async downloads to the
+        meters it gets from newMeter(), so this hands out the _ChecksumMeter
+        (wrapping the real meter's one). It hashes and compares the same as
+        the real meter, so parallel_wait() still starts and ends that once,
+        with the totals of all the downloads. """
+
+    class _Totals:
+        total = 0
+
+    def __init__(self, meter, checksum_meter):
+        self.meter = meter
+        self.checksum_meter = checksum_meter
+
+    def __hash__(self):
+        return hash(self.meter)
+
+    def __eq__(self, other):
+        if isinstance(other, _ChecksumMultiMeter):
+            other = other.meter
+        return self.meter is other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def _get_re(self):
+        if self.meter is None:
+            return self._Totals()
+        return self.meter.re
+    re = property(fget=_get_re)
+
+    def start(self, *args, **kwargs):
+        if self.meter is not None:
+            self.meter.start(*args, **kwargs)
+
+    def end(self, *args, **kwargs):
+        if self.meter is not None:
+            self.meter.end(*args, **kwargs)
+
+    def newMeter(self):
+        self.checksum_meter.meter = None
+        if self.meter is not None:
+            self.checksum_meter.meter = self.meter.newMeter()
+        return self.checksum_meter
+
+    def removeMeter(self, meter):
+        if self.meter is not None:
+            self.meter.removeMeter(self.checksum_meter.meter)
+
+class _SegmentedDownload:
+    """ Download a big package as byte range segments, queued together so
+        parallel_wait() spreads them over the mirrors (honoring their
+        max_connections). The first segment goes straight to the package
+        file, the rest are appended to it when they've all finished, and
+        then the real checkfunc is run on the whole file. If any of that
+        fails, the package is downloaded again the normal way. """
+
+    def __init__(self, repo, package, ranges, checkfunc, text, cache, kwargs):
+        self.repo = repo
+        self.package = package
+        self.ranges = ranges
+        self.checkfunc = checkfunc
+        self.text = text
+        self.cache = cache
+        self.kwargs = kwargs
+        self.local = package.localPkg()
+        self.files = [self.local]
+        for num in range(1, len(ranges)):
+            self.files.append('%s.%d.seg' % (self.local, num))
+        self.running = 0
+        self.failed = None
+
+    def start(self):
+        kwargs = dict(self.kwargs)
+        kwargs['failfunc'] = self._failfunc
+        for num, (start, end) in enumerate(self.ranges):
+            checkfunc = (self._checkfunc, (end - start,), {})
+            text = '%s [%d/%d]' % (self.text, num + 1, len(self.ranges))
+            try:
+                self.repo._getFile(url=self.package.basepath,
+                                   relative=self.package.relativepath,
+                                   local=self.files[num], start=start,
+                                   end=end, reget=None, checkfunc=checkfunc,
+                                   text=text, cache=self.cache,
+                                   size=end - start, **kwargs)
+            except Errors.RepoError, e:
+                if not self.running:
+                    raise
+                # The queued segments finishing falls back to a whole one.
+                self.failed = e
+                break
+            self.running += 1
+        return self.local
+
+    def _cleanup(self):
+        for fname in self.files[1:]:
+            misc.unlink_f(fname)
+
+    def _checkfunc(self, obj, size):
+        try:
+            if os.path.getsize(obj.filename) != size:
+                raise URLGrabError(-1, _('Segment is the wrong size.'))
+        except OSError, e:
+            raise URLGrabError(-1, str(e))
+        self._done()
+
+    def _failfunc(self, obj):
+        if self.failed is None:
+            self.failed = obj.exception
+        self._done()
+
+    def _done(self):
+        self.running -= 1
+        if self.running:
+            return
+        if self.failed is not None:
+            self._cleanup()
+            return self._fallback(self.failed)
+
+        try:
+            fo = open(self.local, 'ab')
+            for fname in self.files[1:]:
+                seg = open(fname, 'rb')
+                shutil.copyfileobj(seg, fo, 2**20)
+                seg.close()
+                misc.unlink_f(fname)
+            fo.close()
+        except (IOError, OSError), e:
+            self._cleanup()
+            return self._fallback(e)
+
+        obj = CallbackObject(filename=self.local,
+                             url=self.package.remote_url,
+                             size=self.package.size)
+        try:
+            if self.checkfunc is not None:
+                urlgrabber.grabber._run_callback(self.checkfunc, obj)
+        except URLGrabError, e:
+            return self._fallback(e)
+
+    def _fallback(self, e):
+        verbose_logger.log(logginglevels.DEBUG_2,
+                           "Segmented download of %s failed, downloading it"
+                           " whole: %s", self.package, e)
+        misc.unlink_f(self.local)
+        self.package._no_segments = True
+        try:
+            self.repo.getPackage(self.package, checkfunc=self.checkfunc,
+                                 text=self.text, cache=self.cache,
+                                 **self.kwargs)
+        except Errors.RepoError, e:
+            obj = CallbackObject(url=self.package.remote_url, exception=e)
+            failfunc = self.kwargs.get('failfunc')
+            if failfunc is None:
+                raise obj.exception
+            urlgrabber.grabber._run_callback(failfunc, obj)
+
 class YumPackageSack(packageSack.PackageSack):
     """imports/handles package objects from an mdcache dict object"""
     def __init__(self, packageClass):
@@ -187,6 +547,37 @@ class YumPackageSack(packageSack.PackageSack):
                     # NOTE: No failfunc.
                     repo._retrieveMD(mydbtype, async=True, failfunc=None)
 
+    def _decompress_list(self, repo, data):
+        """ Return the (filename, generated_name, cached) of the compressed DB
+            files that populate() will need to decompress, so they can be done
+            in parallel first. """
+        ret = []
+        for item in data:
+            if item in self.added.get(repo, []):
+                continue
+            if item == 'metadata':
+                mydbtype = 'primary_db'
+            elif item == 'filelists':
+                mydbtype = 'filelists_db'
+            elif item == 'otherdata':
+                mydbtype = 'other_db'
+            else:
+                continue
+
+            if not self._check_db_version(repo, mydbtype):
+                continue
+            mydbdata = repo.repoXML.getData(mydbtype)
+            (r_base, remote) = mydbdata.location
+            compressed_fn = repo.cachedir + '/' + os.path.basename(remote)
+            if not os.path.exists(compressed_fn):
+                continue
+            db_un_fn = misc.decompress(compressed_fn, fn_only=True)
+            # Not compressed, or the old uncompressed version is there.
+            if db_un_fn == compressed_fn or os.path.exists(db_un_fn):
+                continue
+            ret.append((compressed_fn, mydbtype + '.sqlite', repo.cache))
+        return ret
+
     def populate(self, repo, mdtype='metadata', callback=None, cacheonly=0):
         if mdtype == 'all':
             data = ['metadata', 'filelists', 'otherdata']
@@ -235,10 +626,12 @@ class YumPackageSack(packageSack.PackageSack):
                     db_un_fn = self._check_uncompressed_db_gen(repo, mydbtype)
 
                 if not db_un_fn:
-                    db_fn = repo._retrieveMD(mydbtype)
+                    # unlink the decompressed file, we know it's not valid
+                    misc.unlink_f(repo.cachedir +'/gen/%s.sqlite' % mydbtype)
+                    # ...and decompress the new one as we check the download.
+                    db_fn = repo._retrieveMD(mydbtype,
+                                             gen_name=mydbtype + '.sqlite')
                     if db_fn:
-                        # unlink the decompressed file, we know it's not valid
-                        misc.unlink_f(repo.cachedir +'/gen/%s.sqlite' % mydbtype)
                         db_un_fn = self._check_uncompressed_db_gen(repo,
                                                                    mydbtype)
                     if not db_un_fn: # Shouldn't happen?
@@ -263,7 +656,19 @@ class YumPackageSack(packageSack.PackageSack):
                 # Convert XML => .sqlite
                 xmldata = repo.repoXML.getData(mymdtype)
                 (ctype, csum) = xmldata.checksum
-                dobj = repo_cache_function(xml, csum)
+                if getattr(repo, 'xml2sqlite', None) == 'python':
+                    try:
+                        db_fn = xml2sqlite.xml2sqlite(xml, xml + '.sqlite',
+                                                      csum, callback, repo.id)
+                    except Errors.MiscError, e:
+                        raise Errors.RepoError('%s: %s' % (repo, e), repo=repo)
+                    dobj = repo.cacheHandler.open_database(db_fn)
+                else:
+                    dobj = repo_cache_function(xml, csum)
+
+            if getattr(repo, 'sqlite_read_only', False):
+                # Nothing writes to the metadata DBs after this point.
+                sqlutils.sql_read_only(dobj)
 
             if not cacheonly:
                 self.addDict(repo, item, dobj, callback)
@@ -282,12 +687,14 @@ class YumPackageSack(packageSack.PackageSack):
         compressed_fn    = repo.cachedir + '/' + fname
         db_un_fn         = mdtype + '.sqlite'
 
-        if not repo._checkMD(compressed_fn, mdtype, data=mydbdata,
-                             check_can_fail=True):
-            return None
+        # Updated from the previous version with a delta, so no compressed
+        # version to check against.
+        ret = repo._deltaMDValid(mydbdata, mdtype)
+        if ret:
+            return ret
 
-        ret = misc.repo_gen_decompress(compressed_fn, db_un_fn,
-                                       cached=repo.cache)
+        ret = repo._checkDecompressMD(compressed_fn, mdtype, db_un_fn,
+                                      data=mydbdata)
         if ret:
             return self._check_uncompressed_db_fn(repo, mdtype, ret)
         return None
@@ -343,12 +750,14 @@ class YumRepository(Repository, config.RepoConf):
         self._oldRepoMDData = {}
         self.cache = 0
         self._retry_no_cache = False
+        self._checksum_meter = None
         self.mirrorlistparsed = 0
         self.yumvar = {} # empty dict of yumvariables for $string replacement
         self._proxy_dict = {}
         self.metadata_cookie_fn = 'cachecookie'
         self._metadataCurrent = None
         self._metalink = None
+        self._staging_live = None # The real cachedir, when we are staging
         self.groups_added = False
         self.http_headers = {}
         self.repo_config_age = 0 # if we're a repo not from a file then the
@@ -362,6 +771,13 @@ class YumRepository(Repository, config.RepoConf):
         self.retrieved = { 'primary':0, 'filelists':0, 'other':0, 'group':0,
                            'updateinfo':0, 'prestodelta':0}
         self._preloaded_repomd = False
+        self._md_chksums = {} # of (filename, chktype) => (chksum, size, mtime)
+        # Files downloaded in parallel by RepoStorage, see _asyncMetalink()
+        self._prefetched_metalink = None # filename, or the URLGrabError
+        self._prefetched_repoXML = None # filename, or the URLGrabError
+        self._prefetched_repoXML_sig = False
+        # Prefetched files that were conditional requests, see _grabIfModified()
+        self._prefetched_conditional = set()
 
         # callbacks
         self.callback = None  # for the grabber
@@ -388,6 +804,8 @@ class YumRepository(Repository, config.RepoConf):
         self._grabfunc = None
         self._grab = None
         self._async = False
+        self._mirror_stats = None
+        self._http_validators = None
 
     def __cmp__(self, other):
         """ Sort yum repos. by cost, and then by alphanumeric on their id. """
@@ -447,6 +865,8 @@ class YumRepository(Repository, config.RepoConf):
     def close(self):
         if self._sack is not None:
             self.sack.close()
+        if self._mirror_stats is not None:
+            self._mirror_stats.save()
         Repository.close(self)
 
     def _resetSack(self):
@@ -609,8 +1029,15 @@ class YumRepository(Repository, config.RepoConf):
         """sets up the grabber functions with the already stocked in urls for
            the mirror groups"""
 
+        mgkwargs = {}
         if self.failovermethod == 'roundrobin':
             mgclass = urlgrabber.mirror.MGRandomOrder
+        elif self.failovermethod == 'fastest':
+            mgclass = mirrorstats.MGFastest
+            if self._mirror_stats is None:
+                fname = self.cachedir + '/mirrorstats.txt'
+                self._mirror_stats = mirrorstats.MirrorStats(fname)
+            mgkwargs['stats'] = self._mirror_stats
         else:
             mgclass = urlgrabber.mirror.MirrorGroup
 
@@ -623,21 +1050,25 @@ class YumRepository(Repository, config.RepoConf):
                                     reget='simple',
                                     **ugopts)
         def add_mc(url):
-            host = urlparse.urlsplit(url).netloc.split('@')[-1]
-            mc = self.metalink_data._host2mc.get(host)
-            if mc:
-                url = {
-                    'mirror': misc.to_utf8(url),
-                    'kwargs': {
-                        'max_connections': mc.max_connections,
-                        'preference': mc.preference,
-                        'private': mc.private,
-                    },
-                }
+            kwargs = {}
+            if self.metalink:
+                host = urlparse.urlsplit(url).netloc.split('@')[-1]
+                mc = self.metalink_data._host2mc.get(host)
+                if mc:
+                    kwargs = {'max_connections': mc.max_connections,
+                              'preference': mc.preference,
+                              'private': mc.private}
+            #  The per. mirror limit is what parallel_wait() uses to spread
+            # the downloads over the mirrors, so cap the metalink one too.
+            hmc = self.max_host_connections
+            if hmc:
+                mc = kwargs.get('max_connections')
+                if not mc or mc > hmc:
+                    kwargs['max_connections'] = hmc
+            if kwargs:
+                url = {'mirror': misc.to_utf8(url), 'kwargs': kwargs}
             return url
-        urls = self.urls
-        if self.metalink:
-            urls = map(add_mc, urls)
+        urls = map(add_mc, self.urls)
 
         def mirror_failure(obj):
             action = {}
@@ -654,6 +1085,10 @@ class YumRepository(Repository, config.RepoConf):
                 # unsupported checksum type, fail now
                 action['fail'] = True
 
+            # Any failure, even a 404 from an out of date mirror, counts.
+            if self._mirror_stats is not None and obj.mirror:
+                self._mirror_stats.failure(obj.mirror)
+
             # No known user of this callback, but just in case...
             cb = self.mirror_failure_obj
             if cb:
@@ -663,7 +1098,7 @@ class YumRepository(Repository, config.RepoConf):
             return action
 
         self._grab = mgclass(self._grabfunc, urls,
-                             failure_callback=mirror_failure)
+                             failure_callback=mirror_failure, **mgkwargs)
 
     def _default_grabopts(self, cache=True):
         opts = { 'keepalive': self.keepalive,
@@ -885,16 +1320,81 @@ class YumRepository(Repository, config.RepoConf):
                     fset=lambda self, value: setattr(self, "_urls", value),
                     fdel=lambda self: setattr(self, "_urls", None))
 
+    def _revalidating(self, url):
+        """ Should url be downloaded with a conditional request. """
+        if not self.http_revalidate:
+            return False
+        return urlparse.urlsplit(url)[0] in ('http', 'https')
+
+    def _getHTTPValidators(self):
+        if self._http_validators is None:
+            fname = self.cachedir + '/validators.txt'
+            self._http_validators = httpvalidators.HTTPValidators(fname)
+        return self._http_validators
+
+    def _revalidateHeaders(self, url, local):
+        """ Return the headers for a conditional request of url, if we have
+            validators for our copy of it in local. """
+        if not self._revalidating(url):
+            return []
+        return self._getHTTPValidators().headers(url, local)
+
+    def _grabIfModified(self, url, tmpname, local, cache=True, **kwargs):
+        """ Download url to tmpname. For http(s) URLs, the ETag/Last-Modified
+            are saved and the next download is a conditional request, which
+            returns None when our copy of the file (local) is current. """
+        ugopts = self._default_grabopts(cache=cache)
+        ug = URLGrabber(progress_obj = self.callback, **ugopts)
+        if not self._revalidating(url):
+            return ug.urlgrab(url, tmpname, **kwargs)
+
+        validators = self._getHTTPValidators()
+        ret = httpvalidators.urlgrab_if_modified(ug, url, tmpname, local,
+                                                 validators, **kwargs)
+        validators.save()
+        return ret
+
+    def _notModifiedPrefetch(self, fname):
+        """ Is the prefetched file the empty result of a conditional request
+            that got a 304, ie. our copy is current. """
+        if fname not in self._prefetched_conditional:
+            return False
+        self._prefetched_conditional.discard(fname)
+        if os.path.getsize(fname):
+            return False
+        misc.unlink_f(fname)
+        return True
+
+    def _parseMetalink(self, filename):
+        """ Parse the metalink file, using the manifest if it's ours. """
+        if (self.repomd_manifest and self.basecachedir and
+            filename == self.cachedir + '/metalink.xml'):
+            return self._parseManifest(filename, metalink.MetaLinkRepoMD,
+                                       metalink.MetaLinkRepoMD,
+                                       metalink.MetaLinkRepoErrorParseFail)
+        return metalink.MetaLinkRepoMD(filename)
+
     def _getMetalink(self):
         if not self._metalink:
             self.metalink_filename = self.cachedir + '/' + 'metalink.xml'
             local = self.metalink_filename + '.tmp'
             if not self._metalinkCurrent():
                 url = misc.to_utf8(self.metalink)
-                ugopts = self._default_grabopts(cache=self.http_caching=='all')
+                prefetched = self._prefetched_metalink
+                self._prefetched_metalink = None
                 try:
-                    ug = URLGrabber(progress_obj = self.callback, **ugopts)
-                    result = ug.urlgrab(url, local, text="%s/metalink" % self.ui_id)
+                    if isinstance(prefetched, URLGrabError):
+                        raise prefetched
+                    if prefetched is None:
+                        cache = self.http_caching == 'all'
+                        result = self._grabIfModified(url, local,
+                                                      self.metalink_filename,
+                                                      cache=cache,
+                                                      text="%s/metalink" % self.ui_id)
+                    elif self._notModifiedPrefetch(prefetched):
+                        result = None
+                    else:
+                        result = prefetched
 
                 except URLGrabError, e:
                     if not os.path.exists(self.metalink_filename):
@@ -906,7 +1406,11 @@ class YumRepository(Repository, config.RepoConf):
                     logger.error("Could not get metalink %s error was\n%s: %s" % (url, e.args[0], misc.to_unicode(e.args[1])))
                     self._metadataCurrent = True
 
-            if not self._metadataCurrent:
+            if not self._metadataCurrent and result is None:
+                #  Not modified, so we have the latest metalink. But leave
+                # checking the repomd.xml against it to _latestRepoXML().
+                self._metalink = self._parseMetalink(self.metalink_filename)
+            elif not self._metadataCurrent:
                 try:
                     self._metalink = metalink.MetaLinkRepoMD(result)
                     shutil.move(result, self.metalink_filename)
@@ -917,7 +1421,7 @@ class YumRepository(Repository, config.RepoConf):
                     misc.unlink_f(result)
 
             if self._metadataCurrent:
-                self._metalink = metalink.MetaLinkRepoMD(self.metalink_filename)
+                self._metalink = self._parseMetalink(self.metalink_filename)
 
         return self._metalink
 
@@ -926,6 +1430,110 @@ class YumRepository(Repository, config.RepoConf):
                                                               value),
                              fdel=lambda self: setattr(self, "_metalink", None))
 
+    #  RepoStorage can setup all the repos. in parallel, by first queueing the
+    # metalink downloads (_asyncMetalink) and then the repomd.xml downloads
+    # (_asyncRepoXML) for all of them, with a parallel_wait() after each.
+    # The downloaded files are then used by _getMetalink() and
+    # _getFileRepoXML() when the repos. are setup one at a time as normal, so
+    # all the checking (and GPG key importing) happens as it always has. If a
+    # prefetched file isn't usable, we just download it again as normal.
+
+    def _asyncMetalink(self):
+        """ Queue the download of the metalink, if _getMetalink() would
+            download it. """
+        self._hack_mirrorlist_for_anaconda()
+        if not self.metalink or self._metalink or self.cache:
+            return
+        self.metalink_filename = self.cachedir + '/' + 'metalink.xml'
+        if self._metalinkCurrent():
+            return
+
+        url = misc.to_utf8(self.metalink)
+        local = self.metalink_filename + '.tmp'
+        headers = self._revalidateHeaders(url, self.metalink_filename)
+        if self._revalidating(url) and not headers:
+            #  We can't get the validators from a prefetch, so let
+            # _getMetalink() download it.
+            return
+
+        def failfunc(obj):
+            self._prefetched_metalink = obj.exception
+        ugopts = self._default_grabopts(cache=self.http_caching=='all')
+        if headers:
+            ugopts['http_headers'] += tuple(headers)
+            self._prefetched_conditional.add(local)
+        ug = URLGrabber(progress_obj = self.callback, **ugopts)
+        host = urlparse.urlsplit(url)[1]
+        self._prefetched_metalink = local
+        ug.urlgrab(url, local, text="%s/metalink" % self.ui_id,
+                   async=(host, None), failfunc=failfunc)
+
+    def _asyncRepoXML(self):
+        """ Queue the download of the repomd.xml (and signature), if
+            _commonLoadRepoXML() would download it. """
+        local = self.cachedir + '/repomd.xml'
+        if self._repoXML is not None or self.mediaid:
+            return
+        if self._cachingRepoXML(local):
+            return
+        if os.path.exists(local):
+            oxml = self._parseRepoXML(local, True)
+            if oxml is not None and self._isLatestRepoXML(oxml):
+                return
+
+        # This is named so that "yum clean metadata" picks it up
+        tfname = tempfile.mktemp(prefix='repomd', suffix="tmp.xml",
+                                 dir=self.cachedir)
+        url = self._repoXMLURL()
+        if url is not None:
+            headers = self._revalidateHeaders(url, local)
+            if not headers:
+                #  We can't get the validators from a prefetch, so let
+                # _getFileRepoXML() download it.
+                return
+            #  A conditional request to the mirror we have the validators
+            # for, if it fails _getFileRepoXML() will try them all.
+            def failfunc(obj):
+                misc.unlink_f(obj.filename)
+                self._prefetched_repoXML = None
+            ugopts = self._default_grabopts(cache=self.http_caching == 'all')
+            ugopts['http_headers'] += tuple(headers)
+            ug = URLGrabber(progress_obj = self.callback, **ugopts)
+            host = urlparse.urlsplit(url)[1]
+            self._prefetched_repoXML = tfname
+            self._prefetched_conditional.add(tfname)
+            ug.urlgrab(url, tfname, text=self.ui_id, size=102400,
+                       async=(host, None), failfunc=failfunc)
+        else:
+            def failfunc(obj):
+                misc.unlink_f(obj.filename)
+                self._prefetched_repoXML = obj.exception
+            self._prefetched_repoXML = tfname
+            self._getFile(relative=self.repoMDFile, local=tfname,
+                          copy_local=1, text=self.ui_id, reget=None,
+                          cache=self.http_caching == 'all', size=102400,
+                          async=True, failfunc=failfunc)
+
+        if self.repo_gpgcheck and not self._override_sigchecks:
+            def failfunc(obj):
+                self._prefetched_repoXML_sig = False
+            self._prefetched_repoXML_sig = True
+            self._getFile(relative='repodata/repomd.xml.asc',
+                          local=self.cachedir + '/repomd.xml.asc',
+                          copy_local=1, text='%s/signature' % self.ui_id,
+                          reget=None, cache=self.http_caching == 'all',
+                          size=102400, async=True, failfunc=failfunc)
+
+    def _asyncDone(self):
+        """ Cleanup anything prefetched that wasn't used. """
+        for fname in (self._prefetched_repoXML, self._prefetched_metalink):
+            if isinstance(fname, basestring):
+                misc.unlink_f(fname)
+        self._prefetched_repoXML = None
+        self._prefetched_repoXML_sig = False
+        self._prefetched_metalink = None
+        self._prefetched_conditional.clear()
+
     def _all_urls_are_files(self, url):
         if url:
             return url.startswith("/") or url.startswith("file:")
@@ -994,9 +1602,13 @@ Insufficient space in download directory %s
     * needed %s'''
                 ) % (os.path.dirname(local), format_number(avail), format_number(long(size))), repo=self)
 
+        progress_obj = self.callback
+        if self._checksum_meter is not None:
+            progress_obj = self._checksum_meter
+
         if url and scheme != "media":
             ugopts = self._default_grabopts(cache=cache)
-            ug = URLGrabber(progress_obj = self.callback,
+            ug = URLGrabber(progress_obj = progress_obj,
                             copy_local = copy_local,
                             reget = reget,
                             failure_callback = self.failure_obj,
@@ -1030,6 +1642,7 @@ Insufficient space in download directory %s
                                            http_headers=headers,
                                            size=size,
                                            retry_no_cache=self._retry_no_cache,
+                                           progress_obj=progress_obj,
                                            **kwargs
                                            )
             except URLGrabError, e:
@@ -1061,27 +1674,93 @@ Insufficient space in download directory %s
         # break backward compatibility with plugins that override _getFile()
         # (BZ 1360532).
         self._retry_no_cache = self.http_caching == 'lazy:packages'
+        #  Checksum the package as it downloads, verifyLocalPkg() uses that
+        # instead of reading it all again.
+        #  Async downloads happen in urlgrabber's downloader process, and
+        # parallel_wait() gives us the progress, and then runs checkfunc, so
+        # the meter stays with the package until then. Without a multi file
+        # meter parallel_wait() only tells self.callback about finished
+        # files, which we'd lose, so those are still read after.
+        ranges = None
+        use_meter = True
+        if kwargs.get('async'):
+            ranges = self._segmentRanges(package)
+            use_meter = (not ranges and (self.multi_callback is not None or
+                                         self.callback is None))
+        if use_meter:
+            self._checksum_meter = _ChecksumMeter(self.callback, local,
+                                                  package.returnIdSum()[0])
+            package._checksum_meter = self._checksum_meter
+        if kwargs.get('async') and use_meter:
+            meter = self._checksum_meter
+            kwargs['multi_progress_obj'] = _ChecksumMultiMeter(
+                                                 self.multi_callback, meter)
+            def _done():
+                meter.close()
+                if package._checksum_meter is meter:
+                    package._checksum_meter = None
+            orig_checkfunc = checkfunc
+            def checkfunc(obj):
+                urlgrabber.grabber._run_callback(orig_checkfunc, obj)
+                _done()
+            failfunc = kwargs.get('failfunc')
+            def _failfunc(obj):
+                _done()
+                if failfunc is None:
+                    raise obj.exception
+                urlgrabber.grabber._run_callback(failfunc, obj)
+            kwargs['failfunc'] = _failfunc
+        queued = False
         try:
-            ret = self._getFile(url=basepath,
-                            relative=remote,
-                            local=local,
-                            checkfunc=checkfunc,
-                            text=text,
-                            cache=cache,
-                            size=package.size,
-                            **kwargs
-                            )
+            if ranges:
+                if text is None:
+                    text = os.path.basename(remote)
+                dl = _SegmentedDownload(self, package, ranges, checkfunc,
+                                        text, cache, kwargs)
+                ret = dl.start()
+            else:
+                ret = self._getFile(url=basepath,
+                                relative=remote,
+                                local=local,
+                                checkfunc=checkfunc,
+                                text=text,
+                                cache=cache,
+                                size=package.size,
+                                **kwargs
+                                )
+            queued = kwargs.get('async')
+
+            if not queued and not package.verifyLocalPkg():
+                # Don't return as "success" when bad.
+                msg = "Downloaded package %s, from %s, but it was invalid."
+                msg = msg % (package, package.repo.id)
+                raise Errors.RepoError(msg, repo=self)
         finally:
             self._retry_no_cache = False
-
-        if not kwargs.get('async') and not package.verifyLocalPkg():
-            # Don't return as "success" when bad.
-            msg = "Downloaded package %s, from %s, but it was invalid."
-            msg = msg % (package, package.repo.id)
-            raise Errors.RepoError(msg, repo=self)
+            if self._checksum_meter is not None:
+                if not queued:
+                    self._checksum_meter.close()
+                    package._checksum_meter = None
+                self._checksum_meter = None
 
         return ret
 
+    def _segmentRanges(self, package):
+        """ Return the byte ranges to download the package in, from several
+            mirrors at once, or None if it should be downloaded whole. """
+        segsize = self.download_segment_size
+        if not segsize or getattr(package, '_no_segments', False):
+            return None
+        if package.basepath or self.cache or self.mediaid:
+            return None
+        if len(self.urls) < 2 or self._all_urls_are_files(None):
+            return None
+        size = package.size
+        if not size or size < 2 * segsize:
+            return None
+        num = size / segsize
+        return [(size * i / num, size * (i + 1) / num) for i in range(num)]
+
     def getHeader(self, package, checkfunc = None, reget = 'simple',
             cache = True):
 
@@ -1180,6 +1859,9 @@ Insufficient space in download directory %s
 
         if expire_req_filter and self._matchExpireFilter():
             expiration_time = -1
+        # Refreshed by. "yum makecache", via. a staging dir, see _stageSetup()
+        if self.metadata_refresh == 'background' and not self._staging_live:
+            expiration_time = -1
 
         # -1 is special and should never get refreshed
         if expiration_time == -1 and os.path.exists(myfile):
@@ -1215,6 +1897,126 @@ Insufficient space in download directory %s
             fo.close()
             del fo
 
+    #  Staging is used to refresh the metadata in the background: the repo. is
+    # pointed at a staging dir inside its cachedir, which starts with a copy
+    # of our state files and hardlinks to the metadata. New metadata is then
+    # downloaded, decompressed etc. there as normal, and when it's all done
+    # it's moved into the real cachedir (with the yum lock held). Everything
+    # that writes to gen/ does so via. a .tmp file and a rename, as do the
+    # downloads of the metadata files which aren't valid (and so aren't
+    # linked), so nothing written in the staging dir changes what yum is
+    # using.
+
+    def _stageLink(self, src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    def _stageSetup(self):
+        """ Point the repo. at a new staging dir, inside its cachedir, so
+            that it is refreshed there. """
+        if self._staging_live:
+            return
+        if self._repoXML is not None:
+            raise Errors.RepoError("Can't stage metadata for %s, it's already"
+                                   " loaded" % self.ui_id, repo=self)
+        live = self.cachedir
+        stage = live + '/staging'
+        try:
+            if os.path.exists(stage):
+                shutil.rmtree(stage)
+            self._dirSetupMkdir_p(stage + '/gen')
+
+            for fname in _staged_state_files + (self.metadata_cookie_fn,):
+                if os.path.exists(live + '/' + fname):
+                    shutil.copy2(live + '/' + fname, stage + '/' + fname)
+
+            #  Only link the metadata files which are valid, as if one needs
+            # to be downloaded it's written to in place.
+            repomd = None
+            if os.path.exists(live + '/repomd.xml'):
+                repomd = self._parseRepoXML(live + '/repomd.xml', True)
+            if repomd is not None:
+                for (mdtype, data) in repomd.repoData.items():
+                    fname = os.path.basename(data.location[1])
+                    if self._checkMD(live + '/' + fname, mdtype, data=data,
+                                     check_can_fail=True):
+                        self._stageLink(live + '/' + fname, stage + '/' + fname)
+
+            for fname in os.listdir(live + '/gen'):
+                if fname.endswith('.tmp'):
+                    continue
+                if fname.endswith('.xml.sqlite'):
+                    # sqlitecachec updates these in place.
+                    shutil.copy2(live + '/gen/' + fname,
+                                 stage + '/gen/' + fname)
+                else:
+                    self._stageLink(live + '/gen/' + fname,
+                                    stage + '/gen/' + fname)
+        except (EnvironmentError, Errors.RepoError), e:
+            shutil.rmtree(stage, ignore_errors=True)
+            raise Errors.RepoError("Can't stage metadata for %s: %s" %
+                                   (self.ui_id, misc.to_unicode(str(e))),
+                                   repo=self)
+
+        self.setAttribute('_dir_setup_cachedir', stage)
+        self.setAttribute('_dir_setup_metadata_cookie',
+                          stage + '/' + self.metadata_cookie_fn)
+        self._metadataCurrent = None
+        self._staging_live = live
+
+    def _stageCommit(self):
+        """ Move the staged metadata into the real cachedir, gen/ first then
+            the metadata and lastly the state files. Any old metadata that
+            isn't used now is removed. Needs the yum lock. """
+        if not self._staging_live:
+            return
+        live = self._staging_live
+        stage = self.cachedir
+
+        old = []
+        orepomd = None
+        if os.path.exists(live + '/repomd.xml'):
+            orepomd = self._parseRepoXML(live + '/repomd.xml', True)
+        if orepomd is not None:
+            old = [os.path.basename(data.location[1])
+                   for data in orepomd.repoData.values()]
+
+        state = _staged_state_files + (self.metadata_cookie_fn,)
+        gen = [fname for fname in os.listdir(stage + '/gen')
+               if not fname.endswith('.tmp')]
+        data = [fname for fname in os.listdir(stage)
+                if fname not in state and not fname.endswith('.tmp') and
+                os.path.isfile(stage + '/' + fname)]
+        for fname in gen:
+            os.rename(stage + '/gen/' + fname, live + '/gen/' + fname)
+        for fname in data:
+            os.rename(stage + '/' + fname, live + '/' + fname)
+        for fname in state:
+            if os.path.exists(stage + '/' + fname):
+                os.rename(stage + '/' + fname, live + '/' + fname)
+
+        for fname in os.listdir(live + '/gen'):
+            if fname not in gen and not fname.endswith('.tmp'):
+                misc.unlink_f(live + '/gen/' + fname)
+        for fname in old:
+            if fname not in data and fname not in state:
+                misc.unlink_f(live + '/' + fname)
+
+    def _stageClose(self):
+        """ Point the repo. back at the real cachedir, and remove the
+            staging dir. """
+        if not self._staging_live:
+            return
+        stage = self.cachedir
+        live = self._staging_live
+        self.setAttribute('_dir_setup_cachedir', live)
+        self.setAttribute('_dir_setup_metadata_cookie',
+                          live + '/' + self.metadata_cookie_fn)
+        self._staging_live = None
+        shutil.rmtree(stage, ignore_errors=True)
+
     def setup(self, cache, mediafunc = None, gpg_import_func=None, confirm_func=None, gpgca_import_func=None):
         try:
             self.cache = cache
@@ -1238,6 +2040,31 @@ Insufficient space in download directory %s
             return True
         return False
 
+    def _checkPrefetchedRepoXML(self, local):
+        """ Return the repomd.xml file downloaded by _asyncRepoXML(), if
+            there is one and it passes _checkRepoXML(), or local if it was
+            not modified. If the download failed, raise the error _getFile()
+            would have. """
+        result = self._prefetched_repoXML
+        self._prefetched_repoXML = None
+        if result is None:
+            return None
+        if isinstance(result, URLGrabError):
+            # Same as _getFile() failing.
+            errstr = "failure: %s from %s: %s" % (self.repoMDFile, self, result)
+            errors = getattr(result, 'errors', None)
+            raise Errors.NoMoreMirrorsRepoError(errstr, errors, repo=self)
+        if self._notModifiedPrefetch(result):
+            return local
+        try:
+            self._checkRepoXML(result)
+        except URLGrabError, e:
+            verbose_logger.log(logginglevels.DEBUG_2,
+                               "Downloading repomd.xml again: %s" % e)
+            misc.unlink_f(result)
+            return None
+        return result
+
     def _getFileRepoXML(self, local, text=None, grab_can_fail=None):
         """ Call _getFile() for the repomd.xml file. """
         checkfunc = (self._checkRepoXML, (), {})
@@ -1245,17 +2072,26 @@ Insufficient space in download directory %s
             grab_can_fail = 'old_repo_XML' in self._oldRepoMDData
         tfname = ''
         try:
-            # This is named so that "yum clean metadata" picks it up
-            tfname = tempfile.mktemp(prefix='repomd', suffix="tmp.xml",
-                                     dir=os.path.dirname(local))
-            result = self._getFile(relative=self.repoMDFile,
-                                   local=tfname,
-                                   copy_local=1,
-                                   text=text,
-                                   reget=None,
-                                   checkfunc=checkfunc,
-                                   cache=self.http_caching == 'all',
-                                   size=102400) # setting max size as 100K
+            result = self._checkPrefetchedRepoXML(local)
+            if result is None:
+                result = self._revalidateRepoXML(local, text)
+            if result == local: # Not modified
+                result = self._checkNotModifiedRepoXML(local)
+            if result == local:
+                return local
+            tfname = result
+            if result is None:
+                # This is named so that "yum clean metadata" picks it up
+                tfname = tempfile.mktemp(prefix='repomd', suffix="tmp.xml",
+                                         dir=os.path.dirname(local))
+                result = self._getFile(relative=self.repoMDFile,
+                                       local=tfname,
+                                       copy_local=1,
+                                       text=text,
+                                       reget=None,
+                                       checkfunc=checkfunc,
+                                       cache=self.http_caching == 'all',
+                                       size=102400) # setting max size as 100K
 
         except URLGrabError, e:
             misc.unlink_f(tfname)
@@ -1282,9 +2118,89 @@ Insufficient space in download directory %s
                                    repo=self)
         return local
 
+    def _checkNotModifiedRepoXML(self, local):
+        """ Our repomd.xml is the same as the first mirror's. With a metalink
+            we only get here when it doesn't match, so check it again and
+            return None if _getFile() should try all the mirrors. """
+        if not self.metalink:
+            return local
+        try:
+            self._checkRepoXML(local)
+        except URLGrabError, e:
+            verbose_logger.log(logginglevels.DEBUG_2,
+                               "Downloading repomd.xml from all mirrors: %s" % e)
+            return None
+        return local
+
+    def _repoXMLURL(self):
+        """ Return the URL of the repomd.xml on the mirror _getFile() would
+            try first, if it can be downloaded with a conditional request. """
+        if self.mediaid or not self.grab.mirrors:
+            return None
+        url = self.grab.mirrors[0]['mirror']
+        if not url.endswith('/'):
+            url += '/'
+        url += self.repoMDFile
+        if not self._revalidating(url):
+            return None
+        return url
+
+    def _revalidateRepoXML(self, local, text=None):
+        """ Download the repomd.xml from the first mirror with a conditional
+            request. Returns local if it's current, the downloaded file if it
+            passes _checkRepoXML(), or None if _getFile() should be used. """
+        url = self._repoXMLURL()
+        if url is None:
+            return None
+        # This is named so that "yum clean metadata" picks it up
+        tfname = tempfile.mktemp(prefix='repomd', suffix="tmp.xml",
+                                 dir=os.path.dirname(local))
+        try:
+            result = self._grabIfModified(url, tfname, local, text=text,
+                                          cache=self.http_caching == 'all',
+                                          size=102400)
+            if result is None:
+                return local
+            self._checkRepoXML(result)
+        except URLGrabError, e:
+            verbose_logger.log(logginglevels.DEBUG_2,
+                               "Downloading repomd.xml from all mirrors: %s" % e)
+            misc.unlink_f(tfname)
+            return None
+        return result
+
+    def _parseManifest(self, local, new, parse, error):
+        """ Parse the repomd.xml or metalink.xml file, using the manifest of
+            parsed files in the base cachedir when it hasn't changed. new()
+            returns an object to load from the manifest, parse() parses the
+            file, and error is the exception for damaged data. """
+        filename = self.basecachedir + '/repomd.manifest'
+        manifest = _repomd_manifest_load(filename)
+        key = _repomd_manifest_key(local)
+        if key is not None and local in manifest and manifest[local][0] == key:
+            ret = new()
+            try:
+                ret.parse_manifest(manifest[local][1])
+                return ret
+            except error:
+                pass
+
+        ret = parse(local)
+        data = ret.dump_manifest()
+        if (key is not None and data is not None and
+            os.access(self.basecachedir, os.W_OK)):
+            _repomd_manifest_add(filename, local, key, data)
+        return ret
+
     def _parseRepoXML(self, local, parse_can_fail=None):
         """ Parse the repomd.xml file. """
         try:
+            if (self.repomd_manifest and self.basecachedir and
+                local == self.cachedir + '/repomd.xml'):
+                return self._parseManifest(local,
+                                           lambda: repoMDObject.RepoMD(self.id),
+                                           lambda fname: repoMDObject.RepoMD(self.id, fname),
+                                           Errors.RepoMDError)
             return repoMDObject.RepoMD(self.id, local)
         except Errors.RepoMDError, e:
             if parse_can_fail is None:
@@ -1449,7 +2365,11 @@ Insufficient space in download directory %s
         oxml = self._saveOldRepoXML(local)
         if not oxml: # No old repomd.xml data
             return False
+        return self._isLatestRepoXML(oxml)
 
+    def _isLatestRepoXML(self, oxml):
+        """ Check to see if the repomd.xml data is the latest available given
+            the metalink data. """
         self._hack_mirrorlist_for_anaconda()
         if not self.metalink: # Nothing to check it against
             return False
@@ -1643,10 +2563,101 @@ Insufficient space in download directory %s
             # No old repomd data, but we might still have uncompressed MD
             if self._groupCheckDataMDValid(ndata, nmdtype, mdtype):
                 continue
+            # Already updated with a delta, or we can do that now.
+            if self._deltaMDValid(ndata, nmdtype):
+                continue
+            if old_repo_XML and self._retrieveDeltaMD(odata, ndata, nmdtype):
+                continue
             downloading.append((ndata, nmdtype))
             newmdfiles.append(self._get_mdtype_fname(ndata, False))
         return downloading
 
+    def _deltaMDValid(self, data, dbmdtype):
+        """ If our gen/ copy of the dbmdtype DB was made by applying a delta,
+            and is the version for data, return its filename. """
+        fname = self.cachedir + '/gen/' + dbmdtype + '.sqlite'
+        try:
+            info = open(fname + '.delta').read().split()
+        except (IOError, OSError):
+            return None
+        st = misc.stat_f(fname)
+        if st is None:
+            return None
+        if info != [str(data.checksum[0]), str(data.checksum[1]),
+                    str(st.st_size), str(int(st.st_mtime))]:
+            return None
+        return fname
+
+    def _retrieveDeltaMD(self, odata, ndata, dbmdtype):
+        """ Try to update our gen/ copy of the dbmdtype DB from odata to ndata,
+            using a delta listed in ndata. Returns True if that worked, on any
+            problem we return False and the whole DB is downloaded. """
+        if (not self.metadata_deltas or odata is None or ndata is None or
+            not ndata.deltas or odata.timestamp is None or
+            not dbmdtype.endswith('_db')):
+            return False
+        delta = ndata.getDelta(odata.timestamp)
+        if delta is None:
+            return False
+
+        #  Make sure what we have is the DB for odata, either from the real
+        # thing or a delta.
+        fname = self.cachedir + '/gen/' + dbmdtype + '.sqlite'
+        if not self._deltaMDValid(odata, dbmdtype):
+            if not os.path.exists(fname):
+                return False
+            if not self._checkMD(fname, dbmdtype, openchecksum=True,
+                                 data=odata, check_can_fail=True):
+                return False
+
+        (r_base, remote) = delta.location
+        local = self.cachedir + '/' + os.path.basename(remote)
+        def checkfunc(obj):
+            try:
+                self._checkMD(obj, dbmdtype, data=delta)
+            except URLGrabError:
+                misc.unlink_f(obj.filename)
+                raise
+        delta_fn = None
+        try:
+            try:
+                local = self._getFile(relative=remote,
+                                      local=local,
+                                      copy_local=1,
+                                      reget=None,
+                                      checkfunc=checkfunc,
+                                      text="%s/%s delta" % (self.ui_id,
+                                                            dbmdtype),
+                                      cache=self.http_caching == 'all',
+                                      size=delta.size)
+                delta_fn = misc.repo_gen_decompress(local,
+                                                    dbmdtype + '-delta.sqlite',
+                                                    cached=self.cache)
+                if not delta_fn:
+                    return False
+                mddelta.apply(fname, delta_fn, fname + '.delta.tmp')
+            except (Errors.RepoError, Errors.MiscError, URLGrabError,
+                    EnvironmentError), e:
+                verbose_logger.debug("Metadata delta for %s/%s failed: %s" %
+                                     (self.ui_id, dbmdtype, e))
+                return False
+        finally:
+            misc.unlink_f(local)
+            if delta_fn:
+                misc.unlink_f(delta_fn)
+
+        os.rename(fname + '.delta.tmp', fname)
+        st = os.stat(fname)
+        fo = open(fname + '.delta.tmp', 'w')
+        fo.write("%s %s %d %d\n" % (ndata.checksum[0], ndata.checksum[1],
+                                   st.st_size, int(st.st_mtime)))
+        fo.close()
+        os.rename(fname + '.delta.tmp', fname + '.delta')
+        verbose_logger.log(logginglevels.DEBUG_2,
+                           "Updated %s/%s using a delta" % (self.ui_id,
+                                                           dbmdtype))
+        return True
+
     def _commonRetrieveDataMD_done(self, downloading):
         """ Uncompress the downloaded metadata """
 
@@ -1715,15 +2726,20 @@ Insufficient space in download directory %s
         if self.repo_gpgcheck and not self._override_sigchecks:
 
             sigfile = self.cachedir + '/repomd.xml.asc'
+            prefetched = self._prefetched_repoXML_sig
+            self._prefetched_repoXML_sig = False
             try:
-                result = self._getFile(relative='repodata/repomd.xml.asc',
-                                       copy_local=1,
-                                       local = sigfile,
-                                       text='%s/signature' % self.ui_id,
-                                       reget=None,
-                                       checkfunc=None,
-                                       cache=self.http_caching == 'all',
-                                       size=102400)
+                if prefetched and os.path.exists(sigfile):
+                    result = sigfile
+                else:
+                    result = self._getFile(relative='repodata/repomd.xml.asc',
+                                           copy_local=1,
+                                           local = sigfile,
+                                           text='%s/signature' % self.ui_id,
+                                           reget=None,
+                                           checkfunc=None,
+                                           cache=self.http_caching == 'all',
+                                           size=102400)
             except URLGrabError, e:
                 raise URLGrabError(-1, 'Error finding signature for repomd.xml for %s: %s' % (self, e))
             valid = misc.valid_detached_sig(result, filepath, self.gpgdir)
@@ -1788,7 +2804,7 @@ Insufficient space in download directory %s
         if size is not None:
             size = int(size)
 
-        l_csum = _xattr_get_chksum(file, r_ctype)
+        l_csum = self._getChksum(file, r_ctype)
         if l_csum:
             fsize = misc.stat_f(file)
             if fsize is not None: # We just got an xattr, so it should be there
@@ -1810,7 +2826,7 @@ Insufficient space in download directory %s
             raise URLGrabError(-3, 'Error performing checksum: %s' % e)
 
         if l_csum == r_csum:
-            _xattr_set_chksum(file, r_ctype, l_csum)
+            self._setChksum(file, r_ctype, l_csum)
             if not openchecksum:
                 self._preload_to_cashe(r_ctype, r_csum, file)
             return 1
@@ -1819,14 +2835,90 @@ Insufficient space in download directory %s
                 return None
             raise URLGrabError(-1, 'Metadata file does not match checksum')
 
+    def _getChksum(self, filename, chktype):
+        """ Return the checksum of filename, if we already know it. Either from
+            the xattr, or because we've done it in this process. """
+        ret = _xattr_get_chksum(filename, chktype)
+        if ret:
+            return ret
+        data = self._md_chksums.get((filename, chktype))
+        if data is None:
+            return None
+        st = misc.stat_f(filename)
+        if st is None or (st.st_size, int(st.st_mtime)) != data[1:]:
+            return None
+        return data[0]
+
+    def _setChksum(self, filename, chktype, chksum):
+        """ Remember the checksum of filename, for _getChksum(). """
+        _xattr_set_chksum(filename, chktype, chksum)
+        st = misc.stat_f(filename)
+        if st is not None:
+            self._md_chksums[(filename, chktype)] = (chksum, st.st_size,
+                                                     int(st.st_mtime))
+
+    def _checkDecompressMD(self, fn, mdtype, generated_name, data=None):
+        """ Decompress the MD file fn into gen/generated_name, checking the
+            checksum of fn and the open checksum of the result in the same
+            pass over the data. Returns the decompressed file name, or None if
+            fn doesn't match the checksum. """
+        thisdata = data
+        if thisdata is None:
+            thisdata = self.repoXML.getData(mdtype)
+        (r_ctype, r_csum) = thisdata.checksum
+        (o_ctype, o_csum) = thisdata.openchecksum
+
+        out = None
+        try:
+            in_sums = misc.Checksums([r_ctype])
+            out_sums = misc.Checksums([o_ctype], ignore_missing=True,
+                                      ignore_none=True)
+            out = misc.repo_gen_decompress(fn, generated_name,
+                                           cached=self.cache,
+                                           in_sums=in_sums, out_sums=out_sums)
+        except Errors.MiscError:
+            #  Something we can't do in one pass (Eg. junk at the end), or
+            # the file is missing ... do it the normal way, which will fail
+            # with the right error.
+            in_sums = None
+
+        if in_sums is None or not in_sums.length:
+            # Already decompressed (or we can't), so just check it.
+            if not self._checkMD(fn, mdtype, data=thisdata,
+                                 check_can_fail=True):
+                return None
+            if out is None:
+                out = misc.repo_gen_decompress(fn, generated_name,
+                                               cached=self.cache)
+            return out
+
+        size = thisdata.size
+        if (in_sums.hexdigest(r_ctype) != r_csum or
+            (size is not None and int(size) != in_sums.length)):
+            misc.unlink_f(out)
+            return None
+        self._setChksum(fn, r_ctype, r_csum)
+        self._preload_to_cashe(r_ctype, r_csum, fn)
+
+        #  If the open checksum is bad we don't remember anything, and
+        # checkMD(openchecksum=True) will find it.
+        size = thisdata.opensize
+        if (o_ctype and out_sums.hexdigest(o_ctype) == o_csum and
+            (size is None or int(size) == out_sums.length)):
+            self._setChksum(out, o_ctype, o_csum)
+        return out
+
     def retrieveMD(self, mdtype):
         """base function to retrieve metadata files from the remote url
            returns the path to the local metadata file of a 'mdtype'
            mdtype can be 'primary', 'filelists', 'other' or 'group'."""
         return self._retrieveMD(mdtype)
 
-    def _retrieveMD(self, mdtype, retrieve_can_fail=False, **kwargs):
-        """ Internal function, use .retrieveMD() from outside yum. """
+    def _retrieveMD(self, mdtype, retrieve_can_fail=False, gen_name=None,
+                    **kwargs):
+        """ Internal function, use .retrieveMD() from outside yum. If gen_name
+            is given, a downloaded file is decompressed into gen/gen_name
+            while it is checked. """
         #  Note that this can raise Errors.RepoMDError if mdtype doesn't exist
         # for this repo.
         # FIXME - maybe retrieveMD should call decompress() after we've checked
@@ -1880,7 +2972,11 @@ Insufficient space in download directory %s
         try:
             def checkfunc(obj):
                 try:
-                    self.checkMD(obj, mdtype)
+                    if gen_name is None:
+                        self.checkMD(obj, mdtype)
+                    elif not self._checkDecompressMD(obj.filename, mdtype,
+                                                     gen_name, data=thisdata):
+                        raise URLGrabError(-1, 'Metadata file does not match checksum')
                 except URLGrabError:
                     #  Don't share MD among mirrors, in theory we could use:
                     #     self._del_dl_file(local, int(thisdata.size))
@@ -1997,11 +3093,10 @@ Insufficient space in download directory %s
         fo = None
 
         cacheok = False
+        tmpname = None
         if self.withinCacheAge(self.mirrorlist_file, self.mirrorlist_expire,
                                expire_req_filter=False):
             cacheok = True
-            fo = open(self.mirrorlist_file, 'r')
-            url = 'file://' + self.mirrorlist_file # just to keep self._readMirrorList(fo,url) happy
         else:
             url = self.mirrorlist
             scheme = urlparse.urlparse(url)[0]
@@ -2009,12 +3104,28 @@ Insufficient space in download directory %s
                 url = 'file://' + url
             ugopts = self._default_grabopts()
             try:
-                fo = urlgrabber.grabber.urlopen(url, **ugopts)
+                if self._revalidating(url) and not self.cache:
+                    tmpname = self.mirrorlist_file + '.tmp'
+                    if self._grabIfModified(url, tmpname, self.mirrorlist_file,
+                                            progress_obj=None) is None:
+                        # Not modified, so the one we have is good for longer
+                        os.utime(self.mirrorlist_file, None)
+                        cacheok = True
+                    else:
+                        fo = open(tmpname, 'r')
+                else:
+                    fo = urlgrabber.grabber.urlopen(url, **ugopts)
             except URLGrabError, e:
                 logger.error("Could not retrieve mirrorlist %s error was\n%s: %s" % (url, e.args[0], misc.to_unicode(e.args[1])))
                 fo = None
 
+        if cacheok:
+            fo = open(self.mirrorlist_file, 'r')
+            url = 'file://' + self.mirrorlist_file # just to keep self._readMirrorList(fo,url) happy
+
         (returnlist, content) = self._readMirrorList(fo, url)
+        if tmpname is not None:
+            misc.unlink_f(tmpname)
 
         if returnlist:
             if not self.cache and not cacheok:
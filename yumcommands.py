@@ -1387,11 +1387,17 @@ class MakeCacheCommand(YumCommand):
         base.logger.debug(_("This may take a while depending on the speed of this computer"))
 
         # Fast == don't download any extra MD
-        fast = False
-        if extcmds and extcmds[0] == 'fast':
-            fast = True
+        fast = 'fast' in extcmds
+        #  Staged == download and setup everything in staging dirs, without
+        # the yum lock, then move it into the cache.
+        staged = 'staged' in extcmds or base.stageMetadataNeeded()
+        staged = staged and not base.conf.cache
 
-        if True: # Try, YumBase...
+        if staged:
+            base.stageMetadata()
+            base.doUnlock()
+
+        try:
             for repo in base.repos.sort():
                 repo.metadata_expire = 0
                 if not fast:
@@ -1425,6 +1431,14 @@ class MakeCacheCommand(YumCommand):
                     misc.repo_gen_decompress(repo.retrieveMD(MD),
                                              fname_map[MD],
                                              cached=repo.cache)
+                if hasattr(repo.sack, 'buildIndexes'):
+                    repo.sack.buildIndexes(repo)
+
+            if staged:
+                base.waitForLock()
+                base.commitStagedMetadata()
+        finally:
+            base.closeStagedMetadata()
 
         return 0, [_('Metadata Cache Created')]
 